@@ -0,0 +1,54 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import compiler
+from bench_tokenize import best_of
+from generate import generate_document
+
+def main():
+    parser = argparse.ArgumentParser(description='Attribute parsing throughput of parse_attributes against the character loop.')
+    parser.add_argument('-n', '--nodes', type=int, default=5000, help='Elements of the generated document')
+    parser.add_argument('--attributes', type=float, default=4.0, help='Average plain attributes per element')
+    parser.add_argument('--styles', type=float, default=0.8, help='Share of elements with an inline style')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Runs per measurement, best time is reported')
+    args = parser.parse_args()
+
+    document = generate_document(args.nodes, attribute_density=args.attributes, styles=args.styles, classes=0.5)
+    tokens = compiler.Parser(document).tokenize()
+    bodies = [token.value for token in tokens if token.type == compiler.TokenType.ATTRIBUTE]
+    size = sum(len(body) for body in bodies)
+    pairs = sum(len(compiler.Compiler.parse_attributes(body)) for body in bodies)
+    print(f"{len(bodies)} attribute groups, {pairs} pairs, {size / 1e6:.2f} MB of attribute text")
+
+    loop = compiler.Compiler.parse_attributes_loop
+    fast = compiler.Compiler.parse_attributes
+    timings = {
+        "loop": best_of(lambda: [loop(body) for body in bodies], args.repeat),
+        "bulk": best_of(lambda: [fast(body, {}) for body in bodies], args.repeat),
+    }
+    for name, seconds in timings.items():
+        print(f"  {name:<14}{seconds * 1000:8.1f} ms  {pairs / seconds / 1e6:6.2f} M pairs/s  {size / seconds / 1e6:6.1f} MB/s")
+
+    # Whole Compiler.compile with each parser
+    compile_fast = best_of(lambda: compiler.Compiler(tokens).compile(), args.repeat)
+    compiler.Compiler.parse_attributes = staticmethod(lambda text, strings=None: loop(text))
+    try:
+        compile_loop = best_of(lambda: compiler.Compiler(tokens).compile(), args.repeat)
+    finally:
+        compiler.Compiler.parse_attributes = staticmethod(fast)
+    print(f"compile: {compile_loop * 1000:.1f} ms with the loop, {compile_fast * 1000:.1f} ms bulk")
+
+    root = compiler.Compiler(tokens).compile()
+    values = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        values.extend(node.attributes.values())
+        stack.extend(node.children)
+    print(f"{len(values)} attribute values in the tree, {len({id(value) for value in values})} distinct objects")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import batch, compiler
+from bench_tokenize import best_of
+from generate import generate_document
+
+def main():
+    parser = argparse.ArgumentParser(description='Snippets/s of compile_many against the Parser/Compiler/compile_to_html loop.')
+    parser.add_argument('-n', '--snippets', type=int, default=5000, help='Number of snippets')
+    parser.add_argument('-e', '--elements', type=int, default=4, help='Most elements per snippet (1 to this many)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='Workers of the thread and process pools')
+    parser.add_argument('-c', '--chunk-sizes', type=str, default='16,256,1024', help='Comma-separated chunk sizes for the pools')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Runs per measurement, best time is reported')
+    args = parser.parse_args()
+    translation, styles = compiler.translation, compiler.styles
+
+    rng = random.Random(0)
+    snippets = [generate_document(nodes=rng.randint(1, args.elements), seed=n) for n in range(args.snippets)]
+    print(f"{args.snippets} snippets, {sum(map(len, snippets)) / args.snippets:.0f} characters on average, "
+          f"{args.jobs} workers")
+
+    def loop():
+        return [compiler.Compiler.compile_to_html(compiler.Compiler(compiler.Parser(source).tokenize()).compile(),
+                                                  translation, styles) for source in snippets]
+    assert batch.compile_many(snippets, translation, styles) == loop()
+
+    def report(name, seconds):
+        print(f"  {name:<28}{seconds * 1000:8.1f} ms  {args.snippets / seconds:10.0f} snippets/s")
+    # Alternated, so load on the machine affects both the same way
+    timings = {"loop": [], "compile_many": []}
+    for _ in range(args.repeat):
+        timings["loop"].append(best_of(loop, 1))
+        timings["compile_many"].append(best_of(lambda: batch.compile_many(snippets, translation, styles), 1))
+    for name, runs in timings.items():
+        report(name, min(runs))
+    for label, pool in (("threads", ThreadPoolExecutor), ("processes", ProcessPoolExecutor)):
+        with pool(max_workers=args.jobs) as executor:
+            batch.compile_many(snippets[:args.jobs], translation, styles, executor=executor, chunk_size=1)  # start workers
+            for chunk_size in map(int, args.chunk_sizes.split(',')):
+                report(f"compile_many, {label} {chunk_size}", best_of(
+                    lambda: batch.compile_many(snippets, translation, styles, executor=executor, chunk_size=chunk_size),
+                    args.repeat))
+
+if __name__ == "__main__":
+    main()
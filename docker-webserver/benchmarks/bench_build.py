@@ -0,0 +1,50 @@
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import parse
+from bench_tokenize import build_document
+
+def write_site(directory: str, pages: int, sections: int):
+    # Page sizes vary so that scheduling the largest pages first matters
+    for n in range(pages):
+        with open(os.path.join(directory, f"page{n}.mhtml"), "w") as f:
+            f.write(build_document(sections * (1 + n % 8)))
+
+def main():
+    parser = argparse.ArgumentParser(description='Time a full parse.py build with 1, 2, 4 and 8 processes.')
+    parser.add_argument('-p', '--pages', type=int, default=32, help='Number of pages in the site')
+    parser.add_argument('-s', '--sections', type=int, default=50, help='Sections in the smallest page')
+    parser.add_argument('-j', '--jobs', type=int, nargs='+', default=[1, 2, 4, 8], help='Process counts to time')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Builds per process count, best time is reported')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "src")
+        os.makedirs(source)
+        write_site(source, args.pages, args.sections)
+        size = sum(os.path.getsize(os.path.join(source, name)) for name in os.listdir(source))
+        print(f"{args.pages} pages, {size / 1e6:.1f} MB, {os.cpu_count()} CPUs")
+
+        baseline = None
+        for jobs in args.jobs:
+            best = float("inf")
+            for _ in range(args.repeat):
+                output = os.path.join(directory, "html")
+                shutil.rmtree(output, ignore_errors=True)
+                os.makedirs(output)
+                start = time.perf_counter()
+                parse.build(source, output, minify=True, compress=True, jobs=jobs)
+                best = min(best, time.perf_counter() - start)
+            baseline = baseline or best
+            print(f"jobs {jobs}: {best * 1000:8.1f} ms  ({baseline / best:.2f}x)")
+
+if __name__ == "__main__":
+    main()
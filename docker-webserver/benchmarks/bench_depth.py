@@ -0,0 +1,31 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import compiler
+from bench_tokenize import best_of
+
+def deep_document(depth: int) -> str:
+    return "[" + "d(class=\"level\")[p{x}" * depth + "]" * depth + "]"
+
+def wide_document(width: int) -> str:
+    return "[d[" + "p{item}(class=\"row\") br()" * width + "]]"
+
+def main():
+    parser = argparse.ArgumentParser(description='Time Compiler.compile and compile_to_html on deep and wide trees.')
+    parser.add_argument('--depth', type=int, default=900, help='Nesting depth of the deep document')
+    parser.add_argument('--width', type=int, default=50000, help='Number of siblings in the wide document')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Runs per measurement, best time is reported')
+    args = parser.parse_args()
+
+    for name, text in (("deep", deep_document(args.depth)), ("wide", wide_document(args.width))):
+        tokens = compiler.Parser(text).tokenize()
+        root = compiler.Compiler(tokens).compile()
+        parse = best_of(lambda: compiler.Compiler(tokens).compile(), args.repeat)
+        render = best_of(lambda: compiler.Compiler.compile_to_html(root, compiler.translation, compiler.styles), args.repeat)
+        print(f"{name}: {len(tokens)} tokens  parse {parse * 1000:7.1f} ms  render {render * 1000:7.1f} ms")
+
+if __name__ == "__main__":
+    main()
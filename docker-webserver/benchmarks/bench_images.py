@@ -0,0 +1,75 @@
+import argparse
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import images, parse
+
+def write_site(directory: str, count: int, width: int, height: int):
+    # Photo-like JPEGs: smooth gradients with noise, saved at a high
+    # quality as cameras and editors do. Each page shows four images.
+    from PIL import Image
+    rng = random.Random(0)
+    os.makedirs(os.path.join(directory, "photos"))
+    for n in range(count):
+        base = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+        noise = Image.effect_noise((width, height), 24 + n).convert("RGB")
+        tint = Image.new("RGB", (width, height), tuple(rng.randrange(256) for _ in range(3)))
+        image = Image.blend(Image.blend(base, noise, 0.3), tint, 0.3)
+        image.save(os.path.join(directory, "photos", f"photo{n}.jpg"), quality=95)
+    for n in range(0, count, 4):
+        elements = " ".join(f'i(src="photos/photo{m}.jpg" alt="photo {m}")' for m in range(n, min(n + 4, count)))
+        with open(os.path.join(directory, f"page{n // 4}.mhtml"), "w") as f:
+            f.write(f'[hl{{Gallery}} d[{elements}]]')
+
+def main():
+    parser = argparse.ArgumentParser(description='Time of the image pipeline in a full build, and the bytes it saves.')
+    parser.add_argument('-n', '--images', type=int, default=16, help='Number of source images')
+    parser.add_argument('--size', type=str, default='2400x1600', help='Size of the source images')
+    parser.add_argument('-j', '--jobs', type=int, nargs='+', default=[1, 2, 4], help='Process counts to time')
+    args = parser.parse_args()
+    if not images.has_pillow():
+        sys.exit("Pillow is needed to generate the images: pip install Pillow")
+    logging.disable(logging.CRITICAL)
+    width, height = map(int, args.size.split("x"))
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "src")
+        write_site(source, args.images, width, height)
+        photos = os.path.join(source, "photos")
+        original = sum(os.path.getsize(os.path.join(photos, name)) for name in os.listdir(photos))
+        print(f"{args.images} images of {width}x{height}, {original / 1e6:.1f} MB, {os.cpu_count()} CPUs")
+
+        output = os.path.join(directory, "html")
+        os.makedirs(output)
+        start = time.perf_counter()
+        parse.build(source, output, optimize_images=False)
+        print(f"  without images:{(time.perf_counter() - start) * 1000:9.1f} ms")
+        for jobs in args.jobs:
+            shutil.rmtree(output)
+            os.makedirs(output)
+            start = time.perf_counter()
+            parse.build(source, output, jobs=jobs)
+            print(f"  jobs {jobs}, cold:{(time.perf_counter() - start) * 1000:12.1f} ms")
+        # Variants on disk are reused: only the pages are compiled again
+        os.remove(os.path.join(output, parse.MANIFEST_NAME))
+        start = time.perf_counter()
+        parse.build(source, output)
+        print(f"  warm, pages only:{(time.perf_counter() - start) * 1000:7.1f} ms")
+
+        variants = os.path.join(output, images.IMAGE_DIR)
+        full = sum(os.path.getsize(os.path.join(variants, name)) for name in os.listdir(variants)
+                   if name.endswith(f".{width}.jpg"))
+        small = sum(os.path.getsize(os.path.join(variants, name)) for name in os.listdir(variants)
+                    if name.endswith(".640.jpg"))
+        print(f"bytes per image: {original / args.images / 1e3:.0f} kB original, "
+              f"{full / args.images / 1e3:.0f} kB recompressed, {small / args.images / 1e3:.0f} kB at 640w")
+
+if __name__ == "__main__":
+    main()
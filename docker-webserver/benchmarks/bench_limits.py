@@ -0,0 +1,97 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import compiler
+from bench_tokenize import best_of
+from generate import generate_document
+
+# Generous limits: no generated document comes near them, so the runs
+# measure what checking costs
+GENEROUS = compiler.Limits(input_bytes=1 << 30, tokens=1 << 26, nodes=1 << 24, depth=1 << 16, attributes=1 << 12,
+                           output_bytes=1 << 31, seconds=3600)
+# What a service taking pasted sources might allow
+STRICT = compiler.Limits(input_bytes=1 << 20, tokens=200000, nodes=20000, depth=64, attributes=64,
+                         output_bytes=4 << 20, seconds=2)
+
+def mutate(text: str, rng: random.Random, edits: int) -> str:
+    # Drops, doubles and swaps characters, leaving brackets and bodies unbalanced
+    chars = list(text)
+    for _ in range(edits):
+        at = rng.randrange(len(chars))
+        kind = rng.random()
+        if kind < 0.4:
+            del chars[at]
+        elif kind < 0.7:
+            chars.insert(at, chars[at])
+        else:
+            chars[at] = rng.choice('[](){}"=d')
+    return "".join(chars)
+
+def hostile(size: int):
+    # (name, text) of sources made to exhaust one resource each
+    yield "deep nesting", "[" + "d[" * size + "]" * (size + 1)
+    yield "unterminated {", "[p{" + "x" * (size * 40)
+    yield "trailing whitespace", "[p{a}]" + " " * (size * 20)
+    yield "huge attribute list", "[p(" + " ".join(f'a{n}="{n}"' for n in range(size)) + ")]"
+    yield "many tokens", "[" + "p{}" * (size * 6) + "]"
+    yield "wide output", "[" + 's-w(style="' + "bold " * 200 + '")' + 'p(class="w")' * (size // 4) + "]"
+
+def compile_with(text, limits):
+    if limits is not None:
+        limits = limits.start()
+    tokens = compiler.Parser(text, limits).tokenize()
+    root = compiler.Compiler(tokens, limits=limits).compile()
+    return compiler.Compiler.compile_to_html(root, compiler.translation, compiler.styles, limits=limits)
+
+def outcome(text, limits):
+    # (seconds, error limit or None) of one compile
+    start = time.perf_counter()
+    try:
+        compile_with(text, limits)
+        error = None
+    except compiler.LimitError as e:
+        error = e.limit
+    except (ValueError, RecursionError) as e:
+        error = type(e).__name__
+    return time.perf_counter() - start, error
+
+def main():
+    parser = argparse.ArgumentParser(description='Cost of resource limits on fuzzed documents, and time to stop hostile ones.')
+    parser.add_argument('-e', '--elements', type=int, default=20000, help='Elements per generated document')
+    parser.add_argument('-n', '--documents', type=int, default=20, help='Fuzzed documents')
+    parser.add_argument('-s', '--size', type=int, default=50000, help='Size of the hostile sources')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Runs per measurement, best time is reported')
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    plain = limited = 0.0
+    errors = 0
+    for n in range(args.documents):
+        text = generate_document(nodes=args.elements, seed=n)
+        text = mutate(text, rng, rng.randint(0, 20))
+        try:
+            html = compile_with(text, None)
+        except ValueError:
+            errors += 1  # fails the same way with limits
+            continue
+        assert compile_with(text, GENEROUS) == html
+        plain += best_of(lambda: compile_with(text, None), args.repeat)
+        limited += best_of(lambda: compile_with(text, GENEROUS), args.repeat)
+    print(f"{args.documents} fuzzed documents of {args.elements} elements ({errors} not compiling either way)")
+    print(f"  no limits {plain * 1000:8.1f} ms   generous limits {limited * 1000:8.1f} ms   "
+          f"{100 * (limited / plain - 1):+.1f}%")
+
+    print(f"{'hostile source':<22} {'KB':>7}  {'unlimited ms':>12}  {'limited ms':>10}  stopped by")
+    for name, text in hostile(args.size):
+        unlimited, error = outcome(text, None)
+        stopped, limit = outcome(text, STRICT)
+        print(f"{name:<22} {len(text) / 1024:>7.0f}  {unlimited * 1000:>12.1f}  {stopped * 1000:>10.2f}  "
+              f"{limit or '-'}{f' (unlimited: {error})' if error else ''}")
+
+if __name__ == "__main__":
+    main()
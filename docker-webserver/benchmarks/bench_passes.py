@@ -0,0 +1,85 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import compiler, passes
+from bench_tokenize import best_of
+from generate import generate_document
+
+# Element passes a site might add: rewrite links, mark external ones and
+# give paragraphs a data attribute. Each is also run as a tree walk of its
+# own to show what fusing them into the render saves.
+
+def relative_links(tag, attributes, content):
+    href = attributes.get('href', '')
+    if href.endswith('.mhtml'):
+        return tag, dict(attributes, href=href[:-6] + '.html'), content
+    return tag, attributes, content
+
+def external_links(tag, attributes, content):
+    if attributes.get('href', '').startswith('http'):
+        return tag, dict(attributes, rel='noopener'), content
+    return tag, attributes, content
+
+def paragraphs(tag, attributes, content):
+    return tag, dict(attributes, **{'data-text': str(len(content))}), content
+
+VISITS = ((relative_links, ('l',)), (external_links, ('l',)), (paragraphs, ('p',)))
+
+class Walk(passes.TreePass):
+    # An element pass as a separate traversal
+    def __init__(self, visit, tags):
+        self.visit = visit
+        self.tags = frozenset(tags)
+        self.name = visit.__name__
+
+    def run(self, root):
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node.tag in self.tags:
+                node.tag, node.attributes, node.content = self.visit(node.tag, node.attributes, node.content)
+            stack.extend(node.children)
+
+def main():
+    parser = argparse.ArgumentParser(description='Render time with element passes fused into the render against one walk per pass.')
+    parser.add_argument('-e', '--elements', type=int, default=20000, help='Number of elements')
+    parser.add_argument('-r', '--repeat', type=int, default=7, help='Runs per measurement, best time is reported')
+    args = parser.parse_args()
+
+    text = generate_document(nodes=args.elements)
+    translation, styles = compiler.translation, compiler.styles
+
+    def render(manager=None):
+        root = compiler.Compiler(compiler.Parser(text).tokenize()).compile()
+        return lambda: compiler.Compiler.compile_to_html(root, translation, styles, passes=manager)
+
+    def fused(count):
+        manager = passes.PassManager()
+        for visit, tags in VISITS[:count]:
+            manager.add(passes.FunctionPass(visit, tags))
+        return manager
+
+    def walks(count):
+        return passes.PassManager([Walk(visit, tags) for visit, tags in VISITS[:count]])
+
+    assert render(fused(3))() == render(walks(3))()
+    print(f"{args.elements} elements, {len(text) / 1024:.0f} KB")
+    print(f"{'passes':>6}  {'fused ms':>9}  {'one walk each ms':>16}")
+    for count in range(len(VISITS) + 1):
+        # The walks change the tree in place, to the same result every time
+        fused_time = best_of(render(fused(count)), args.repeat)
+        walk_time = best_of(render(walks(count)), args.repeat)
+        print(f"{count:>6}  {fused_time * 1000:>9.1f}  {walk_time * 1000:>16.1f}")
+
+    manager = fused(len(VISITS))
+    manager.timed = True
+    render(manager)()
+    print("time per pass (timed run):")
+    for name, entry in manager.report().items():
+        print(f"  {name:<16} {entry['seconds'] * 1000:7.2f} ms  {entry['elements']:>7} elements")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import compiler
+from minihtml.incremental import Document
+from generate import generate_document
+
+def keystrokes(text: str, count: int, seed: int = 0):
+    # (start, end, text) edits typing into the text of random elements: a
+    # character inserted, then deleted again, so the document stays the same size
+    rng = random.Random(seed)
+    bodies = [n + 1 for n, char in enumerate(text) if char == "{"]
+    for _ in range(count // 2):
+        offset = rng.choice(bodies)
+        yield offset, offset, "x"
+        yield offset, offset + 1, ""
+
+def percentiles(times):
+    times = sorted(times)
+    return statistics.median(times) * 1000, times[min(len(times) - 1, int(len(times) * 0.99))] * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description='Keystroke-to-HTML latency of the live preview against a full compile.')
+    parser.add_argument('-e', '--elements', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Document sizes in elements')
+    parser.add_argument('-k', '--keystrokes', type=int, default=400, help='Edits per document size')
+    parser.add_argument('--full', type=int, default=20, help='Full compiles per document size')
+    args = parser.parse_args()
+    translation, styles = compiler.translation, compiler.styles
+
+    print(f"{'elements':>9} {'KB':>7}  {'incremental median/p99 ms':>26}  {'full compile median/p99 ms':>27}  patches")
+    for elements in args.elements:
+        text = generate_document(nodes=elements)
+        document = Document(text)
+        incremental, patched = [], 0
+        for start, end, insert in keystrokes(text, args.keystrokes):
+            began = time.perf_counter()
+            patch = document.edit(start, end, insert)
+            html = document.render() if patch is None else document.render_element(patch.node)
+            incremental.append(time.perf_counter() - began)
+            patched += patch is not None
+        assert document.text == text and html
+
+        full = []
+        for start, end, insert in keystrokes(text, args.full * 2):
+            edited = text[:start] + insert + text[end:]
+            began = time.perf_counter()
+            compiler.Compiler.compile_to_html(compiler.Compiler(compiler.Parser(edited).tokenize()).compile(),
+                                              translation, styles)
+            full.append(time.perf_counter() - began)
+            if len(full) == args.full:
+                break
+
+        (median, p99), (full_median, full_p99) = percentiles(incremental), percentiles(full)
+        print(f"{elements:>9} {len(text) / 1024:>7.0f}  {median:>12.3f} / {p99:>11.3f}  "
+              f"{full_median:>13.1f} / {full_p99:>11.1f}  {patched}/{len(incremental)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import parse
+from bench_build import write_site
+
+def main():
+    parser = argparse.ArgumentParser(description='Cost of profiling a parse.py build, and of logging at INFO.')
+    parser.add_argument('-p', '--pages', type=int, default=32, help='Number of pages in the site')
+    parser.add_argument('-s', '--sections', type=int, default=20, help='Sections in the smallest page')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Builds per mode, best time is reported')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, stream=open(os.devnull, "w"))
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "src")
+        os.makedirs(source)
+        write_site(source, args.pages, args.sections)
+
+        for label, profiles in (("off", None), ("--profile", {})):
+            best = float("inf")
+            for _ in range(args.repeat):
+                output = os.path.join(directory, "html")
+                shutil.rmtree(output, ignore_errors=True)
+                os.makedirs(output)
+                start = time.perf_counter()
+                parse.build(source, output, minify=True, profiles=profiles)
+                best = min(best, time.perf_counter() - start)
+            print(f"{label:<10} {best * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import serve
+from bench_build import write_site
+
+def run_server(directory: str, port: int, cache_bytes: int):
+    # In its own process so the client does not compete for the GIL
+    logging.disable(logging.CRITICAL)
+    server = serve.Server(directory, cache_bytes=cache_bytes)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(server.start("127.0.0.1", port))
+    loop.run_forever()
+
+async def client(port: int, paths, latencies):
+    # One keep-alive connection sending requests back to back
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for path in paths:
+        start = time.perf_counter()
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nAccept-Encoding: gzip\r\n\r\n".encode())
+        length = 0
+        status = await reader.readline()
+        while True:
+            line = await reader.readline()
+            if line == b"\r\n":
+                break
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":")[1])
+        await reader.readexactly(length)
+        if not status.startswith(b"HTTP/1.1 200"):
+            raise RuntimeError(status)
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+
+async def load(port: int, paths, connections: int):
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, paths[n::connections], latencies) for n in range(connections)))
+    return time.perf_counter() - start, sorted(latencies)
+
+def wait_until_listening(port: int):
+    async def connect():
+        while True:
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.close()
+                return
+            except OSError:
+                await asyncio.sleep(0.05)
+    asyncio.get_event_loop().run_until_complete(asyncio.wait_for(connect(), 10))
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test serve.py on cache hits and cache misses.')
+    parser.add_argument('-p', '--pages', type=int, default=20, help='Number of pages in the site')
+    parser.add_argument('-s', '--sections', type=int, default=5, help='Sections in the smallest page')
+    parser.add_argument('-n', '--requests', type=int, default=5000, help='Requests per run')
+    parser.add_argument('-c', '--connections', type=int, default=16, help='Concurrent keep-alive connections')
+    parser.add_argument('--port', type=int, default=8765, help='Port for the server under test')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_site(directory, args.pages, args.sections)
+        paths = [f"/page{n % args.pages}.html" for n in range(args.requests)]
+        # A cache of 0 bytes compiles every request: the cold path
+        for label, cache_bytes, requests in (("cache hit", 64 * 1024 * 1024, args.requests),
+                                             ("cache miss", 0, max(args.requests // 20, args.connections))):
+            server = multiprocessing.Process(target=run_server, args=(directory, args.port, cache_bytes), daemon=True)
+            server.start()
+            try:
+                wait_until_listening(args.port)
+                if cache_bytes:
+                    asyncio.get_event_loop().run_until_complete(load(args.port, paths[:args.pages], 1))
+                elapsed, latencies = asyncio.get_event_loop().run_until_complete(
+                    load(args.port, paths[:requests], args.connections))
+            finally:
+                server.terminate()
+                server.join()
+            p50 = latencies[len(latencies) // 2]
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            print(f"{label:<11} {requests / elapsed:8.0f} req/s   p50 {p50 * 1000:7.2f} ms   p99 {p99 * 1000:7.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import glob
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import compiler
+from bench_tokenize import build_document, best_of
+from bench_styles import styled_document
+from bench_tree import traced
+from generate import generate_document
+
+def corpus(examples: str):
+    # (name, text): the example pages as one site, and generated pages from
+    # many repeats (a section template, styled cards) to none
+    pages = sorted(glob.glob(os.path.join(examples, "*.mhtml")))
+    for path in pages:
+        with open(path, encoding="utf-8") as f:
+            yield os.path.basename(path), f.read()
+    yield "sections (4000)", build_document(4000)
+    yield "styled cards (20000)", styled_document(20000)
+    yield "generated (20000)", generate_document(nodes=20000)
+
+def compile_shared(tokens):
+    table = compiler.SharedSubtrees()
+    return compiler.Compiler(tokens, shared=table).compile(), table
+
+def main():
+    parser = argparse.ArgumentParser(description='Nodes and bytes saved by sharing identical subtrees, and compile/render times.')
+    parser.add_argument('-d', '--examples', type=str,
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "examples"),
+                        help='Directory of example pages')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Runs per measurement, best time is reported')
+    args = parser.parse_args()
+    translation, styles = compiler.translation, compiler.styles
+
+    print(f"{'document':<24} {'nodes':>7} {'unique':>7} {'dedup':>6}  {'tree KB':>15}  "
+          f"{'compile ms':>13}  {'render ms':>13}  {'reused HTML KB':>14}")
+    for name, text in corpus(args.examples):
+        tokens = compiler.Parser(text).tokenize()
+        tree, tree_bytes = traced(lambda: compiler.Compiler(tokens).compile())
+        # The table is part of what sharing keeps in memory
+        (shared_tree, table), shared_bytes = traced(lambda: compile_shared(tokens))
+        html = compiler.Compiler.compile_to_html(tree, translation, styles)
+        assert compiler.Compiler.compile_to_html(shared_tree, translation, styles, shared=table) == html
+        stats = table.stats()
+
+        compile_plain = best_of(lambda: compiler.Compiler(tokens).compile(), args.repeat)
+        compile_with_table = best_of(lambda: compile_shared(tokens), args.repeat)
+        render_plain = best_of(lambda: compiler.Compiler.compile_to_html(tree, translation, styles), args.repeat)
+        table.reused = table.reused_html = 0
+        render_shared = best_of(
+            lambda: compiler.Compiler.compile_to_html(shared_tree, translation, styles, shared=table), args.repeat)
+        reused_html = table.reused_html / max(1, args.repeat)
+        print(f"{name:<24} {stats['nodes']:>7} {stats['unique']:>7} "
+              f"{100 * stats['deduplicated'] / max(1, stats['nodes']):>5.0f}%  "
+              f"{tree_bytes / 1024:>6.0f} > {shared_bytes / 1024:>6.0f}  "
+              f"{compile_plain * 1000:>5.1f} > {compile_with_table * 1000:>5.1f}  "
+              f"{render_plain * 1000:>5.1f} > {render_shared * 1000:>5.1f}  "
+              f"{reused_html / 1024:>8.0f} of {len(html) / 1024:.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import compiler
+from bench_tokenize import build_document
+
+def compile_text(path: str) -> compiler.Node:
+    with open(path, "r") as f:
+        text = f.read()
+    tokens = compiler.Parser(text).tokenize()
+    return compiler.Compiler(tokens).compile()
+
+def compile_mapped(path: str) -> compiler.Node:
+    with compiler.map_source(path) as source:
+        tokens = compiler.Parser(source).tokenize_spans()
+        return compiler.Compiler(tokens).compile()
+
+def measure(func, path: str):
+    # Timed without tracing, then run again under tracemalloc for the peak
+    gc.collect()
+    start = time.perf_counter()
+    root = func(path)
+    seconds = time.perf_counter() - start
+    del root
+    gc.collect()
+    tracemalloc.start()
+    root = func(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return root, seconds, peak
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare peak memory of str tokens against mmap span tokens.')
+    parser.add_argument('-s', '--sections', type=int, default=8000, help='Number of repeated page sections')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "big.mhtml")
+        with open(path, "w") as f:
+            f.write(build_document(args.sections))
+        print(f"document: {os.path.getsize(path) / 1e6:.2f} MB")
+
+        html = {}
+        for name, func in (("str tokens", compile_text), ("mmap spans", compile_mapped)):
+            root, seconds, peak = measure(func, path)
+            html[name] = compiler.Compiler.compile_to_html(root, compiler.translation, compiler.styles)
+            print(f"{name:>10}: peak {peak / 1e6:7.1f} MB  {seconds * 1000:8.1f} ms")
+        assert html["str tokens"] == html["mmap spans"]
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_stylesheet import EXAMPLES
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def best_run(command, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=PACKAGE_ROOT)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Wall time of short-lived minihtml processes: imports and CLI commands.')
+    parser.add_argument('-r', '--repeat', type=int, default=20, help='Runs per command, best time is reported')
+    args = parser.parse_args()
+    python = sys.executable
+    page = os.path.join(EXAMPLES, "helloworld.mhtml")
+
+    with tempfile.TemporaryDirectory() as output:
+        commands = {
+            "python -c pass": [python, "-c", "pass"],
+            "import minihtml": [python, "-c", "import minihtml"],
+            "import minihtml.compiler": [python, "-c", "import minihtml.compiler"],
+            "import minihtml.parse": [python, "-c", "import minihtml.parse"],
+            "minihtml render": [python, "-m", "minihtml", "render", page],
+            "minihtml build": [python, "-m", "minihtml", "build", "-d", EXAMPLES, "-o", output, "-m"],
+        }
+        bare = None
+        for name, command in commands.items():
+            seconds = best_run(command, args.repeat)
+            if bare is None:
+                bare = seconds
+            print(f"{name:<26}{seconds * 1000:8.1f} ms  (+{(seconds - bare) * 1000:.1f} ms over the interpreter)")
+    print("\nimport breakdown: python -X importtime -c 'import minihtml.parse' 2>&1 | sort -t'|' -k2 -n | tail")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import compiler
+from bench_tokenize import best_of
+
+def styled_document(elements: int) -> str:
+    rows = "".join(
+        'p{Row}(class="card text" style="color(#333) size(14px) italic")' if n % 2 else
+        'd(class="card")[l{link}(href="#" style="bold color(#3498db)")]'
+        for n in range(elements))
+    return ('[s-card(style="card background(#f8f9fa) margin(20px) padding(15px)")'
+            's-text(style="bold font(Arial) text-center")' + rows + ']')
+
+def main():
+    parser = argparse.ArgumentParser(description='Time compile_to_html on a page that reuses classes and inline styles.')
+    parser.add_argument('-e', '--elements', type=int, default=20000, help='Number of styled elements')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Runs per measurement, best time is reported')
+    args = parser.parse_args()
+
+    root = compiler.Compiler(compiler.Parser(styled_document(args.elements)).tokenize()).compile()
+    render = best_of(lambda: compiler.Compiler.compile_to_html(root, compiler.translation, compiler.styles), args.repeat)
+    print(f"{args.elements} styled elements: render {render * 1000:7.1f} ms")
+
+if __name__ == "__main__":
+    main()
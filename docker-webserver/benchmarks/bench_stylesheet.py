@@ -0,0 +1,44 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import compiler, parse
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "examples")
+
+def main():
+    parser = argparse.ArgumentParser(description='Report bytes saved by extracting styles into a site stylesheet.')
+    parser.add_argument('-d', '--directory', type=str, default=EXAMPLES, help='Directory of MiniHTML sources')
+    args = parser.parse_args()
+
+    site_stylesheet = compiler.Stylesheet()
+    inline_total = extracted_total = 0
+    rows = []
+    for root, dirs, files in os.walk(args.directory):
+        for file in sorted(files):
+            if not file.endswith((".minihtml", ".mhtml")):
+                continue
+            path = os.path.join(root, file)
+            inline = len(parse.compile_file(path).encode("utf-8"))
+            page_stylesheet = compiler.Stylesheet()
+            html = parse.compile_file(path, page_stylesheet)
+            site_stylesheet.update(page_stylesheet)
+            rows.append((file, inline, len(html.encode("utf-8")), bool(page_stylesheet.rules)))
+
+    link = len(compiler.Stylesheet.link(site_stylesheet.filename()).encode("utf-8"))
+    print(f"{'page':<28}{'inline':>8}{'extracted':>11}")
+    for file, inline, extracted, styled in rows:
+        extracted += link if styled else 0
+        inline_total += inline
+        extracted_total += extracted
+        print(f"{file:<28}{inline:>8}{extracted:>11}")
+    css = len(site_stylesheet.css().encode("utf-8"))
+    print(f"{'stylesheet (once per site)':<28}{'':>8}{css:>11}")
+    print(f"{'total':<28}{inline_total:>8}{extracted_total + css:>11}")
+    print(f"saved: {inline_total - extracted_total - css} bytes per full download, "
+          f"{inline_total - extracted_total} bytes per page set once the stylesheet is cached")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import compiler
+
+SECTION = """
+    s-card{0}(style="card background(#f8f9fa) margin(20px)")
+    hm{{Section {0}}}
+    d(class="card{0}" style="padding(15px)")[
+        p{{Normal text with a few more words in it}}
+        p{{Bold text}}(style="bold color(#e74c3c)")
+        p{{Custom font}}(style="font(Brush Script MT) italic size(24px)")
+        i(src="https://picsum.photos/300/200" alt="picture {0}" style="width(300px)")
+        br()
+        l{{Visit Example}}(href="https://example.com/{0}" style="color(#3498db)")
+        hline()
+    ]
+"""
+
+def build_document(sections: int) -> str:
+    return "[" + "".join(SECTION.format(n) for n in range(sections)) + "]"
+
+def best_of(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Parser.tokenize against the reference loop.')
+    parser.add_argument('-s', '--sections', type=int, default=2000, help='Number of repeated page sections')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Runs per scanner, best time is reported')
+    args = parser.parse_args()
+
+    text = build_document(args.sections)
+    megabytes = len(text.encode("utf-8")) / 1e6
+    parser_instance = compiler.Parser(text)
+    assert [(t.type, t.value) for t in parser_instance.tokenize()] == \
+        [(t.type, t.value) for t in parser_instance.tokenize_loop()]
+
+    print(f"document: {megabytes:.2f} MB, {len(parser_instance.tokenize())} tokens")
+    results = {}
+    for name in ("tokenize_loop", "tokenize"):
+        seconds = best_of(getattr(parser_instance, name), args.repeat)
+        results[name] = seconds
+        print(f"{name:>14}: {seconds * 1000:8.1f} ms  {megabytes / seconds:7.1f} MB/s")
+    print(f"speedup: {results['tokenize_loop'] / results['tokenize']:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import compiler
+from bench_tokenize import build_document, best_of
+
+def traced(func):
+    # Memory still held by the result of func()
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, current
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare memory and build time of Node trees and FlatTree.')
+    parser.add_argument('-s', '--sections', type=int, default=4000, help='Number of repeated page sections')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs per measurement, best time is reported')
+    args = parser.parse_args()
+
+    text = build_document(args.sections)
+    tokens, token_bytes = traced(lambda: compiler.Parser(text).tokenize())
+    print(f"document: {len(text) / 1e6:.2f} MB, {len(tokens)} tokens using {token_bytes / 1e6:.1f} MB")
+
+    html = None
+    for name, compact in (("Node tree", False), ("FlatTree", True)):
+        tree, tree_bytes = traced(lambda: compiler.Compiler(tokens).compile(compact=compact))
+        build = best_of(lambda: compiler.Compiler(tokens).compile(compact=compact), args.repeat)
+        render = best_of(lambda: compiler.Compiler.compile_to_html(tree, compiler.translation, compiler.styles), args.repeat)
+        output = compiler.Compiler.compile_to_html(tree, compiler.translation, compiler.styles)
+        assert html is None or output == html
+        html = output
+        print(f"{name:>9}: {tree_bytes / 1e6:6.1f} MB  build {build * 1000:7.1f} ms  render {render * 1000:7.1f} ms")
+
+if __name__ == "__main__":
+    main()
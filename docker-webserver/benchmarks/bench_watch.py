@@ -0,0 +1,84 @@
+import argparse
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import parse, watcher
+from bench_build import write_site
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def serve(directory: str, output: str, files, building: threading.Lock):
+    # What main.py does, without the container paths
+    while True:
+        changed = watcher.wait_for_changes(files)
+        if changed is not None:
+            changed = {path for path in changed if watcher.is_source(path)}
+        with building:
+            parse.build(directory, output, minify=True, compress=True, changed=changed)
+
+def wait_for(path: str, text: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with open(path) as f:
+                if text in f.read():
+                    return
+        except FileNotFoundError:
+            pass
+        time.sleep(0.001)
+    raise TimeoutError(path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the time from saving a source to its page being written.')
+    parser.add_argument('-p', '--pages', type=int, default=200, help='Number of pages in the site')
+    parser.add_argument('-s', '--sections', type=int, default=10, help='Sections in the smallest page')
+    parser.add_argument('-e', '--edits', type=int, default=20, help='Number of edits to time')
+    parser.add_argument('--polling', action='store_true', help='Use the scandir fallback instead of inotify')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "src")
+        output = os.path.join(directory, "html")
+        os.makedirs(source)
+        os.makedirs(output)
+        write_site(source, args.pages, args.sections)
+        parse.build(source, output, minify=True, compress=True)
+
+        # Before: poll every 10 s, then a new interpreter rebuilds the site
+        with open(os.path.join(source, "page0.mhtml"), "w") as f:
+            f.write("[p{edit}]")
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "minihtml", "build", "-d", source, "-o", output, "--minify", "--compress"],
+                       check=True, stderr=subprocess.DEVNULL, cwd=PACKAGE_ROOT)
+        spawn = time.perf_counter() - start
+        print(f"{args.pages} pages; subprocess rebuild after one edit: {spawn * 1000:.0f} ms "
+              f"(+ 0-10 s polling delay, {5000 + spawn * 1000:.0f} ms on average)")
+
+        files = watcher.PollingWatcher(source) if args.polling else watcher.make_watcher(source)
+        building = threading.Lock()
+        threading.Thread(target=serve, args=(source, output, files, building), daemon=True).start()
+        latencies = []
+        for n in range(args.edits):
+            page = n % args.pages
+            time.sleep(0.2)
+            start = time.perf_counter()
+            with open(os.path.join(source, f"page{page}.mhtml"), "w") as f:
+                f.write(f"[p{{edit {n}}}]")
+            wait_for(os.path.join(output, f"page{page}.html"), f"edit {n}")
+            latencies.append(time.perf_counter() - start)
+
+        building.acquire()  # no build running while the directory is removed
+        print(f"{type(files).__name__}: edit to live median {statistics.median(latencies) * 1000:.0f} ms, "
+              f"max {max(latencies) * 1000:.0f} ms over {args.edits} edits")
+
+if __name__ == "__main__":
+    main()
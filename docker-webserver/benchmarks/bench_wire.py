@@ -0,0 +1,62 @@
+import argparse
+import gzip
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import compiler, wire
+from bench_stylesheet import EXAMPLES
+from bench_tokenize import best_of
+from generate import generate_document
+
+def parse_text(text: str) -> compiler.Node:
+    return compiler.Compiler(compiler.Parser(text).tokenize()).compile()
+
+def main():
+    parser = argparse.ArgumentParser(description='Size and decode speed of the wire format against MiniHTML text.')
+    parser.add_argument('-d', '--directory', type=str, default=EXAMPLES, help='Directory of MiniHTML sources')
+    parser.add_argument('-n', '--nodes', type=int, default=5000, help='Elements of an added generated document, 0 for none')
+    parser.add_argument('-l', '--loops', type=int, default=200, help='Decodes of the corpus per timing')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Timings per measurement, best is reported')
+    args = parser.parse_args()
+    translation, styles = compiler.translation, compiler.styles
+
+    examples = []
+    for file in sorted(os.listdir(args.directory)):
+        if file.endswith((".minihtml", ".mhtml")):
+            with open(os.path.join(args.directory, file), encoding="utf-8") as f:
+                examples.append((file, f.read()))
+    generated = [(f"generated ({args.nodes} elements)", generate_document(args.nodes))] if args.nodes else []
+
+    print(f"{'document':<30}{'text':>9}{'text.gz':>9}{'wire':>9}{'wire.gz':>9}")
+    encoded = {}
+    totals = [0, 0, 0, 0]
+    for name, text in examples + generated:
+        data = encoded[name] = wire.encode(parse_text(text), translation, styles)
+        raw = text.encode("utf-8")
+        sizes = [len(raw), len(gzip.compress(raw)), len(data), len(gzip.compress(data))]
+        print(f"{name:<30}" + "".join(f"{size:>9}" for size in sizes))
+        if (name, text) in examples:
+            totals = [total + size for total, size in zip(totals, sizes)]
+    print(f"{'total of ' + os.path.basename(args.directory):<30}" + "".join(f"{size:>9}" for size in totals))
+
+    for label, documents, loops in ((os.path.basename(args.directory), examples, args.loops), ("generated", generated, 1)):
+        if not documents:
+            continue
+        selection = [(text, encoded[name]) for name, text in documents]
+
+        def run(func):
+            return best_of(lambda: [func(text, data) for _ in range(loops) for text, data in selection], args.repeat) / loops
+        timings = {
+            "text -> Node": run(lambda text, data: parse_text(text)),
+            "wire -> Node": run(lambda text, data: wire.decode(data, translation, styles)),
+            "text -> HTML": run(lambda text, data: compiler.Compiler.compile_to_html(parse_text(text), translation, styles)),
+            "wire -> HTML": run(lambda text, data: wire.decode_to_html(data, translation, styles)),
+        }
+        print(f"\n{label}:")
+        for name, seconds in timings.items():
+            print(f"  {name:<14}{seconds * 1e6:10.1f} us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import random
+from typing import List
+
+# Seeded generator of synthetic MiniHTML documents, so benchmark runs on
+# different commits measure the same input.
+
+LEAF_TAGS = ("p", "p", "p", "hl", "hm", "hs", "l", "i", "br", "hline")
+TEXT_TAGS = ("p", "hl", "hm", "hs", "l")
+WORDS = ("mini", "html", "page", "card", "section", "link", "text", "style", "content", "header",
+         "paragraph", "example", "image", "small", "large", "blue", "quick", "light", "docker", "server")
+STYLES = ("bold", "italic", "underline", "text-center", "card", "codeblock", "color(#3498db)", "color(#e74c3c)",
+          "size(14px)", "size(24px)", "font(Brush Script MT)", "background(#f8f9fa)", "padding(10px)",
+          "margin(20px)", "width(300px)", "width-height(300px, 200px)")
+ATTRIBUTES = ("id", "title", "data-index", "lang", "role")
+
+def text(rng: random.Random, length: int) -> str:
+    # Words up to about length characters (half to one and a half of it)
+    target = max(1, int(length * rng.uniform(0.5, 1.5)))
+    words = []
+    size = 0
+    while size < target:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+def style(rng: random.Random) -> str:
+    return " ".join(rng.sample(STYLES, rng.randint(1, 3)))
+
+def attributes(rng: random.Random, index: int, density: float, classes: float, class_count: int,
+               styles: float, tag: str) -> str:
+    # density is the average number of plain attributes per element
+    parts = []
+    if tag == "i":
+        parts.append(f'src="https://picsum.photos/300/200" alt="picture {index}"')
+    elif tag == "l":
+        parts.append(f'href="https://example.com/{index}"')
+    count = int(density) + (rng.random() < density - int(density))
+    for name in rng.sample(ATTRIBUTES, min(count, len(ATTRIBUTES))):
+        parts.append(f'{name}="{name}-{index}"')
+    if class_count and rng.random() < classes:
+        parts.append(f'class="c{rng.randrange(class_count)}"')
+    if rng.random() < styles:
+        parts.append(f'style="{style(rng)}"')
+    return f"({' '.join(parts)})" if parts else ""
+
+def generate_document(nodes: int = 1000, depth: int = 8, attribute_density: float = 1.0, text_length: int = 40,
+                      classes: float = 0.2, styles: float = 0.3, seed: int = 0) -> str:
+    # nodes elements in containers nested up to depth levels. classes is the
+    # share of elements using one of the page's s- classes (one defined per
+    # 50 elements), styles the share with an inline style attribute.
+    rng = random.Random(seed)
+    class_count = max(1, nodes // 50) if classes > 0 else 0
+    parts = ["["]  # type: List[str]
+    parts.extend(f's-c{n}(style="{style(rng)}")' for n in range(class_count))
+    open_containers = 0
+    for index in range(nodes):
+        if open_containers and rng.random() < 0.25:
+            parts.append("]")
+            open_containers -= 1
+        if open_containers < depth and rng.random() < 0.2:
+            parts.append("d" + attributes(rng, index, attribute_density, classes, class_count, styles, "d") + "[")
+            open_containers += 1
+            continue
+        tag = rng.choice(LEAF_TAGS)
+        content = "{" + text(rng, text_length) + "}" if tag in TEXT_TAGS else ""
+        attrs = attributes(rng, index, attribute_density, classes, class_count, styles, tag)
+        parts.append(f"{tag}{content}{attrs or '()'}")
+    parts.append("]" * open_containers + "]")
+    return "\n".join(parts)
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic MiniHTML document to stdout.')
+    parser.add_argument('-n', '--nodes', type=int, default=1000, help='Number of elements')
+    parser.add_argument('--depth', type=int, default=8, help='Deepest nesting of containers')
+    parser.add_argument('--attributes', type=float, default=1.0, help='Average plain attributes per element')
+    parser.add_argument('--text', type=int, default=40, help='Average text length of text elements')
+    parser.add_argument('--classes', type=float, default=0.2, help='Share of elements using an s- class')
+    parser.add_argument('--styles', type=float, default=0.3, help='Share of elements with an inline style')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+    print(generate_document(args.nodes, args.depth, args.attributes, args.text, args.classes, args.styles, args.seed))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minihtml import compiler, parse
+if __package__:
+    from .bench_tokenize import best_of
+    from .generate import generate_document
+else:  # run as python benchmarks/suite.py
+    from bench_tokenize import best_of
+    from generate import generate_document
+
+HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.json")
+STAGES = ("tokenize", "compile", "render", "build")
+
+def commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def run(params: Dict, pages: int, repeat: int) -> Dict[str, float]:
+    # Best of repeat for each stage on the generated document, then a full
+    # parse.build of `pages` generated documents (different seeds).
+    document = generate_document(**params)
+    tokens = compiler.Parser(document).tokenize()
+    root = compiler.Compiler(tokens).compile()
+    results = {
+        "tokenize": best_of(lambda: compiler.Parser(document).tokenize(), repeat),
+        "compile": best_of(lambda: compiler.Compiler(tokens).compile(), repeat),
+        "render": best_of(lambda: compiler.Compiler.compile_to_html(root, compiler.translation, compiler.styles), repeat),
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "src")
+        output = os.path.join(directory, "html")
+        os.makedirs(source)
+        for n in range(pages):
+            with open(os.path.join(source, f"page{n}.mhtml"), "w") as f:
+                f.write(generate_document(**dict(params, seed=params["seed"] + n)))
+
+        def build():
+            shutil.rmtree(output, ignore_errors=True)
+            os.makedirs(output)
+            parse.build(source, output, minify=True)
+        results["build"] = best_of(build, repeat)
+    return results
+
+def load_history(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {"baseline": None, "runs": []}
+    with open(path) as f:
+        return json.load(f)
+
+def regressions(result: Dict, baseline: Dict, threshold: float) -> List[str]:
+    # Stages slower than the baseline by more than threshold percent
+    slower = []
+    for stage in STAGES:
+        before, after = baseline["results"].get(stage), result["results"].get(stage)
+        if before and after and (after - before) / before * 100 > threshold:
+            slower.append(f"{stage}: {before * 1000:.1f} ms -> {after * 1000:.1f} ms "
+                          f"(+{(after - before) / before * 100:.1f}%)")
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description='Time tokenize, compile, render and parse.py builds on generated documents.')
+    parser.add_argument('-n', '--nodes', type=int, default=5000, help='Elements per document')
+    parser.add_argument('--depth', type=int, default=8, help='Deepest nesting of containers')
+    parser.add_argument('--attributes', type=float, default=1.0, help='Average plain attributes per element')
+    parser.add_argument('--text', type=int, default=40, help='Average text length of text elements')
+    parser.add_argument('--classes', type=float, default=0.2, help='Share of elements using an s- class')
+    parser.add_argument('--styles', type=float, default=0.3, help='Share of elements with an inline style')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--pages', type=int, default=8, help='Pages in the end-to-end parse.py build')
+    parser.add_argument('-r', '--repeat', type=int, default=10, help='Runs per stage, best time is reported')
+    parser.add_argument('--history', type=str, default=HISTORY, help='JSON file the results are appended to')
+    parser.add_argument('--save-baseline', action='store_true', help='Make this run the baseline later runs compare to')
+    parser.add_argument('--check', type=float, metavar='PERCENT',
+                        help='Exit with an error when a stage is more than PERCENT slower than the baseline')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    params = {"nodes": args.nodes, "depth": args.depth, "attribute_density": args.attributes,
+              "text_length": args.text, "classes": args.classes, "styles": args.styles, "seed": args.seed}
+    result = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit(),
+        "python": platform.python_version(),
+        "params": dict(params, pages=args.pages),
+        "results": run(params, args.pages, args.repeat),
+    }
+
+    history = load_history(args.history)
+    baseline = history.get("baseline")
+    if baseline and baseline["params"] != result["params"]:
+        print("baseline was measured with other parameters, not comparing")
+        baseline = None
+    for stage in STAGES:
+        line = f"{stage:<9} {result['results'][stage] * 1000:9.2f} ms"
+        if baseline and baseline["results"].get(stage):
+            before = baseline["results"][stage]
+            line += f"  ({(result['results'][stage] - before) / before * 100:+.1f}% against {baseline['commit'] or 'baseline'})"
+        print(line)
+
+    history["runs"].append(result)
+    if args.save_baseline or not history.get("baseline"):
+        history["baseline"] = result
+    with open(args.history, "w") as f:
+        json.dump(history, f, indent=2)
+
+    if args.check is not None:
+        if baseline is None:
+            sys.exit("no baseline with the same parameters to check against")
+        slower = regressions(result, baseline, args.check)
+        if slower:
+            print(f"regressions over {args.check}%:")
+            for line in slower:
+                print(f"  {line}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,37 @@
 import os
 import time
-import subprocess
 import logging
-
-def get_files_mod_times(directory):
-    files_mod_times = {}
-    for root, _, files in os.walk(directory):
-        for file in files:
-            filepath = os.path.join(root, file)
-            files_mod_times[filepath] = os.path.getmtime(filepath)
-    return files_mod_times
-
-def has_any_file_changed(directory, last_mod_times):
-    current_mod_times = get_files_mod_times(directory)
-    for filepath, mod_time in current_mod_times.items():
-        if filepath not in last_mod_times or last_mod_times[filepath] != mod_time:
-            return True
-    return False
+from minihtml import budget, parse, watcher
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+BUILD_OPTIONS = {"minify": True, "compress": True}
+
+def rebuild(directory, output, changed=None):
+    start = time.perf_counter()
+    try:
+        # Pages over budget are logged; the server keeps serving them
+        config = budget.load_config(os.path.join(directory, budget.CONFIG_NAME))
+        sizes = {} if config is not None else None
+        stats = parse.build(directory, output, changed=changed, sizes=sizes, **BUILD_OPTIONS)
+        if config is not None:
+            parse.check_budgets(sizes, config)
+    except Exception:
+        logger.exception("Build failed")
+        return
+    logger.info(f"Rebuilt in {(time.perf_counter() - start) * 1000:.0f} ms: {stats}")
+
 logger.info("Starting minihtml webserver...")
 
 if not os.path.exists("/app/html"):
-    os.mkdir("/app/html")
+    os.makedirs("/app/html")
 
 if os.path.exists("/app/minihtml"):
     os.chdir("/app/minihtml")
 
 else:
-    os.mkdir("/app/minihtml")
+    os.makedirs("/app/minihtml")
     with open("/app/minihtml/index.minihtml", "w") as f:
         f.write("""
                 [
@@ -40,23 +41,19 @@ else:
         
 
 
-try:
-    subprocess.run(["python", "/app/parse.py", "-d", "/app/minihtml", "-o", "/app/html"], check=True)
-except subprocess.CalledProcessError as e:
-    logger.error(f"Error running parse.py: {e}")
-
-# Example usage
+# The compiler and its style caches stay loaded between rebuilds, and only
+# sources reported by the watcher are hashed again.
 directory = "/app/minihtml"
-last_mod_times = get_files_mod_times(directory)
+files = watcher.make_watcher(directory)
+rebuild(directory, "/app/html")
 
 while True:
-    time.sleep(10)
-    if has_any_file_changed(directory, last_mod_times):
-        logger.info(f"Files in {directory} have been modified.")
-        try:
-            subprocess.run(["python", "/app/parse.py", "-d", directory, "-o", "/app/html"], check=True)
-            last_mod_times = get_files_mod_times(directory)
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Error running parse.py: {e}")
+    changed = watcher.wait_for_changes(files)
+    if changed is not None:
+        changed = {path for path in changed if watcher.is_source(path)}
+        if not changed:
+            continue
+        logger.info(f"Changed: {', '.join(sorted(os.path.relpath(path, directory) for path in changed))}")
     else:
-        logger.info(f"No files in {directory} have been modified.")
\ No newline at end of file
+        logger.info(f"Files in {directory} have been modified.")
+    rebuild(directory, "/app/html", changed)
@@ -0,0 +1,47 @@
+import importlib
+
+# MiniHTML compiler and site builder. Importing the package loads nothing
+# else: submodules and the names below are imported on first access, so
+# `import minihtml` costs next to nothing and minihtml.Compiler only loads
+# the compiler.
+
+SUBMODULES = ("batch", "budget", "cli", "compiler", "images", "incremental", "instrument", "parse", "passes",
+              "preview", "serve", "watcher", "wire")
+
+EXPORTS = {
+    "Parser": "compiler",
+    "Compiler": "compiler",
+    "Node": "compiler",
+    "FlatTree": "compiler",
+    "Stylesheet": "compiler",
+    "SharedSubtrees": "compiler",
+    "Limits": "compiler",
+    "LimitError": "compiler",
+    "StyleEngine": "compiler",
+    "StyleError": "compiler",
+    "iter_html": "compiler",
+    "map_source": "compiler",
+    "translation": "compiler",
+    "styles": "compiler",
+    "build": "parse",
+    "PassManager": "passes",
+    "Pass": "passes",
+    "TreePass": "passes",
+    "compile_many": "batch",
+    "CompileError": "batch",
+}
+
+__all__ = list(EXPORTS)
+
+def __getattr__(name: str):
+    if name in SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    module = EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f"{__name__}.{module}"), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + list(SUBMODULES) + __all__)
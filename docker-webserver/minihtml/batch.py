@@ -0,0 +1,87 @@
+from itertools import repeat
+from typing import TYPE_CHECKING, Iterable, List, Optional, Sequence, Union
+from .compiler import Compiler, HtmlRenderer, LimitError, Limits, Parser, TokenBuffer
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+
+# Compiling many small documents with the same translation and styles
+# tables, e.g. user-supplied snippets. The style engine is looked up once
+# per chunk instead of once per document, tokens go into a reused buffer
+# instead of Token objects and one renderer is reset between documents.
+
+class CompileError(ValueError):
+    # Returned by compile_many in place of the HTML of a document that could
+    # not be compiled, with the document's position in the input
+    def __init__(self, index: int, message: str):
+        super().__init__(index, message)
+        self.index = index
+        self.message = message
+
+    def __str__(self) -> str:
+        return f"document {self.index}: {self.message}"
+
+class BatchCompiler:
+    # Compiles documents one after another, sharing a token buffer, a
+    # renderer (its s- classes are forgotten between documents) and the
+    # attribute value table of Compiler. Not thread-safe: use one per thread.
+    # limits, when given, apply to each document on its own.
+    def __init__(self, translation: dict, styles: dict, minify: bool = False, limits: Optional[Limits] = None):
+        self.tokens = TokenBuffer()
+        self.renderer = HtmlRenderer(translation, styles, minify=minify)
+        self.strings = {}
+        self.limits = limits
+
+    def compile(self, source: str) -> str:
+        if self.limits is None:
+            root = Compiler(Parser(source).tokenize_into(self.tokens), self.strings).compile()
+            self.renderer.reset()
+            return self.renderer.render_nodes(root.children)
+        limits = self.limits.start()
+        try:
+            root = Compiler(Parser(source, limits).tokenize_into(self.tokens), self.strings, limits=limits).compile()
+        except LimitError as e:
+            raise e.locate(source)
+        self.renderer.reset()
+        self.renderer.set_limits(limits)
+        html = self.renderer.render_nodes(root.children)
+        self.renderer.check_output(html)
+        return html
+
+def compile_chunk(sources: Sequence[str], start: int, translation: dict, styles: dict,
+                  minify: bool = False, limits: Optional[Limits] = None) -> List[Union[str, CompileError]]:
+    # Unit of work for an executor. A BatchCompiler per chunk keeps its
+    # attribute table bounded and is never shared between threads.
+    batch = BatchCompiler(translation, styles, minify, limits)
+    results = []
+    for offset, source in enumerate(sources):
+        try:
+            results.append(batch.compile(source))
+        except Exception as e:
+            results.append(CompileError(start + offset, f"{type(e).__name__}: {e}"))
+    return results
+
+def compile_many(sources: Iterable[str], translation: dict, styles: dict, minify: bool = False,
+                 executor: Optional['Executor'] = None, chunk_size: int = 256,
+                 limits: Optional[Limits] = None) -> List[Union[str, CompileError]]:
+    # HTML of every source, in input order. A document that fails, or goes
+    # over limits (each document gets all of them), gives a CompileError
+    # instead of stopping the batch. With an executor (a thread
+    # or process pool, kept by the caller across batches) each chunk of
+    # chunk_size documents is one task: bigger chunks spend less on task
+    # overhead and pickling, smaller ones spread better over the workers.
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    sources = list(sources)
+    starts = range(0, len(sources), chunk_size)
+    chunks = [sources[start:start + chunk_size] for start in starts]
+    if executor is None:
+        parts = map(compile_chunk, chunks, starts, repeat(translation), repeat(styles), repeat(minify),
+                    repeat(limits))
+    else:
+        parts = executor.map(compile_chunk, chunks, starts, repeat(translation), repeat(styles), repeat(minify),
+                             repeat(limits))
+    results = []
+    for part in parts:
+        results.extend(part)
+    return results
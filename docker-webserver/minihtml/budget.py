@@ -0,0 +1,91 @@
+from fnmatch import fnmatchcase
+import json
+from typing import Dict, List, Optional
+
+# Byte budgets of built pages. The config is a JSON file next to the
+# sources (CONFIG_NAME in the source directory):
+#
+#   {"mode": "warn",
+#    "budgets": {"*": {"gzip_bytes": 14000},
+#                "blog/*": {"html_bytes": 60000, "mode": "fail"},
+#                "index.mhtml": {"elements": 400}}}
+#
+# Keys of "budgets" are glob patterns of source paths relative to the
+# source directory. Every pattern that matches a page applies, in file
+# order, so later ones override the limits and mode of earlier ones. A page
+# over a "warn" budget is reported; one over a "fail" budget also fails the
+# build.
+
+CONFIG_NAME = "minihtml-budget.json"
+METRICS = ("source_bytes", "html_bytes", "gzip_bytes", "brotli_bytes", "inline_style_bytes", "elements")
+MODES = ("warn", "fail")
+
+class BudgetError(ValueError):
+    pass
+
+def load_config(path: str) -> Optional[dict]:
+    # The validated config, or None when there is no such file
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        raise BudgetError(f"{path}: {e}")
+    if not isinstance(config, dict) or not isinstance(config.get("budgets", {}), dict):
+        raise BudgetError(f"{path}: expected an object with a \"budgets\" object")
+    if config.get("mode", "warn") not in MODES:
+        raise BudgetError(f"{path}: mode must be one of {', '.join(MODES)}")
+    for pattern, rule in config.get("budgets", {}).items():
+        if not isinstance(rule, dict):
+            raise BudgetError(f"{path}: budget {pattern!r} is not an object")
+        for name, limit in rule.items():
+            if name == "mode":
+                if limit not in MODES:
+                    raise BudgetError(f"{path}: {pattern!r}: mode must be one of {', '.join(MODES)}")
+            elif name not in METRICS:
+                raise BudgetError(f"{path}: {pattern!r}: unknown metric {name!r}, expected one of {', '.join(METRICS)}")
+            elif not isinstance(limit, int) or isinstance(limit, bool) or limit < 0:
+                raise BudgetError(f"{path}: {pattern!r}: {name} must be a whole number of at least 0")
+    return config
+
+def limits_for(page: str, config: dict) -> dict:
+    # Metric -> limit for a page, plus its "mode"
+    limits = {"mode": config.get("mode", "warn")}
+    for pattern, rule in config.get("budgets", {}).items():
+        if fnmatchcase(page, pattern):
+            limits.update(rule)
+    return limits
+
+def check(sizes: Dict[str, dict], config: Optional[dict]) -> List[dict]:
+    # Budgets exceeded by the pages measured in parse.build, one entry per
+    # page and metric. Metrics that were not measured (brotli_bytes without
+    # brotli) never exceed a budget.
+    over = []
+    if not config:
+        return over
+    for page, size in sorted(sizes.items()):
+        limits = limits_for(page, config)
+        for metric in METRICS:
+            value = size.get(metric)
+            if metric in limits and value is not None and value > limits[metric]:
+                over.append({"page": page, "metric": metric, "limit": limits[metric], "value": value,
+                             "mode": limits["mode"]})
+    return over
+
+def describe(entry: dict) -> str:
+    text = f"{entry['page']}: {entry['metric']} is {entry['value']}, over the budget of {entry['limit']}"
+    if entry["limit"]:
+        text += f" by {(entry['value'] - entry['limit']) / entry['limit']:.0%}"
+    return text
+
+def report(sizes: Dict[str, dict], over: List[dict]) -> dict:
+    # Machine-readable size report of a build, for --size-report
+    pages = [dict(page=page, **size) for page, size in sorted(sizes.items())]
+    totals = {metric: sum(page[metric] for page in pages if page.get(metric) is not None) for metric in METRICS}
+    return {
+        "totals": dict(pages=len(pages), **totals),
+        "over_budget": over,
+        "failed": any(entry["mode"] == "fail" for entry in over),
+        "pages": pages,
+    }
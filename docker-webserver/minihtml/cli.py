@@ -0,0 +1,62 @@
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+# The `minihtml` command. Each command imports only the modules it needs,
+# so `minihtml render` starts without loading the build machinery.
+
+COMMANDS = {
+    "build": "compile a directory of MiniHTML files (the options of python -m minihtml.parse)",
+    "render": "compile one MiniHTML file to HTML",
+    "preview": "live preview server for the editor extension",
+}
+
+def render(argv: List[str], prog: str):
+    parser = argparse.ArgumentParser(prog=prog, description='Compile one MiniHTML file to HTML.')
+    parser.add_argument('input', type=str, help='MiniHTML source, - for stdin')
+    parser.add_argument('-o', '--output', type=str, help='Output file, stdout by default')
+    parser.add_argument('-m', '--minify', action='store_true', help='Minify the generated HTML')
+    parser.add_argument('-r', '--root', type=str,
+                        help='Directory inc(src="...") paths are relative to; without it includes are not expanded')
+    args = parser.parse_args(argv)
+    from . import compiler
+
+    include = None
+    if args.root:
+        from . import parse
+        stack = () if args.input == '-' else (os.path.abspath(args.input),)
+        include = parse.Includes(parse.fragment_cache(os.path.abspath(args.root), args.minify), stack=stack)
+    if args.input == '-':
+        root = compiler.Compiler(compiler.Parser(sys.stdin.read()).tokenize()).compile()
+    else:
+        with compiler.map_source(args.input) as source:
+            root = compiler.Compiler(compiler.Parser(source).tokenize_spans()).compile()
+    html = compiler.Compiler.compile_to_html(root, compiler.translation, compiler.styles, minify=args.minify,
+                                             include=include)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(html)
+    else:
+        sys.stdout.buffer.write(html.encode("utf-8"))
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog='minihtml', description='MiniHTML compiler.',
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="commands:\n" + "".join(f"  {name:<8}{text}\n"
+                                                                    for name, text in COMMANDS.items()))
+    parser.add_argument('command', choices=list(COMMANDS))
+    parser.add_argument('arguments', nargs=argparse.REMAINDER, help='options of the command, see minihtml COMMAND -h')
+    args = parser.parse_args(argv)
+    prog = f"minihtml {args.command}"
+    if args.command == "build":
+        from . import parse
+        parse.main(args.arguments, prog)
+    elif args.command == "preview":
+        from . import preview
+        preview.main(args.arguments, prog)
+    else:
+        render(args.arguments, prog)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1573 @@
+from array import array
+from contextlib import contextmanager
+from enum import Enum
+from functools import lru_cache
+from itertools import chain, islice
+import mmap
+import os
+import re
+from sys import intern, maxsize
+import time
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, Dict, Optional, Set, Tuple, Union
+
+if TYPE_CHECKING:
+    from .passes import PassManager
+
+# Importing this module does no work beyond defining it: the patterns below
+# are compiled on first use and hashlib/base64 are only imported by the
+# extracted-CSS mode, so short-lived processes start quickly.
+
+class LazyPattern:
+    # Stands in for the module-level pattern `name` until its first use,
+    # then compiles it and replaces itself in the module, so later lookups
+    # get the compiled pattern directly.
+    def __init__(self, name: str, pattern, flags: int = 0):
+        self.name = name
+        self.pattern = pattern
+        self.flags = flags
+
+    def __getattr__(self, attribute: str):
+        compiled = re.compile(self.pattern, self.flags)
+        globals()[self.name] = compiled
+        return getattr(compiled, attribute)
+
+class TokenType(Enum):
+    OPEN_BRACKET = '['
+    CLOSE_BRACKET = ']'
+    TEXT = 'TEXT'
+    TAG = 'TAG'
+    ATTRIBUTE = 'ATTRIBUTE'
+
+class Token:
+    __slots__ = ('type', 'value')
+
+    def __init__(self, type: TokenType, value: str):
+        self.type = type
+        self.value = value
+    def __repr__(self) -> str:
+        return f"Token({self.type}, '{self.value}')"
+
+def decode_span(source, start: int, end: int) -> str:
+    value = source[start:end]
+    if isinstance(value, str):
+        return value
+    value = value.decode('utf-8')
+    if '\r' in value:
+        # Same newline translation open(path, "r") applies
+        value = value.replace('\r\n', '\n').replace('\r', '\n')
+    return value
+
+class SpanToken(Token):
+    # View of one SpanTokens entry; the value is sliced from the source
+    # buffer each time it is read.
+    __slots__ = ('source', 'start', 'end')
+
+    def __init__(self, type: TokenType, source, start: int, end: int):
+        self.type = type
+        self.source = source
+        self.start = start
+        self.end = end
+
+    @property
+    def value(self) -> str:
+        return decode_span(self.source, self.start, self.end)
+
+class SpanTokens:
+    # Token stream produced by Parser.tokenize_spans: token types plus
+    # parallel (start, end) offset arrays into the source buffer (a str,
+    # bytes or mmap). Substrings are only materialized by value_at, so the
+    # stream costs a few bytes per token instead of a Token and a str.
+    def __init__(self, source):
+        self.source = source
+        self.types: List[TokenType] = []
+        self.starts = array('q')
+        self.ends = array('q')
+
+    def value_at(self, index: int) -> str:
+        return decode_span(self.source, self.starts[index], self.ends[index])
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __getitem__(self, index: int) -> SpanToken:
+        return SpanToken(self.types[index], self.source, self.starts[index], self.ends[index])
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+class TokenBuffer:
+    # Token stream filled by Parser.tokenize_into: types and str values in
+    # two parallel lists that are cleared and refilled for every document,
+    # so compiling many small documents creates no Token objects and no
+    # new lists.
+    def __init__(self):
+        self.types: List[TokenType] = []
+        self.values: List[str] = []
+        self.value_at = self.values.__getitem__
+
+    def clear(self):
+        self.types.clear()
+        self.values.clear()
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __getitem__(self, index: int) -> Token:
+        return Token(self.types[index], self.values[index])
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+Source = Union[str, bytes, mmap.mmap]
+
+@contextmanager
+def map_source(path: str) -> Iterator[Source]:
+    # Memory-map a source file for Parser.tokenize_spans so the document is
+    # never read into a Python string. Tokens must not outlive the block.
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""  # mmap refuses empty files
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield buffer
+
+class Node:
+    __slots__ = ('tag', 'attributes', 'content', 'children')
+
+    def __init__(self):
+        self.tag: str = ""
+        self.attributes: Dict[str, str] = {}
+        self.content: str = ""
+        self.children: List[Node] = []
+
+class SharedSubtrees:
+    # Hash-consing table for Compiler(shared=...): a finished element that
+    # is identical to one seen before (same tag, attributes in the same
+    # order, text and children) is replaced by that one, so each distinct
+    # subtree is one Node however often it occurs. Children are already
+    # shared when their parent is looked up, so they compare by identity.
+    # The table maps a hash of that to the node, and a node only replaces
+    # another after the two are compared; two different subtrees with the
+    # same hash are both kept. Compiling several documents with one table
+    # shares subtrees between them. The trees must not be changed
+    # afterwards: a change would show at every place the node occurs, and
+    # in later compiles. compile_to_html(shared=...) renders a repeated
+    # subtree once and reuses its HTML; see HtmlRenderer.render_shared.
+    def __init__(self):
+        self.table: Dict[int, Node] = {}
+        self.repeated: Set[Node] = set()  # nodes that replaced an identical one
+        self.deduplicated = 0  # elements replaced by an identical node
+        self.collisions = 0  # elements kept because another subtree had their hash
+        self.reused = 0  # subtrees whose HTML came from the render cache
+        self.reused_html = 0  # characters of that HTML
+
+    def intern(self, node: Node) -> Node:
+        items = tuple(node.attributes.items())
+        shared = self.table.setdefault(hash((node.tag, node.content, items, *node.children)), node)
+        if shared is node:
+            return node
+        # Lists compare their items by identity first, and Nodes only by identity
+        if (shared.children == node.children and shared.tag == node.tag and shared.content == node.content
+                and tuple(shared.attributes.items()) == items):
+            self.repeated.add(shared)
+            self.deduplicated += 1
+            return shared
+        self.collisions += 1
+        return node
+
+    def stats(self) -> Dict[str, int]:
+        # nodes counts every element compiled with the table, unique the
+        # Node objects they became
+        unique = len(self.table) + self.collisions
+        return {"nodes": unique + self.deduplicated, "unique": unique, "deduplicated": self.deduplicated,
+                "repeated": len(self.repeated), "reused_renders": self.reused, "reused_html": self.reused_html}
+
+CHECK_EVERY = 4096  # tokens or elements between checks of the clock
+
+class LimitError(ValueError):
+    # A Limits maximum was exceeded. limit is the name of the Limits field
+    # and maximum its value. position is the offset in the source (in
+    # characters of a str, bytes of bytes or an mmap) of the token where
+    # it happened, and line and column are counted from 1 there. The
+    # compiler only has the index of the token (token) when it was given
+    # Token objects; locate(source) finds the position from it. Limits of
+    # the renderer name the element (tag) instead.
+    def __init__(self, limit: str, maximum, position: Optional[int] = None, token: Optional[int] = None,
+                 tag: Optional[str] = None):
+        super().__init__(limit, maximum)
+        self.limit = limit
+        self.maximum = maximum
+        self.position = position
+        self.token = token
+        self.tag = tag
+        self.line: Optional[int] = None
+        self.column: Optional[int] = None
+
+    def locate(self, source: Source) -> 'LimitError':
+        if self.position is None and self.token is not None:
+            starts = Parser(source).tokenize_spans().starts
+            if self.token < len(starts):
+                self.position = starts[self.token]
+        if self.position is not None:
+            head = source[:self.position]  # a slice of an mmap is bytes, which has count()
+            newline = '\n' if isinstance(head, str) else b'\n'
+            self.line = head.count(newline) + 1
+            self.column = self.position - head.rfind(newline)
+        return self
+
+    def __str__(self) -> str:
+        if self.line is not None:
+            where = f" at line {self.line}, column {self.column}"
+        elif self.position is not None:
+            where = f" at offset {self.position}"
+        elif self.token is not None:
+            where = f" at token {self.token}"
+        elif self.tag is not None:
+            where = f" in a {self.tag} element"
+        else:
+            where = ""
+        return f"{self.limit} limit of {self.maximum} exceeded{where}"
+
+class Limits:
+    # Maximums for compiling untrusted sources; None is no limit. Parser,
+    # Compiler and compile_to_html (and compile_many) take one and raise
+    # LimitError as soon as one is exceeded:
+    #   input_bytes   size of the source (UTF-8 bytes of a str)
+    #   tokens        tokens of the source
+    #   nodes         elements of the tree
+    #   depth         nesting of elements (children of the root are at 1)
+    #   attributes    attributes of one element
+    #   output_bytes  UTF-8 bytes of the HTML, includes too
+    #   seconds       wall-clock time
+    # The clock is read every CHECK_EVERY tokens or elements, so a stage
+    # overruns seconds by at most that much work: each token is scanned in
+    # time linear in its length, and HTML reused for shared subtrees counts
+    # as the elements it was rendered from. start() returns a copy
+    # whose clock is running, to give all stages of a document one budget;
+    # a stage given limits that were not started starts its own clock. An
+    # unterminated { or ( runs to the end of the source as one token, so
+    # input_bytes also bounds its size.
+    def __init__(self, input_bytes: Optional[int] = None, tokens: Optional[int] = None,
+                 nodes: Optional[int] = None, depth: Optional[int] = None, attributes: Optional[int] = None,
+                 output_bytes: Optional[int] = None, seconds: Optional[float] = None):
+        self.input_bytes = input_bytes
+        self.tokens = tokens
+        self.nodes = nodes
+        self.depth = depth
+        self.attributes = attributes
+        self.output_bytes = output_bytes
+        self.seconds = seconds
+        self.deadline: Optional[float] = None
+
+    def start(self) -> 'Limits':
+        limits = Limits(self.input_bytes, self.tokens, self.nodes, self.depth, self.attributes,
+                        self.output_bytes, self.seconds)
+        if self.seconds is not None:
+            limits.deadline = time.perf_counter() + self.seconds
+        return limits
+
+    def running(self) -> 'Limits':
+        return self.start() if self.seconds is not None and self.deadline is None else self
+
+    def check_clock(self, position: Optional[int] = None, token: Optional[int] = None, tag: Optional[str] = None):
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise LimitError("seconds", self.seconds, position, token, tag)
+
+    def check_input(self, source: Source):
+        maximum = self.input_bytes
+        if maximum is None or len(source) <= maximum // 4:
+            return
+        if not isinstance(source, str):
+            if len(source) > maximum:
+                raise LimitError("input_bytes", maximum, maximum).locate(source)
+            return
+        if len(source) <= maximum and len(source.encode('utf-8', 'surrogatepass')) <= maximum:
+            return
+        # Characters that fit in the limit
+        position = len(source.encode('utf-8', 'surrogatepass')[:maximum].decode('utf-8', 'ignore'))
+        raise LimitError("input_bytes", maximum, position).locate(source)
+
+    def runs(self, matches: Iterator, tokens, source: Source) -> Iterator[Iterable]:
+        # The tokenizer's matches in runs of up to CHECK_EVERY, checking the
+        # token count and the clock between runs. Each run's first match is
+        # taken here, so an error can point at it.
+        for first in matches:
+            if first.lastindex is None:
+                return  # only the end of the input is left
+            if self.tokens is not None and len(tokens) >= self.tokens:
+                raise LimitError("tokens", self.tokens, first.start(first.lastindex)).locate(source)
+            if self.deadline is not None and time.perf_counter() > self.deadline:
+                raise LimitError("seconds", self.seconds, first.start(first.lastindex)).locate(source)
+            size = CHECK_EVERY if self.tokens is None else min(CHECK_EVERY, self.tokens - len(tokens))
+            yield chain((first,), islice(matches, size - 1))
+
+def subtree_classes(node: Node) -> Optional[Tuple[str, ...]]:
+    # The class names used in node's subtree, or None when it has s-
+    # definitions (rendering it changes the classes)
+    names = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.tag.startswith('s-'):
+            return None
+        if 'class' in node.attributes:
+            names.update(node.attributes['class'].split())
+        stack.extend(node.children)
+    return tuple(names)
+
+# One alternative per token kind, in the order tokenize_loop checks them.
+# The leading class jumps over whitespace and stray characters in one step.
+# Whatever follows it starts a token, or is the end of the input: the last
+# alternative matches the characters after the last token, with no group
+# (lastindex None), so a long run of them is one match instead of a failed
+# match, retried at each of its characters.
+# Unterminated {...} and (...) bodies run to the end of the input, and the
+# ")" of an attribute body only counts outside double quotes.
+TOKEN_PATTERN = LazyPattern('TOKEN_PATTERN', r"""
+    [^\w.\-\[\]({]*
+    (?:
+        \{([^}]*)\}?                             # 1: TEXT
+      | \(([^")]*(?:"[^"]*"?[^")]*)*)\)?          # 2: ATTRIBUTE
+      | (\[)                                      # 3: OPEN_BRACKET
+      | (\])                                      # 4: CLOSE_BRACKET
+      | ([\w.\-]+)                                # 5: TAG (str.isalnum() or '-_.')
+      | \Z                                       # end of the input
+    )
+""", re.VERBOSE)
+
+# Same scanner for byte buffers. Bytes patterns only know ASCII classes, so
+# every non-ASCII byte is treated as a tag character here and runs that
+# contain one are decoded and rescanned with TOKEN_PATTERN (non-ASCII
+# whitespace and punctuation also live outside the ASCII range).
+BYTES_TOKEN_PATTERN = LazyPattern('BYTES_TOKEN_PATTERN', rb"""
+    [^\w.\-\[\]({\x80-\xff]*
+    (?:
+        \{([^}]*)\}?
+      | \(([^")]*(?:"[^"]*"?[^")]*)*)\)?
+      | (\[)
+      | (\])
+      | ([\w.\-\x80-\xff]+)
+      | \Z
+    )
+""", re.VERBOSE)
+NON_ASCII_PATTERN = LazyPattern('NON_ASCII_PATTERN', rb'[\x80-\xff]')
+
+# TOKEN_PATTERN group number -> token type
+GROUP_TYPES = (None, TokenType.TEXT, TokenType.ATTRIBUTE, TokenType.OPEN_BRACKET,
+               TokenType.CLOSE_BRACKET, TokenType.TAG)
+
+class Parser:
+    def __init__(self, text: Source, limits: Optional[Limits] = None):
+        # With limits, the tokenizers check input_bytes, tokens and seconds
+        self.text = text
+        self.limits = limits.running() if limits is not None else None
+
+    def matches(self, pattern, tokens) -> Iterable:
+        # pattern.finditer(self.text), or its runs between checks of limits
+        if self.limits is None:
+            return (pattern.finditer(self.text),)
+        self.limits.check_input(self.text)
+        return self.limits.runs(pattern.finditer(self.text), tokens, self.text)
+
+    def tokenize(self) -> List[Token]:
+        # Each match is one token; whitespace and characters that start no
+        # token (stray '}' or ')', punctuation) are skipped by the pattern
+        # exactly like the "i += 1" fall-through of tokenize_loop.
+        tokens = []
+        append = tokens.append
+        TEXT, ATTRIBUTE, TAG = TokenType.TEXT, TokenType.ATTRIBUTE, TokenType.TAG
+        OPEN_BRACKET, CLOSE_BRACKET = TokenType.OPEN_BRACKET, TokenType.CLOSE_BRACKET
+        for run in self.matches(TOKEN_PATTERN, tokens):
+            for match in run:
+                kind = match.lastindex
+                if kind == 5:
+                    append(Token(TAG, match.group(5)))
+                elif kind == 2:
+                    append(Token(ATTRIBUTE, match.group(2)))
+                elif kind == 1:
+                    append(Token(TEXT, match.group(1)))
+                elif kind == 3:
+                    append(Token(OPEN_BRACKET, '['))
+                elif kind == 4:
+                    append(Token(CLOSE_BRACKET, ']'))
+        return tokens
+
+    def tokenize_into(self, tokens: TokenBuffer) -> TokenBuffer:
+        # tokenize() into a reused buffer (str sources only)
+        tokens.clear()
+        add_type, add_value = tokens.types.append, tokens.values.append
+        for run in self.matches(TOKEN_PATTERN, tokens):
+            for match in run:
+                kind = match.lastindex
+                if kind is None:
+                    break  # end of the input
+                add_type(GROUP_TYPES[kind])
+                add_value(match.group(kind))
+        return tokens
+
+    def tokenize_spans(self) -> SpanTokens:
+        # Zero-copy mode: tokens point into self.text (str, bytes or mmap)
+        # and values are only materialized when the compiler reads them.
+        source = self.text
+        is_bytes = not isinstance(source, str)
+        pattern = BYTES_TOKEN_PATTERN if is_bytes else TOKEN_PATTERN
+        tokens = SpanTokens(source)
+        add_type, add_start, add_end = tokens.types.append, tokens.starts.append, tokens.ends.append
+        for match in chain.from_iterable(self.matches(pattern, tokens)):
+            kind = match.lastindex
+            if kind is None:
+                break  # end of the input
+            start, end = match.span(kind)
+            if kind == 5 and is_bytes and NON_ASCII_PATTERN.search(source, start, end):
+                for start, end in self.rescan_non_ascii(start, end):
+                    add_type(TokenType.TAG)
+                    add_start(start)
+                    add_end(end)
+                continue
+            add_type(GROUP_TYPES[kind])
+            add_start(start)
+            add_end(end)
+        return tokens
+
+    def rescan_non_ascii(self, start: int, end: int) -> List[Tuple[int, int]]:
+        # Split a byte run of tag characters and non-ASCII bytes with the str
+        # rules, mapping character offsets back to byte offsets.
+        run = self.text[start:end].decode('utf-8')
+        spans = []
+        position = 0
+        offset = start
+        for match in TOKEN_PATTERN.finditer(run):
+            if match.lastindex is None:
+                break  # end of the input
+            tag_start, tag_end = match.span(5)
+            offset += len(run[position:tag_start].encode('utf-8'))
+            length = len(run[tag_start:tag_end].encode('utf-8'))
+            spans.append((offset, offset + length))
+            offset += length
+            position = tag_end
+        return spans
+
+    def tokenize_loop(self) -> List[Token]:
+        # Original character-at-a-time scanner, kept as the reference the
+        # regex scanner is tested and benchmarked against.
+        tokens = []
+        i = 0
+        while i < len(self.text):
+            char = self.text[i]
+            if char.isspace():
+                i += 1
+                continue
+            if char == '{':
+                i += 1
+                text_content = []
+                while i < len(self.text) and self.text[i] != '}':
+                    text_content.append(self.text[i])
+                    i += 1
+                i += 1
+                tokens.append(Token(TokenType.TEXT, ''.join(text_content)))
+                continue
+            if char == '(':
+                i += 1
+                attr_content = []
+                in_quotes = False
+                while i < len(self.text):
+                    current_char = self.text[i]
+                    if current_char == '"':
+                        in_quotes = not in_quotes
+                    elif current_char == ')' and not in_quotes:
+                        break
+                    attr_content.append(current_char)
+                    i += 1
+                tokens.append(Token(TokenType.ATTRIBUTE, ''.join(attr_content)))
+                i += 1  # Skip the closing ')'
+                continue
+            if char in '[]':
+                token_type = TokenType.OPEN_BRACKET if char == '[' else TokenType.CLOSE_BRACKET
+                tokens.append(Token(token_type, char))
+                i += 1
+                continue
+            if self.is_tag_char(char):
+                start = i
+                while i < len(self.text) and self.is_tag_char(self.text[i]):
+                    i += 1
+                tag = self.text[start:i]
+                tokens.append(Token(TokenType.TAG, tag))
+                continue
+            i += 1
+        return tokens
+
+    def is_tag_char(self, c: str) -> bool:
+        return c.isalnum() or c in '-_.'
+
+    def parse_node(self, node: Node):
+        if self.pos >= len(self.tokens):
+            return
+
+        # Process TAG (mandatory for non-root nodes)
+        if self.tokens[self.pos].type == TokenType.TAG:
+            node.tag = self.tokens[self.pos].value
+            self.pos += 1
+        else:
+            return  # Invalid structure if there's no TAG
+
+        # Process ATTRIBUTE(s) immediately after TAG
+        while self.pos < len(self.tokens) and self.tokens[self.pos].type == TokenType.ATTRIBUTE:
+            attrs = self.parse_attributes(self.tokens[self.pos].value)
+            node.attributes.update(attrs)
+            self.pos += 1
+
+        # Process TEXT
+        if self.pos < len(self.tokens) and self.tokens[self.pos].type == TokenType.TEXT:
+            node.content = self.tokens[self.pos].value
+            self.pos += 1
+
+        # Process ATTRIBUTE(s) after TEXT
+        while self.pos < len(self.tokens) and self.tokens[self.pos].type == TokenType.ATTRIBUTE:
+            attrs = self.parse_attributes(self.tokens[self.pos].value)
+            node.attributes.update(attrs)
+            self.pos += 1
+
+        # Process children if there's an OPEN_BRACKET
+        if self.pos < len(self.tokens) and self.tokens[self.pos].type == TokenType.OPEN_BRACKET:
+            self.pos += 1
+            while self.pos < len(self.tokens) and self.tokens[self.pos].type != TokenType.CLOSE_BRACKET:
+                if self.tokens[self.pos].type == TokenType.TAG:
+                    child = Node()
+                    self.parse_node(child)
+                    node.children.append(child)
+                else:
+                    # Skip unexpected tokens within child brackets
+                    self.pos += 1
+            if self.pos < len(self.tokens) and self.tokens[self.pos].type == TokenType.CLOSE_BRACKET:
+                self.pos += 1  # Skip CLOSE_BRACKET
+
+# Ends an attribute value outside quotes
+ATTRIBUTE_SEPARATOR = LazyPattern('ATTRIBUTE_SEPARATOR', r"[, ]")
+# One key="value" pair and its separator, the way nearly all attributes are
+# written. A value ends at a separator or the end of the text, so anything
+# else after the closing quote is left to the general case.
+ATTRIBUTE_PAIR = LazyPattern('ATTRIBUTE_PAIR', r'\s*([^\s="]+)="([^"]*)"(?:[, ]|\Z)')
+
+class Compiler:
+    def __init__(self, tokens: Union[List[Token], SpanTokens, TokenBuffer], strings: Optional[Dict[str, str]] = None,
+                 shared: Optional[SharedSubtrees] = None, limits: Optional[Limits] = None):
+        # strings interns attribute values; pass one dict to every Compiler
+        # of a build to share repeated values between pages. With shared,
+        # identical subtrees become one Node (see SharedSubtrees). limits
+        # bounds nodes, depth, attributes and seconds.
+        self.tokens = tokens
+        self.pos = 0
+        self.strings = {} if strings is None else strings
+        self.shared = shared
+        self.limits = limits.running() if limits is not None else None
+        self.nodes = 0  # elements parsed
+        # parse_node calls checkpoint() when nodes reaches next_check, and
+        # compares depth and attribute counts to these
+        self.next_check = self.max_depth = self.max_attributes = maxsize
+        if limits is not None:
+            self.next_check = min(CHECK_EVERY, maxsize if limits.nodes is None else limits.nodes + 1)
+            if limits.depth is not None:
+                self.max_depth = limits.depth
+            if limits.attributes is not None:
+                self.max_attributes = limits.attributes
+        if isinstance(tokens, (SpanTokens, TokenBuffer)):
+            self.types = tokens.types
+            self.value_at = tokens.value_at
+        else:
+            self.types = [token.type for token in tokens]
+            self.value_at = lambda index: tokens[index].value
+
+    def compile(self, compact: bool = False) -> Union[Node, 'FlatTree']:
+        if compact:
+            if self.shared is not None or self.limits is not None:
+                raise ValueError("Shared subtrees and limits need a Node tree, not compact=True")
+            builder = FlatTreeBuilder(self.strings)
+            builder.feed(islice(self.tokens, self.pos, None))
+            builder.finish()
+            self.pos = len(self.tokens)
+            return builder.tree
+        root = Node()
+        types = self.types
+        count = len(types)  # len() of SpanTokens and TokenBuffer is a Python call
+        TAG, CLOSE_BRACKET = TokenType.TAG, TokenType.CLOSE_BRACKET
+        if self.pos < count and types[self.pos] == TokenType.OPEN_BRACKET:
+            self.pos += 1  # Skip root OPEN_BRACKET
+            # Parse root children (nodes inside the outermost brackets)
+            while self.pos < count and types[self.pos] != CLOSE_BRACKET:
+                if types[self.pos] == TAG:
+                    root.children.append(self.parse_node(Node()))
+                else:
+                    # Skip unexpected tokens to avoid infinite loops
+                    self.pos += 1
+            self.pos += 1  # Skip root CLOSE_BRACKET
+        return root
+
+    def parse_node(self, node: Node) -> Node:
+        # Parses the element at self.pos and its whole subtree into node.
+        # Open elements are kept on an explicit stack instead of recursing
+        # per nesting level, so depth is not bounded by the recursion limit.
+        # Returns node, or the identical node it was replaced by when
+        # subtrees are shared: each element is looked up once finished,
+        # and then takes its own place in its parent's children.
+        types, value_at, parse_attributes, strings = self.types, self.value_at, self.parse_attributes, self.strings
+        intern = self.shared.intern if self.shared is not None else None
+        TAG, ATTRIBUTE, TEXT = TokenType.TAG, TokenType.ATTRIBUTE, TokenType.TEXT
+        OPEN_BRACKET, CLOSE_BRACKET = TokenType.OPEN_BRACKET, TokenType.CLOSE_BRACKET
+        max_depth, max_attributes = self.max_depth, self.max_attributes
+        count = len(types)
+        pos = self.pos
+
+        # Process TAG (mandatory for non-root nodes)
+        if pos >= count or types[pos] != TAG:
+            return node  # Invalid structure if there's no TAG
+        if max_depth < 1:
+            raise self.limit_error("depth", max_depth, pos)
+
+        top = node
+        stack = []  # elements whose children are being parsed
+        nodes, next_check = self.nodes, self.next_check
+        while True:
+            nodes += 1
+            if nodes >= next_check:
+                self.nodes = nodes
+                next_check = self.checkpoint(pos)
+            node.tag = value_at(pos)
+            pos += 1
+
+            # Process ATTRIBUTE(s) immediately after TAG
+            while pos < count and types[pos] == ATTRIBUTE:
+                node.attributes.update(parse_attributes(value_at(pos), strings))  # Merge attributes
+                pos += 1
+
+            # Process TEXT
+            if pos < count and types[pos] == TEXT:
+                node.content = value_at(pos)
+                pos += 1
+
+            # Process ATTRIBUTE(s) after TEXT
+            while pos < count and types[pos] == ATTRIBUTE:
+                node.attributes.update(parse_attributes(value_at(pos), strings))  # Merge attributes
+                pos += 1
+            if len(node.attributes) > max_attributes:
+                raise self.limit_error("attributes", max_attributes, pos - 1)
+
+            # Process children if there's an OPEN_BRACKET
+            if pos < count and types[pos] == OPEN_BRACKET:
+                pos += 1
+                stack.append(node)
+            elif intern is not None:
+                if stack:
+                    stack[-1].children[-1] = intern(node)
+                else:
+                    top = intern(node)
+
+            # Find the next child to parse, closing finished elements
+            while stack:
+                # Skip unexpected tokens within child brackets
+                while pos < count and types[pos] != TAG and types[pos] != CLOSE_BRACKET:
+                    pos += 1
+                if pos < count and types[pos] == TAG:
+                    if len(stack) >= max_depth:
+                        raise self.limit_error("depth", max_depth, pos)
+                    node = Node()
+                    stack[-1].children.append(node)
+                    break
+                if pos < count:
+                    pos += 1  # Skip CLOSE_BRACKET
+                closed = stack.pop()
+                if intern is not None:
+                    if stack:
+                        stack[-1].children[-1] = intern(closed)
+                    else:
+                        top = intern(closed)
+            else:
+                self.pos = pos
+                self.nodes, self.next_check = nodes, next_check
+                return top
+
+    def checkpoint(self, pos: int) -> int:
+        # Every CHECK_EVERY elements, and at the one past limits.nodes.
+        # Returns the element count of the next check.
+        limits = self.limits
+        if limits.nodes is not None and self.nodes > limits.nodes:
+            raise self.limit_error("nodes", limits.nodes, pos)
+        if limits.deadline is not None and time.perf_counter() > limits.deadline:
+            raise self.limit_error("seconds", limits.seconds, pos)
+        return min(self.nodes + CHECK_EVERY, maxsize if limits.nodes is None else limits.nodes + 1)
+
+    def limit_error(self, limit: str, maximum, pos: int) -> LimitError:
+        # Span tokens know where token pos is in the source
+        if isinstance(self.tokens, SpanTokens):
+            return LimitError(limit, maximum, self.tokens.starts[pos]).locate(self.tokens.source)
+        return LimitError(limit, maximum, token=pos)
+
+    @staticmethod
+    def parse_attributes(attr_str: str, strings: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        # Same pairs as parse_attributes_loop. Texts made of key="value"
+        # pairs are matched a pair at a time; anything else is split at the
+        # quotes once and each unquoted piece is cut at '=' and separators
+        # with find/search instead of character by character. Keys are
+        # interned and values go through strings, a table shared by a whole
+        # build, so repeated values are stored once.
+        if strings is None:
+            strings = {}
+        pairs = {}
+        match = ATTRIBUTE_PAIR.match
+        pos, end = 0, len(attr_str)
+        while pos < end:
+            pair = match(attr_str, pos)
+            if pair is None:
+                break
+            key, value = pair.group(1, 2)
+            pos = pair.end()
+            # An empty value is kept unless it ends the text, as in the loop
+            if value or pos > pair.end(2) + 1:
+                value = value.strip()
+                pairs[intern(key)] = strings.setdefault(value, value)
+        else:
+            return pairs
+
+        pairs = {}
+        key = value = ''
+        parsing_key = True
+        quoted = False
+        separator = ATTRIBUTE_SEPARATOR.search
+        for piece in attr_str.split('"'):
+            if quoted:
+                value += piece
+                quoted = False
+                continue
+            quoted = True
+            pos = 0
+            while True:
+                if parsing_key:
+                    equals = piece.find('=', pos)
+                    if equals == -1:
+                        key += piece[pos:]
+                        break
+                    key += piece[pos:equals]
+                    parsing_key = False
+                    pos = equals + 1
+                else:
+                    match = separator(piece, pos)
+                    if match is None:
+                        value += piece[pos:]
+                        break
+                    end = match.start()
+                    key = key.strip()
+                    if key:
+                        value = (value + piece[pos:end]).strip()
+                        pairs[intern(key)] = strings.setdefault(value, value)
+                    key = value = ''
+                    parsing_key = True
+                    pos = end + 1
+
+        if key and value:
+            value = value.strip()
+            pairs[intern(key.strip())] = strings.setdefault(value, value)
+
+        return pairs
+
+    @staticmethod
+    def parse_attributes_loop(attr_str: str) -> Dict[str, str]:
+        pairs = {}
+        current_key = []
+        current_value = []
+        parsing_key = True
+        in_quotes = False
+
+        i = 0
+        while i < len(attr_str):
+            c = attr_str[i]
+            if c == '"' and not in_quotes:
+                in_quotes = True
+                i += 1
+                continue
+            elif c == '"' and in_quotes:
+                in_quotes = False
+                i += 1
+                continue
+
+            if in_quotes:
+                current_value.append(c)
+                i += 1
+            else:
+                if c == '=' and parsing_key:
+                    parsing_key = False
+                    i += 1
+                elif c in ', ' and not parsing_key and not in_quotes:
+                    key = ''.join(current_key).strip()
+                    value = ''.join(current_value).strip()
+                    if key:
+                        pairs[key] = value
+                    current_key = []
+                    current_value = []
+                    parsing_key = True
+                    i += 1
+                else:
+                    if parsing_key:
+                        current_key.append(c)
+                    else:
+                        current_value.append(c)
+                    i += 1
+
+        if current_key and current_value:
+            key = ''.join(current_key).strip()
+            value = ''.join(current_value).strip()
+            pairs[key] = value
+
+        return pairs
+    
+    @staticmethod
+    def compile_to_html(element: Union[Node, 'FlatTree'], translation: dict, styles: dict,
+                        stylesheet: Optional['Stylesheet'] = None, minify: bool = False,
+                        include: Optional[Callable[[str], str]] = None,
+                        image: Optional[Callable[[Dict[str, str]], Dict[str, str]]] = None,
+                        passes: Optional['PassManager'] = None, shared: Optional[SharedSubtrees] = None,
+                        limits: Optional[Limits] = None) -> str:
+        # passes adds element and tree passes to the built-in ones; tree
+        # passes turn a FlatTree into Nodes first. shared is the table the
+        # tree was compiled with, to render each repeated subtree once.
+        # limits bounds output_bytes and seconds.
+        if passes is not None and passes.tree_passes():
+            if shared is not None:
+                raise ValueError("Tree passes change the tree in place, which shared subtrees do not allow")
+            from .passes import tree_of
+            element = tree_of(element)
+            passes.run_tree_passes(element)
+        renderer = HtmlRenderer(translation, styles, stylesheet, minify, include, image, passes, shared, limits)
+        if isinstance(element, FlatTree):
+            html = renderer.render_flat(element)
+        else:
+            html = renderer.render_nodes(element.children)
+        if limits is not None:
+            renderer.check_output(html)
+        return html
+
+# Elements without end tags in HTML. </br> is left alone: browsers read it
+# as another <br>, so dropping it would change the page.
+VOID_ELEMENTS = frozenset(('area', 'base', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+                           'param', 'source', 'track', 'wbr'))
+# Elements whose text keeps its whitespace
+PREFORMATTED_ELEMENTS = frozenset(('pre', 'textarea', 'script', 'style'))
+HTML_WHITESPACE_PATTERN = LazyPattern('HTML_WHITESPACE_PATTERN', r'[ \t\n\r\f]+')
+# Raw HTML of those elements written in text, up to its end tag (or the end of the text)
+RAW_PREFORMATTED_PATTERN = LazyPattern('RAW_PREFORMATTED_PATTERN',
+                                       r'<(pre|textarea|script|style)\b.*?(?:</\1[ \t\n\r\f]*>|\Z)',
+                                       re.IGNORECASE | re.DOTALL)
+UNQUOTED_VALUE_PATTERN = LazyPattern('UNQUOTED_VALUE_PATTERN', r'[^ \t\n\r\f"\'=<>`]+')
+
+def minify_text(text: str) -> str:
+    # Collapses whitespace runs, except inside raw preformatted elements
+    if '<' not in text:
+        return HTML_WHITESPACE_PATTERN.sub(' ', text)
+    parts = []
+    position = 0
+    for match in RAW_PREFORMATTED_PATTERN.finditer(text):
+        parts.append(HTML_WHITESPACE_PATTERN.sub(' ', text[position:match.start()]))
+        parts.append(match.group())
+        position = match.end()
+    parts.append(HTML_WHITESPACE_PATTERN.sub(' ', text[position:]))
+    return ''.join(parts)
+
+def minify_css(css: str) -> str:
+    # Only used on the styles table templates, which hold no quoted strings
+    return css.replace(': ', ':').replace('; ', ';')
+
+class StyleError(ValueError):
+    # A style directive with fewer parameters than its template has {}
+    def __init__(self, directive: str, expected: int, given: int):
+        super().__init__(f"Style directive {directive!r} needs {expected} parameters, got {given}")
+        self.directive = directive
+
+class StyleEngine:
+    # Compiled form of a styles table. resolve() turns a style attribute
+    # such as "card color(red) width-height(10px, 20px)" into its CSS
+    # declarations and memoizes the result in a bounded LRU, so a directive
+    # string is only expanded once per build. Inline styles and s- class
+    # definitions both go through expand_directive:
+    # - directives are separated by spaces outside parentheses
+    # - parameters are split on commas, as many as the template has {}
+    #   (so "font(Arial, sans-serif)" keeps its comma)
+    # - unknown directives are passed through verbatim inline, and dropped
+    #   from s- class definitions
+    # - too few parameters raise StyleError
+    engines: Dict[Tuple[int, bool], 'StyleEngine'] = {}
+    max_engines = 8
+    cache_size = 4096
+
+    def __init__(self, styles: dict, minify: bool = False):
+        self.styles = styles
+        self.snapshot = dict(styles)
+        # name -> (template, number of {} placeholders)
+        self.templates = {name: (minify_css(css) if minify else css, css.count('{}'))
+                          for name, css in styles.items()}
+        self.resolve = lru_cache(maxsize=self.cache_size)(self.expand)
+
+    @classmethod
+    def for_styles(cls, styles: dict, minify: bool = False) -> 'StyleEngine':
+        # One engine per styles table, shared by every document rendered
+        # with it; rebuilt if the table was modified in place.
+        key = (id(styles), minify)
+        engine = cls.engines.get(key)
+        if engine is None or engine.styles is not styles or engine.snapshot != styles:
+            if engine is None and len(cls.engines) >= cls.max_engines:
+                del cls.engines[next(iter(cls.engines))]
+            engine = cls.engines[key] = cls(styles, minify)
+        return engine
+
+    def expand(self, style_str: str, drop_unknown: bool = False) -> Tuple[str, ...]:
+        directives = self.split_directives(style_str)
+        if drop_unknown:
+            directives = [directive for directive in directives if directive.partition('(')[0] in self.templates]
+        return tuple(self.expand_directive(directive) for directive in directives)
+
+    @staticmethod
+    def split_directives(style_str: str) -> List[str]:
+        directives = []
+        current = []
+        depth = 0
+        for char in style_str:
+            if char == '(':
+                depth += 1
+            elif char == ')' and depth:
+                depth -= 1
+            elif depth == 0 and char == ' ':
+                if current:
+                    directives.append(''.join(current))
+                    current = []
+                continue
+            current.append(char)
+        if current:
+            directives.append(''.join(current))
+        return directives
+
+    def expand_directive(self, directive: str) -> str:
+        name, paren, params = directive.partition('(')
+        template = self.templates.get(name)
+        if template is None:
+            return directive
+        css, placeholders = template
+        if not paren:
+            return css
+        if params.endswith(')'):
+            params = params[:-1]
+        values = [param.strip() for param in params.split(',', max(placeholders - 1, 0))]
+        if len(values) < placeholders:
+            raise StyleError(directive, placeholders, len(values))
+        return css.format(*values)
+
+class Stylesheet:
+    # Extracted-CSS output mode: instead of a style attribute, every
+    # distinct set of declarations becomes one generated class. Names are
+    # derived from the declarations, so pages compiled separately (or in
+    # earlier builds) agree on them and their sheets can be merged into one
+    # site-wide file.
+    def __init__(self):
+        self.rules: Dict[str, str] = {}  # class name -> declarations
+
+    def class_for(self, css: str) -> str:
+        import base64
+        import hashlib
+        digest = hashlib.sha1(css.encode('utf-8')).digest()
+        name = 'm' + base64.b32encode(digest)[:8].decode('ascii').lower()
+        existing = self.rules.setdefault(name, css)
+        if existing != css:
+            raise ValueError(f"Generated class {name} collides for {existing!r} and {css!r}")
+        return name
+
+    def update(self, other: 'Stylesheet'):
+        for name, css in other.rules.items():
+            existing = self.rules.setdefault(name, css)
+            if existing != css:
+                raise ValueError(f"Generated class {name} collides for {existing!r} and {css!r}")
+
+    def css(self) -> str:
+        return "".join(f".{name}{{{css}}}\n" for name, css in sorted(self.rules.items()))
+
+    def filename(self) -> str:
+        # Content hash in the name, so the file can be cached forever
+        import hashlib
+        return f"site.{hashlib.sha1(self.css().encode('utf-8')).hexdigest()[:12]}.css"
+
+    @staticmethod
+    def link(filename: str) -> str:
+        return f'<link rel="stylesheet" href="{filename}">'
+
+class HtmlRenderer:
+    # Rendering state for one document. Every element goes through the
+    # element passes (see passes.py) and is then written out: passes the
+    # caller registered in a passes.PassManager, then the built-in ones. s-
+    # definitions are collected in document order, so a class only applies
+    # to elements that come after its definition. include, when given,
+    # returns the HTML for inc(src="...") elements; image returns the
+    # attributes to render for an i element in place of its own. shared
+    # turns on the render cache of render_shared.
+    def __init__(self, translation: dict, styles: dict, stylesheet: Optional['Stylesheet'] = None,
+                 minify: bool = False, include: Optional[Callable[[str], str]] = None,
+                 image: Optional[Callable[[Dict[str, str]], Dict[str, str]]] = None,
+                 passes: Optional['PassManager'] = None, shared: Optional[SharedSubtrees] = None,
+                 limits: Optional[Limits] = None):
+        from . import passes as passes_module
+        self.translation = translation
+        self.styles = styles
+        self.stylesheet = stylesheet  # collects styles instead of inline style=""
+        self.minify = minify
+        self.include = include
+        self.image = image
+        self.manager = passes
+        builtins = passes_module.builtin_passes(translation, styles, stylesheet, minify, include, image)
+        self.classes = next(item for item in builtins if isinstance(item, passes_module.ClassPass))
+        self.engine = self.classes.engine
+        if passes is None:
+            self.pipeline = passes_module.Pipeline(builtins)
+        else:
+            self.pipeline = passes.pipeline(builtins)
+        self.entries = self.pipeline.entries
+        self.pipeline.begin()
+        # Passes other than the built-in ones may give a subtree different
+        # HTML at each place, so their output is not cached
+        self.shared = shared
+        self.memo: Optional[Dict[Node, list]] = None
+        if shared is not None and (passes is None or not passes.element_passes()):
+            self.memo = {}
+        self.set_limits(limits)
+
+    def reset(self):
+        # Forget the s- classes (and the state of other passes) of the
+        # previous document, to render another one with the same renderer
+        self.pipeline.begin()
+        if self.memo is not None:
+            self.memo.clear()
+        self.written = self.elements = 0
+
+    def set_limits(self, limits: Optional[Limits]):
+        # With limits, start_element counts the HTML written and reads the
+        # clock every CHECK_EVERY elements. The count is in characters,
+        # which UTF-8 never makes fewer bytes of; check_output measures the
+        # bytes of the whole page when they can be over.
+        self.limits = limits.running() if limits is not None else None
+        self.written = self.elements = 0
+        if self.limits is None:
+            vars(self).pop('start_element', None)
+        else:
+            self.start_element = self.limited_start_element
+
+    def limited_start_element(self, tag: str, attributes: Dict[str, str], content: str) -> Optional[Tuple[str, str]]:
+        element = type(self).start_element(self, tag, attributes, content)
+        limits = self.limits
+        if element is not None and limits.output_bytes is not None:
+            self.written += len(element[0]) + len(element[1])
+            if self.written > limits.output_bytes:
+                raise LimitError("output_bytes", limits.output_bytes, tag=tag)
+        self.elements += 1
+        if not self.elements % CHECK_EVERY:
+            limits.check_clock(tag=tag)
+        return element
+
+    def check_output(self, html: str):
+        maximum = self.limits.output_bytes
+        if maximum is not None and len(html) * 4 > maximum and len(html.encode('utf-8', 'surrogatepass')) > maximum:
+            raise LimitError("output_bytes", maximum)
+
+    def start_element(self, tag: str, attributes: Dict[str, str], content: str) -> Optional[Tuple[str, str]]:
+        # Returns the start tag followed by the text content, and the end
+        # tag. Elements the passes leave out (s- style definitions) return
+        # None: neither they nor their children produce output.
+        # Pipeline.run, inlined
+        visit, tag, expected, translated_tag, position = self.entries.get(tag) or self.pipeline.entry(tag)
+        element = visit(tag, attributes, content)
+        if element.__class__ is not tuple:
+            return None if element is None else (element, '')
+        tag, attributes, content = element
+        if tag != expected:
+            element = self.pipeline.resume(position + 1, tag, attributes, content)
+            if element.__class__ is not tuple:
+                return None if element is None else (element, '')
+            translated_tag, attributes, content = element
+
+        # Build final HTML
+        if self.minify:
+            return self.minified_element(translated_tag, attributes, content)
+        html_attrs = []
+        for k, v in attributes.items():
+            html_attrs.append(f'{k}="{v}"')
+
+        # Construct HTML element
+        html = [f"<{translated_tag}"]
+        if html_attrs:
+            html.append(" " + " ".join(html_attrs))
+        html.append(">")
+
+        if content:
+            html.append(content)
+
+        return "".join(html), f"</{translated_tag}>"
+
+    def minified_element(self, tag: str, attributes: Dict[str, str], content: str) -> Tuple[str, str]:
+        # Same element as start_element builds, without the bytes a browser
+        # ignores: quotes around plain attribute values, whitespace runs in
+        # text and end tags of void elements.
+        html = ["<", tag]
+        for k, v in attributes.items():
+            if UNQUOTED_VALUE_PATTERN.fullmatch(v):
+                html.append(f' {k}={v}')
+            else:
+                html.append(f' {k}="{v}"')
+        html.append(">")
+        if content:
+            if tag not in PREFORMATTED_ELEMENTS:
+                content = minify_text(content)
+            html.append(content)
+        return "".join(html), '' if tag in VOID_ELEMENTS else f"</{tag}>"
+
+    def render(self, node: Node) -> str:
+        return self.render_nodes((node,))
+
+    def render_nodes(self, nodes: Iterable[Node]) -> str:
+        # Depth-first with an explicit stack of (remaining siblings, end tag)
+        # so arbitrarily deep trees render without recursion.
+        if self.memo is not None and self.shared.repeated:
+            return self.render_shared(nodes)
+        html = []
+        stack = [(iter(nodes), '')]
+        while stack:
+            children, end = stack[-1]
+            for child in children:
+                if not child.tag:
+                    continue
+                element = self.start_element(child.tag, child.attributes, child.content)
+                if element is None:
+                    continue  # No output for style definitions
+                start, child_end = element
+                html.append(start)
+                if child.children:
+                    stack.append((iter(child.children), child_end))
+                    break
+                html.append(child_end)
+            else:
+                stack.pop()
+                html.append(end)
+        return "".join(html)
+
+    def render_shared(self, nodes: Iterable[Node]) -> str:
+        # render_nodes for a tree with shared subtrees. The HTML of a
+        # repeated subtree is kept after it is first rendered, with the
+        # styles its s- classes had then, and reused where the subtree
+        # occurs again. An s- definition in between makes the next use
+        # compare the styles of the subtree's classes; if one changed, the
+        # subtree is rendered again. Subtrees with s- definitions change the
+        # classes when they render, so they always render.
+        repeated, memo, classes, limits = self.shared.repeated, self.memo, self.classes, self.limits
+        html = []
+        stack = [(iter(nodes), '', None, 0)]  # (remaining siblings, end tag, node whose HTML is kept, its start)
+        while stack:
+            children, end, kept, mark = stack[-1]
+            for child in children:
+                if not child.tag:
+                    continue
+                keep = False
+                if child in repeated:
+                    entry = memo.get(child)
+                    if entry is None:
+                        entry = memo[child] = [-1, subtree_classes(child), None, None, 0]
+                    generation, names, styles, text, elements = entry
+                    if names is not None:
+                        if text is not None and (generation == classes.definitions or
+                                                 styles == tuple(map(classes.class_styles.get, names))):
+                            entry[0] = classes.definitions
+                            html.append(text)
+                            self.shared.reused += 1
+                            self.shared.reused_html += len(text)
+                            if limits is not None:
+                                self.count_reused(child.tag, text, elements)
+                            continue
+                        keep = True
+                        start_mark = len(html)
+                        entry[4] = self.elements
+                element = self.start_element(child.tag, child.attributes, child.content)
+                if element is None:
+                    if keep:
+                        self.remember(child, html, start_mark)
+                    continue
+                start, child_end = element
+                html.append(start)
+                if child.children:
+                    stack.append((iter(child.children), child_end, child if keep else None, start_mark if keep else 0))
+                    break
+                html.append(child_end)
+                if keep:
+                    self.remember(child, html, start_mark)
+            else:
+                stack.pop()
+                html.append(end)
+                if kept is not None:
+                    self.remember(kept, html, mark)
+        return "".join(html)
+
+    def remember(self, node: Node, html: List[str], mark: int):
+        # Keeps html[mark:] as node's HTML, joined into one piece so that an
+        # enclosing kept subtree joins fewer
+        text = "".join(html[mark:])
+        del html[mark:]
+        html.append(text)
+        classes = self.classes
+        entry = self.memo[node]
+        entry[0] = classes.definitions
+        entry[2] = tuple(map(classes.class_styles.get, entry[1]))
+        entry[3] = text
+        entry[4] = self.elements - entry[4]  # elements rendered for it, counted with limits
+
+    def count_reused(self, tag: str, text: str, elements: int):
+        # Reused HTML counts against the limits like the elements it was
+        # rendered from
+        limits = self.limits
+        if limits.output_bytes is not None:
+            self.written += len(text)
+            if self.written > limits.output_bytes:
+                raise LimitError("output_bytes", limits.output_bytes, tag=tag)
+        before = self.elements
+        self.elements += elements
+        if before // CHECK_EVERY != self.elements // CHECK_EVERY:
+            limits.check_clock(tag=tag)
+
+    def render_flat(self, tree: 'FlatTree') -> str:
+        tags, contents = tree.tag_names, tree.contents
+        first_child, next_sibling, parents = tree.first_child, tree.next_sibling, tree.parents
+        html = []
+        ends = []  # end tags of the rendered ancestors of index
+        index = first_child[0]
+        while index != -1:
+            element = self.start_element(tags[tree.tags[index]], tree.attributes(index), contents[index])
+            if element is not None:  # s- definitions render nothing, not even children
+                start, end = element
+                html.append(start)
+                if first_child[index] != -1:
+                    ends.append(end)
+                    index = first_child[index]
+                    continue
+                html.append(end)
+            # Move on to the next sibling, closing finished ancestors
+            while next_sibling[index] == -1:
+                index = parents[index]
+                if index <= 0:
+                    return "".join(html)
+                html.append(ends.pop())
+            index = next_sibling[index]
+        return "".join(html)
+
+class TokenStream:
+    # Incremental Parser.tokenize: feed() source chunks as they arrive and
+    # get back the tokens completed so far, close() returns the rest. Only
+    # the unfinished last token is held back: a match touching the end of
+    # the buffer may still grow (a tag name, or a body whose closing
+    # character has not arrived) and is rescanned with the next chunk.
+    def __init__(self):
+        self.pending: List[str] = []
+
+    def feed(self, chunk: str) -> List[Token]:
+        if not chunk:
+            return []
+        if self.pending:
+            opener = self.pending[0][0]
+            self.pending.append(chunk)
+            # Do not rescan a long unterminated body for every chunk
+            if (opener == '{' and '}' not in chunk) or (opener == '(' and ')' not in chunk):
+                return []
+            buffer = "".join(self.pending)
+            self.pending = []
+        else:
+            buffer = chunk
+        tokens = []
+        for match in TOKEN_PATTERN.finditer(buffer):
+            kind = match.lastindex
+            if kind is None:
+                break  # end of the input
+            if match.end() == len(buffer) and not self.is_closed(match):
+                start = match.start(kind) - 1 if kind <= 2 else match.start(kind)  # keep '{' / '('
+                self.pending.append(buffer[start:])
+                break
+            tokens.append(Token(GROUP_TYPES[kind], match.group(kind)))
+        return tokens
+
+    def close(self) -> List[Token]:
+        buffer = "".join(self.pending)
+        self.pending = []
+        return Parser(buffer).tokenize()
+
+    @staticmethod
+    def is_closed(match) -> bool:
+        kind = match.lastindex
+        if kind == 5:
+            return False  # a tag name can continue in the next chunk
+        if kind <= 2:
+            return match.end(kind) < match.end()  # closing '}' or ')' consumed
+        return True
+
+class TreeParser:
+    # Push-parser form of Compiler.compile/parse_node: tokens are fed one at
+    # a time and subclasses get open_element() once an element's header
+    # (TAG ATTRIBUTE* TEXT? ATTRIBUTE*) is complete and close_element() at
+    # the ']' ending its children. Only the nesting depth is kept.
+    def __init__(self, strings: Optional[Dict[str, str]] = None):
+        self.state = 'root'
+        self.strings = {} if strings is None else strings  # attribute values, see Compiler
+        self.depth = 0  # open brackets, including the root's
+        self.tag = ''
+        self.attributes: Dict[str, str] = {}
+        self.content = ''
+
+    def open_element(self, tag: str, attributes: Dict[str, str], content: str, has_children: bool):
+        raise NotImplementedError
+
+    def close_element(self):
+        raise NotImplementedError
+
+    def feed(self, tokens: Iterable[Token]):
+        for token in tokens:
+            self.process(token)
+
+    def finish(self):
+        if self.state in ('attributes', 'text_attributes'):
+            self.open_element(self.tag, self.attributes, self.content, False)
+        while self.depth > 1:
+            self.depth -= 1
+            self.close_element()
+        self.depth = 0
+        self.state = 'done'
+
+    def process(self, token: Token):
+        state = self.state
+        token_type = token.type
+
+        # Element header: TAG ATTRIBUTE* TEXT? ATTRIBUTE*
+        if state == 'attributes' or state == 'text_attributes':
+            if token_type == TokenType.ATTRIBUTE:
+                self.attributes.update(Compiler.parse_attributes(token.value, self.strings))  # Merge attributes
+                return
+            if token_type == TokenType.TEXT and state == 'attributes':
+                self.content = token.value
+                self.state = 'text_attributes'
+                return
+            has_children = token_type == TokenType.OPEN_BRACKET
+            self.open_element(self.tag, self.attributes, self.content, has_children)
+            self.state = state = 'children'
+            if has_children:
+                self.depth += 1
+                return
+            # Any other token ends a leaf element and belongs to the parent
+
+        if state == 'children':
+            if token_type == TokenType.TAG:
+                self.tag = token.value
+                self.attributes = {}
+                self.content = ''
+                self.state = 'attributes'
+            elif token_type == TokenType.CLOSE_BRACKET:
+                self.depth -= 1
+                if self.depth:
+                    self.close_element()
+                else:
+                    self.state = 'done'  # root closed, the rest is ignored
+            # Skip unexpected tokens within child brackets
+        elif state == 'root':
+            if token_type == TokenType.OPEN_BRACKET:
+                self.depth = 1
+                self.state = 'children'
+            else:
+                self.state = 'done'
+
+class StreamCompiler(TreeParser):
+    # Fused Compiler.compile and compile_to_html: renders each element as
+    # soon as its header is parsed, so memory is bounded by nesting depth
+    # instead of document size.
+    def __init__(self, translation: dict, styles: dict, stylesheet: Optional['Stylesheet'] = None,
+                 minify: bool = False, include: Optional[Callable[[str], str]] = None,
+                 image: Optional[Callable[[Dict[str, str]], Dict[str, str]]] = None,
+                 passes: Optional['PassManager'] = None):
+        super().__init__()
+        if passes is not None and passes.tree_passes():
+            raise ValueError("Tree passes need the whole tree: use compile_to_html")
+        self.renderer = HtmlRenderer(translation, styles, stylesheet, minify, include, image, passes)
+        self.ends: List[Optional[str]] = []  # end tags, None inside s- definitions
+        self.out: List[str] = []
+
+    def feed(self, tokens: Iterable[Token]) -> str:
+        super().feed(tokens)
+        return self.flush()
+
+    def close(self) -> str:
+        self.finish()
+        return self.flush()
+
+    def flush(self) -> str:
+        html = "".join(self.out)
+        self.out = []
+        return html
+
+    def open_element(self, tag, attributes, content, has_children):
+        if self.ends and self.ends[-1] is None:
+            element = None  # inside an s- definition nothing is rendered
+        else:
+            element = self.renderer.start_element(tag, attributes, content)
+        if element is None:
+            if has_children:
+                self.ends.append(None)
+            return
+        start, end = element
+        self.out.append(start)
+        if has_children:
+            self.ends.append(end)
+        else:
+            self.out.append(end)
+
+    def close_element(self):
+        end = self.ends.pop()
+        if end:
+            self.out.append(end)
+
+class FlatTree:
+    # Array-backed alternative to a Node tree, built by
+    # Compiler.compile(compact=True). Node 0 is the root; node i has tag
+    # tag_names[tags[i]], text contents[i], attributes
+    # attr_keys/attr_values[attr_offsets[i]:attr_offsets[i + 1]] and links
+    # parents/first_child/next_sibling (-1 for none). Nodes are stored in
+    # document order, which is also render order.
+    def __init__(self):
+        self.tag_names: List[str] = ['']
+        self.tag_ids: Dict[str, int] = {'': 0}
+        self.tags = array('I', [0])
+        self.parents = array('i', [-1])
+        self.first_child = array('i', [-1])
+        self.next_sibling = array('i', [-1])
+        self.attr_offsets = array('I', [0, 0])
+        self.attr_keys: List[str] = []
+        self.attr_values: List[str] = []
+        self.contents: List[str] = ['']
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+    def tag(self, index: int) -> str:
+        return self.tag_names[self.tags[index]]
+
+    def attributes(self, index: int) -> Dict[str, str]:
+        start, end = self.attr_offsets[index], self.attr_offsets[index + 1]
+        return dict(zip(self.attr_keys[start:end], self.attr_values[start:end]))
+
+    def children(self, index: int) -> Iterator[int]:
+        child = self.first_child[index]
+        while child != -1:
+            yield child
+            child = self.next_sibling[child]
+
+    def to_node(self, index: int = 0) -> Node:
+        root = self.make_node(index)
+        stack = [(index, root)]
+        while stack:
+            index, node = stack.pop()
+            for child in self.children(index):
+                child_node = self.make_node(child)
+                node.children.append(child_node)
+                stack.append((child, child_node))
+        return root
+
+    def make_node(self, index: int) -> Node:
+        node = Node()
+        node.tag = self.tag(index)
+        node.attributes = self.attributes(index)
+        node.content = self.contents[index]
+        return node
+
+class FlatTreeBuilder(TreeParser):
+    def __init__(self, strings: Optional[Dict[str, str]] = None):
+        super().__init__(strings)
+        self.tree = FlatTree()
+        self.path = [0]  # open nodes, root first
+        self.last_child = [-1]  # last child appended to each open node
+
+    def open_element(self, tag, attributes, content, has_children):
+        tree = self.tree
+        index = len(tree.tags)
+        tag_id = tree.tag_ids.get(tag)
+        if tag_id is None:
+            tag_id = tree.tag_ids[tag] = len(tree.tag_names)
+            tree.tag_names.append(tag)
+        tree.tags.append(tag_id)
+        parent = self.path[-1]
+        tree.parents.append(parent)
+        tree.first_child.append(-1)
+        tree.next_sibling.append(-1)
+        previous = self.last_child[-1]
+        if previous == -1:
+            tree.first_child[parent] = index
+        else:
+            tree.next_sibling[previous] = index
+        self.last_child[-1] = index
+        for key, value in attributes.items():
+            tree.attr_keys.append(intern(key))
+            tree.attr_values.append(value)
+        tree.attr_offsets.append(len(tree.attr_keys))
+        tree.contents.append(content)
+        if has_children:
+            self.path.append(index)
+            self.last_child.append(-1)
+
+    def close_element(self):
+        self.path.pop()
+        self.last_child.pop()
+
+def iter_html(source_chunks: Iterable[str], translation: dict, styles: dict,
+              stylesheet: Optional['Stylesheet'] = None, minify: bool = False,
+              include: Optional[Callable[[str], str]] = None,
+              image: Optional[Callable[[Dict[str, str]], Dict[str, str]]] = None,
+              passes: Optional['PassManager'] = None) -> Iterator[str]:
+    # Streaming compile: yields the HTML produced by each source chunk.
+    # "".join() of the output equals compile_to_html on the whole source.
+    # passes can only hold element passes.
+    tokens = TokenStream()
+    compiler = StreamCompiler(translation, styles, stylesheet, minify, include, image, passes)
+    for chunk in source_chunks:
+        html = compiler.feed(tokens.feed(chunk))
+        if html:
+            yield html
+    html = compiler.feed(tokens.close()) + compiler.close()
+    if html:
+        yield html
+
+translation = {
+    "d": "div",
+    "p": "p",
+    "br": "br",
+    "i": "img",
+    "l": "a",
+    "hl": "h1",
+    "hm": "h2",
+    "hs": "h3",
+    "hss": "h4",
+    "hsss": "h5",
+    "hline": "hr",
+}
+
+# Add near the bottom of the file where other dictionaries are defined
+styles = {
+    'bold': 'font-weight: bold',
+    'italic': 'font-style: italic',
+    'underline': 'text-decoration: underline',
+    'strike': 'text-decoration: line-through',
+    'text-center': 'text-align: center',
+    'text-right': 'text-align: right',
+    'card': 'border: 1px solid #ddd; border-radius: 8px; padding: 15px; margin: 10px 0',
+    'color': 'color: {}',
+    'size': 'font-size: {}',
+    'font': 'font-family: {}',
+    'background': 'background-color: {}',
+    'padding': 'padding: {}',
+    'margin': 'margin: {}',
+    'm': 'margin: {}',
+    'p': 'padding: {}',
+    'codeblock': 'background-color: #f4f4f4; padding: 10px; border-left: 3px solid #ccc',
+    'width': 'width: {}',
+    'height': 'height: {}',
+    'width-height': 'width: {}; height: {}',
+}
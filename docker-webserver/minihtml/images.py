@@ -0,0 +1,343 @@
+from functools import lru_cache
+import hashlib
+import importlib.util
+import logging
+import os
+import re
+import struct
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Local images of i(src="...") elements in a build. Pages get the image's
+# width and height (read from the file header, so browsers reserve its
+# space before it loads), loading="lazy" and, when Pillow is installed, a
+# srcset of resized and recompressed variants. Variants are named after the
+# image's content hash and written to IMAGE_DIR in the output directory, so
+# a variant that exists is up to date and later builds skip it. Without
+# Pillow the image is copied there as it is.
+
+IMAGE_DIR = "img"
+WIDTHS = (320, 640, 960, 1280, 1920)  # variant widths, when smaller than the image
+EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+URL_SCHEME_PATTERN = re.compile(r'[A-Za-z][A-Za-z0-9+.-]*:')
+UNSAFE_NAME_PATTERN = re.compile(r'[^A-Za-z0-9_-]+')  # spaces and commas would break srcset
+SAVE_OPTIONS = {
+    "JPEG": {"quality": 82, "optimize": True, "progressive": True},
+    "PNG": {"optimize": True},
+    "WEBP": {"quality": 80, "method": 6},
+}
+
+@lru_cache(maxsize=None)
+def has_pillow() -> bool:
+    # Checked without importing PIL, which takes longer than the compiler
+    return importlib.util.find_spec("PIL") is not None
+
+def image_size(path: str) -> Optional[Tuple[int, int]]:
+    # Width and height of a PNG, GIF, JPEG or WebP file as it is displayed,
+    # None for anything else
+    header = image_header(path)
+    if header is None:
+        return None
+    width, height, orientation = header
+    return (height, width) if orientation >= 5 else (width, height)
+
+def image_header(path: str) -> Optional[Tuple[int, int, int]]:
+    # Stored width and height from the file header, and the Exif orientation
+    # (1 to 8, 1 is upright; 5 to 8 turn the image a quarter), which Pillow
+    # applies to the variants and browsers to the image
+    with open(path, "rb") as f:
+        head = f.read(30)
+        if head.startswith(b"\x89PNG\r\n\x1a\n") and head[12:16] == b"IHDR":
+            f.seek(33)
+            return struct.unpack(">II", head[16:24]) + (png_orientation(f),)
+        if head[:6] in (b"GIF87a", b"GIF89a"):
+            return struct.unpack("<HH", head[6:10]) + (1,)
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP" and len(head) == 30:
+            chunk = head[12:16]
+            if chunk == b"VP8 ":
+                width, height = struct.unpack("<HH", head[26:30])
+                return width & 0x3fff, height & 0x3fff, 1
+            if chunk == b"VP8L":
+                bits = int.from_bytes(head[21:25], "little")
+                return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1, 1
+            if chunk == b"VP8X":
+                orientation = webp_orientation(f) if head[20] & 0x08 else 1  # has an EXIF chunk
+                return (int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1,
+                        orientation)
+            return None
+        if head[:2] == b"\xff\xd8":
+            f.seek(2)
+            return jpeg_header(f)
+    return None
+
+def jpeg_header(f) -> Optional[Tuple[int, int, int]]:
+    # Walks the segments to the frame header: SOF0 to SOF15, except DHT,
+    # JPG and DAC which share the range. The Exif segment (APP1) comes
+    # before it.
+    orientation = 1
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        if code == 0xFF:
+            f.seek(-1, 1)  # fill byte before the marker
+            continue
+        if code == 0x01 or 0xD0 <= code <= 0xD9:
+            continue  # markers without a segment
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+            frame = f.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack(">xHH", frame)
+            return width, height, orientation
+        if code == 0xE1:
+            segment = f.read(struct.unpack(">H", length)[0] - 2)
+            if segment.startswith(b"Exif\0\0"):
+                orientation = exif_orientation(segment[6:])
+            continue
+        f.seek(struct.unpack(">H", length)[0] - 2, 1)
+
+def png_orientation(f) -> int:
+    # eXIf comes before the image data, so the walk stops at IDAT
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8 or chunk[4:] in (b"IDAT", b"IEND"):
+            return 1
+        length = struct.unpack(">I", chunk[:4])[0]
+        if chunk[4:] == b"eXIf":
+            return exif_orientation(f.read(length))
+        f.seek(length + 4, 1)  # and the CRC
+
+def webp_orientation(f) -> int:
+    # The EXIF chunk usually follows the image data; chunks are skipped by size
+    f.seek(12)
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return 1
+        length = struct.unpack("<I", chunk[4:])[0]
+        if chunk[:4] == b"EXIF":
+            data = f.read(length)
+            return exif_orientation(data[6:] if data.startswith(b"Exif\0\0") else data)
+        f.seek(length + (length & 1), 1)  # chunks are padded to an even size
+
+def exif_orientation(tiff: bytes) -> int:
+    # The Orientation tag of the first IFD of Exif (TIFF) data, 1 when it
+    # is missing or unreadable
+    order = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+    if order is None:
+        return 1
+    try:
+        offset = struct.unpack(order + "I", tiff[4:8])[0]
+        count = struct.unpack(order + "H", tiff[offset:offset + 2])[0]
+        for entry in range(offset + 2, offset + 2 + 12 * count, 12):
+            tag, kind = struct.unpack(order + "HH", tiff[entry:entry + 4])
+            if tag == 0x0112 and kind == 3:  # Orientation, a SHORT
+                value = struct.unpack(order + "H", tiff[entry + 8:entry + 10])[0]
+                return value if 1 <= value <= 8 else 1
+    except struct.error:
+        pass  # cut short
+    return 1
+
+def scaled(size: int, source: int, target: int) -> int:
+    # The other side of an image scaled from `source` to `target`
+    return max(1, round(size * target / source))
+
+class ImageInfo:
+    __slots__ = ("stamp", "digest", "width", "height", "orientation")
+
+    def __init__(self, stamp: tuple, digest: str, width: int, height: int, orientation: int = 1):
+        self.stamp = stamp  # (mtime, size) like parse.file_stamp
+        self.digest = digest
+        self.width = width  # as displayed, after the Exif orientation
+        self.height = height
+        self.orientation = orientation
+
+IMAGE_INFO: Dict[str, ImageInfo] = {}
+
+def image_info(path: str) -> Optional[ImageInfo]:
+    # Size and content hash of an image, kept per process until the file
+    # changes. None when the size cannot be read from the header.
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    info = IMAGE_INFO.get(path)
+    if info is not None and info.stamp == stamp:
+        return info
+    header = image_header(path)
+    if header is None or 0 in header:
+        return None
+    width, height, orientation = header
+    if orientation >= 5:
+        width, height = height, width
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    info = IMAGE_INFO[path] = ImageInfo(stamp, digest, width, height, orientation)
+    return info
+
+def variant_widths(path: str, info: ImageInfo) -> List[int]:
+    # Widths to write, smallest first; 0 is a copy of the image. Animated
+    # GIFs would lose their animation, so they are only copied.
+    if not has_pillow() or path.lower().endswith(".gif"):
+        return [0]
+    return [width for width in WIDTHS if width < info.width] + [info.width]
+
+def variant_name(path: str, info: ImageInfo, width: int) -> str:
+    stem, extension = os.path.splitext(os.path.basename(path))
+    stem = UNSAFE_NAME_PATTERN.sub("-", stem).strip("-") or "image"
+    # Turned images are named apart from variants that older builds wrote
+    # without applying the orientation
+    key = info.digest[:12] if info.orientation == 1 else f"{info.digest[:12]}-o{info.orientation}"
+    if width == 0:
+        return f"{stem}.{key}{extension.lower()}"
+    return f"{stem}.{key}.{width}{extension.lower()}"
+
+class Images:
+    # HtmlRenderer image callback for one page or fragment. src is relative
+    # to root, the source directory, like inc(src="..."); URLs, absolute
+    # paths and files that are not images are left as they are. Records the
+    # variants the page uses (output name -> source path and width) and the
+    # stamps of its images, so pages are compiled again when one changes.
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.variants: Dict[str, Tuple[str, int]] = {}
+        self.stamps: Dict[str, tuple] = {}
+
+    def locate(self, src: str) -> Optional[str]:
+        if not src.lower().endswith(EXTENSIONS) or src.startswith(("/", "\\")) or URL_SCHEME_PATTERN.match(src):
+            return None
+        path = os.path.normpath(os.path.join(self.root, src))
+        if os.path.commonpath([self.root, path]) != self.root or not os.path.isfile(path):
+            return None
+        return path
+
+    def __call__(self, attributes: Dict[str, str]) -> Dict[str, str]:
+        if "srcset" in attributes:
+            return attributes  # the author picked the candidates
+        path = self.locate(attributes.get("src", ""))
+        info = image_info(path) if path is not None else None
+        if info is None:
+            return attributes
+        self.stamps[path] = info.stamp
+        candidates = []
+        for width in variant_widths(path, info):
+            name = variant_name(path, info, width)
+            self.variants[name] = (path, width)
+            candidates.append(f"{IMAGE_DIR}/{name} {width or info.width}w")
+
+        attributes = attributes.copy()
+        attributes["src"] = candidates[-1].rpartition(" ")[0]
+        # A size given by the author is kept, and a missing side follows the aspect ratio
+        width, height = attributes.get("width"), attributes.get("height")
+        if width is None and height is None:
+            attributes["width"], attributes["height"] = str(info.width), str(info.height)
+        elif height is None and width.isdigit():
+            attributes["height"] = str(scaled(info.height, info.width, int(width)))
+        elif width is None and height.isdigit():
+            attributes["width"] = str(scaled(info.width, info.height, int(height)))
+        if len(candidates) > 1:
+            attributes["srcset"] = ", ".join(candidates)
+            attributes.setdefault("sizes", f"(max-width: {info.width}px) 100vw, {info.width}px")
+        attributes.setdefault("loading", "lazy")
+        return attributes
+
+def write_image(path: str, targets: List[Tuple[int, str]]):
+    # Unit of work for the process pool: the (width, destination) variants
+    # of one image, so it is decoded once. Written under temporary names,
+    # so an interrupted build leaves no truncated variant behind. shutil is
+    # imported here: it takes longer to import than the rest of this module.
+    import shutil
+    copies = [destination for width, destination in targets if width == 0]
+    for destination in copies:
+        shutil.copyfile(path, destination + ".tmp")
+        os.replace(destination + ".tmp", destination)
+    if len(copies) == len(targets):
+        return
+    from PIL import Image, ImageOps
+    with Image.open(path) as original:
+        format = original.format
+        image = original
+        if original.getexif().get(0x0112, 1) != 1:
+            # Variants are written upright and without the Orientation tag
+            image = ImageOps.exif_transpose(original)
+        if image.mode in ("1", "P"):
+            # Palette images would be resized with nearest neighbour
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        elif format == "JPEG" and image.mode not in ("RGB", "L", "CMYK"):
+            image = image.convert("RGB")
+        image.load()
+        for width, destination in targets:
+            if width == 0:
+                continue
+            temporary = destination + ".tmp"
+            if image.width > width:
+                # reducing_gap shrinks by whole factors first, several times faster for photos
+                resized = image.resize((width, scaled(image.height, image.width, width)), Image.LANCZOS,
+                                       reducing_gap=3.0)
+                resized.save(temporary, format, **SAVE_OPTIONS.get(format, {}))
+            else:
+                image.save(temporary, format, **SAVE_OPTIONS.get(format, {}))
+                if os.path.getsize(temporary) >= os.path.getsize(path):
+                    shutil.copyfile(path, temporary)  # already smaller than Pillow writes it
+            os.replace(temporary, destination)
+
+class VariantWriter:
+    # Writes the variants missing from IMAGE_DIR in output while pages are
+    # still compiling. add() takes each page's variants as soon as it is
+    # compiled and hands every new source image to a pool of `jobs`
+    # processes (one per CPU by default), largest first, as one task that
+    # decodes it once. The pool starts with the first task, so a build with
+    # nothing to write starts none. finish() waits for the tasks and returns
+    # how many variants were written. An image that fails is logged and its
+    # variants left missing; their pages are compiled again next build.
+    def __init__(self, output: str, jobs: Optional[int] = None):
+        self.directory = os.path.join(output, IMAGE_DIR)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.seen = set()  # variant names added so far
+        self.tasks: List[Tuple[str, List[Tuple[int, str]], object]] = []  # source path, variants, future
+        self.executor = None
+
+    def add(self, variants: Dict[str, Tuple[str, int]]):
+        tasks: Dict[str, List[Tuple[int, str]]] = {}
+        for name, (path, width) in variants.items():
+            if name in self.seen:
+                continue
+            self.seen.add(name)
+            destination = os.path.join(self.directory, name)
+            if not os.path.exists(destination):
+                tasks.setdefault(path, []).append((width, destination))
+        if not tasks:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if self.executor is None:
+            # Imported here: one build in many has images to write
+            from concurrent.futures import ProcessPoolExecutor
+            self.executor = ProcessPoolExecutor(max_workers=self.jobs)
+        for path in sorted(tasks, key=os.path.getsize, reverse=True):
+            self.tasks.append((path, tasks[path], self.executor.submit(write_image, path, tasks[path])))
+
+    def finish(self) -> int:
+        written = 0
+        try:
+            for path, targets, future in self.tasks:
+                try:
+                    future.result()
+                    written += len(targets)
+                except Exception as e:
+                    logger.error(f"Failed: {path}: {e!r}")
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+            self.tasks = []
+            self.executor = None
+        return written
+
+def remove_variants(names: List[str], output: str):
+    for name in names:
+        path = os.path.join(output, IMAGE_DIR, name)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,364 @@
+from bisect import bisect_right
+from typing import Callable, Dict, List, Optional, Tuple
+from . import compiler
+from .compiler import VOID_ELEMENTS, HtmlRenderer, Node, Parser, SpanTokens, TokenType
+
+# Incremental reparsing for live preview. A Document keeps the element tree
+# of a text that is being edited, with the source span of every element.
+# An edit re-tokenizes and re-parses only the smallest element that
+# contains it (when that element would parse the same way inside the whole
+# document), so the work per keystroke follows the size of that element
+# instead of the document.
+
+ID_ATTRIBUTE = "data-mh"  # added to every rendered element, for the preview to find it
+CHUNK = 16 * 1024  # characters per chunk of a Text
+
+class Text:
+    # A str in chunks, so an edit copies about CHUNK characters instead of
+    # the whole text
+    def __init__(self, text: str):
+        self.chunks = [text[n:n + CHUNK] for n in range(0, len(text), CHUNK)] or [""]
+        self.offsets: List[int] = []  # where each chunk starts in the text
+        self.count_from(0)
+
+    def count_from(self, index: int):
+        del self.offsets[index:]
+        offset = self.offsets[-1] + len(self.chunks[index - 1]) if index else 0
+        for chunk in self.chunks[index:]:
+            self.offsets.append(offset)
+            offset += len(chunk)
+        self.length = offset
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __str__(self) -> str:
+        return "".join(self.chunks)
+
+    def locate(self, position: int) -> int:
+        # The chunk holding position, or the last one for the end of the text
+        return bisect_right(self.offsets, position) - 1
+
+    def slice(self, start: int, end: int) -> str:
+        first, last = self.locate(start), self.locate(end)
+        if first == last:
+            return self.chunks[first][start - self.offsets[first]:end - self.offsets[first]]
+        return "".join([self.chunks[first][start - self.offsets[first]:]] + self.chunks[first + 1:last] +
+                       [self.chunks[last][:end - self.offsets[last]]])
+
+    def replace(self, start: int, end: int, text: str):
+        first, last = self.locate(start), self.locate(end)
+        merged = (self.chunks[first][:start - self.offsets[first]] + text +
+                  self.chunks[last][end - self.offsets[last]:])
+        if len(merged) > 2 * CHUNK:
+            pieces = [merged[n:n + CHUNK] for n in range(0, len(merged), CHUNK)]
+        elif merged or last - first + 1 == len(self.chunks):
+            pieces = [merged]
+        else:
+            pieces = []
+        self.chunks[first:last + 1] = pieces
+        self.count_from(first)
+
+class SourceNode(Node):
+    # start is relative to the parent's start (to the document's for
+    # top-level elements), before the moves kept in the parent's shifts.
+    # index is the element's position among its parent's children, which
+    # edits never change. length runs from the tag to the last token of the
+    # element: its ']', or the end of its header.
+    __slots__ = ('start', 'length', 'parent', 'index', 'shifts')
+
+    def __init__(self):
+        super().__init__()
+        self.start = 0
+        self.length = 0
+        self.parent: Optional['SourceNode'] = None
+        self.index = 0
+        self.shifts: Optional[List[int]] = None
+
+    def shift_children(self, index: int, delta: int):
+        # Moves the children from index on by delta. The moves are kept in a
+        # Fenwick tree, so an edit costs O(log n) in the siblings after it
+        # instead of updating each of them.
+        if self.shifts is None:
+            self.shifts = [0] * (len(self.children) + 1)
+        shifts = self.shifts
+        index += 1
+        while index < len(shifts):
+            shifts[index] += delta
+            index += index & -index
+
+    def child_start(self, index: int) -> int:
+        start = self.children[index].start
+        shifts = self.shifts
+        if shifts is not None:
+            index += 1
+            while index:
+                start += shifts[index]
+                index -= index & -index
+        return start
+
+class Patch:
+    # The element with id `old` was replaced by `node`, which starts at
+    # `start` in the text
+    __slots__ = ('old', 'node', 'start')
+
+    def __init__(self, old: str, node: SourceNode, start: int):
+        self.old = old
+        self.node = node
+        self.start = start
+
+def token_end(tokens: SpanTokens, index: int) -> int:
+    # End of a token in the source, including the '}' or ')' closing a body
+    end = tokens.ends[index]
+    kind = tokens.types[index]
+    if (kind == TokenType.TEXT and tokens.source[end:end + 1] == '}') or \
+            (kind == TokenType.ATTRIBUTE and tokens.source[end:end + 1] == ')'):
+        end += 1
+    return end
+
+def contains_definition(node: Node) -> bool:
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.tag.startswith('s-'):
+            return True
+        stack.extend(node.children)
+    return False
+
+class Document:
+    def __init__(self, text: str, translation: dict = None, styles: dict = None, minify: bool = False,
+                 include: Callable[[str], str] = None):
+        # include is HtmlRenderer's inc(src="...") callback, e.g. parse.Includes
+        self.translation = compiler.translation if translation is None else translation
+        self.renderer = HtmlRenderer(self.translation, compiler.styles if styles is None else styles, minify=minify,
+                                     include=include)
+        self.next_id = 0
+        self.version = 0
+        self.load(text)
+
+    @property
+    def text(self) -> str:
+        # Joins the chunks, so it costs as much as the text's length
+        return str(self.source)
+
+    def load(self, text: str):
+        # Replaces the whole text and parses it
+        self.source = Text(text)
+        self.version += 1
+        self.root = self.parse_document(text)
+        self.find_definitions()
+
+    def new_id(self) -> str:
+        self.next_id += 1
+        return str(self.next_id)
+
+    def parse_document(self, text: str) -> SourceNode:
+        # Compiler.compile with spans
+        root = SourceNode()
+        root.length = len(text)
+        tokens = Parser(text).tokenize_spans()
+        types, count = tokens.types, len(tokens)
+        pos = 0
+        if count and types[0] == TokenType.OPEN_BRACKET:
+            pos = 1
+            while pos < count and types[pos] != TokenType.CLOSE_BRACKET:
+                if types[pos] == TokenType.TAG:
+                    child, pos = self.parse_node(tokens, count, pos)
+                    child.parent, child.index = root, len(root.children)
+                    root.children.append(child)
+                else:
+                    pos += 1
+        return root
+
+    def parse_node(self, tokens: SpanTokens, count: int, pos: int) -> Tuple[SourceNode, int]:
+        # Compiler.parse_node for the element whose tag is at pos, recording
+        # spans. Returns the element, with its start in the source, and the
+        # position after its last token.
+        parse_attributes = compiler.Compiler.parse_attributes
+        TAG, ATTRIBUTE, TEXT = TokenType.TAG, TokenType.ATTRIBUTE, TokenType.TEXT
+        OPEN_BRACKET, CLOSE_BRACKET = TokenType.OPEN_BRACKET, TokenType.CLOSE_BRACKET
+        types, starts, value_at = tokens.types, tokens.starts, tokens.value_at
+        top = node = SourceNode()
+        stack = []
+        while True:
+            node.start = starts[pos]
+            node.tag = value_at(pos)
+            pos += 1
+            while pos < count and types[pos] == ATTRIBUTE:
+                node.attributes.update(parse_attributes(value_at(pos)))
+                pos += 1
+            if pos < count and types[pos] == TEXT:
+                node.content = value_at(pos)
+                pos += 1
+            while pos < count and types[pos] == ATTRIBUTE:
+                node.attributes.update(parse_attributes(value_at(pos)))
+                pos += 1
+            node.attributes[ID_ATTRIBUTE] = self.new_id()
+            if pos < count and types[pos] == OPEN_BRACKET:
+                pos += 1
+                stack.append(node)
+            else:
+                node.length = token_end(tokens, pos - 1) - node.start
+
+            while stack:
+                while pos < count and types[pos] != TAG and types[pos] != CLOSE_BRACKET:
+                    pos += 1
+                if pos < count and types[pos] == TAG:
+                    node = SourceNode()
+                    node.parent, node.index = stack[-1], len(stack[-1].children)
+                    stack[-1].children.append(node)
+                    break
+                if pos < count:
+                    pos += 1
+                closed = stack.pop()
+                closed.length = token_end(tokens, pos - 1) - closed.start
+                for child in closed.children:
+                    child.start -= closed.start
+            else:
+                return top, pos
+
+    def reparse(self, start: int, length: int) -> Optional[SourceNode]:
+        # The element at text[start:start + length] parsed on its own, or None
+        # when it would not parse the same way inside the document: a token
+        # would run past that range, or the element would take the token
+        # after it (an unclosed '[' taking the next sibling, a header taking
+        # text or attributes after it). That token is tokenized along with
+        # the element to find out. Its type is decided by its first
+        # character, so only the start of a long one is read.
+        end = start + length
+        window = 256
+        while True:
+            after = self.source.slice(end, min(len(self.source), end + window))
+            following = compiler.TOKEN_PATTERN.match(after)
+            if following.lastindex is not None or end + len(after) == len(self.source):
+                break
+            window *= 4
+        tokens = Parser(self.source.slice(start, end) + following.group(0)).tokenize_spans()
+        count = len(tokens)
+        if following.lastindex is not None:
+            count -= 1
+        if count <= 0 or tokens.types[0] != TokenType.TAG or tokens.starts[0] != 0 \
+                or token_end(tokens, count - 1) != length or tokens.starts[-1] < length:
+            return None
+        node, pos = self.parse_node(tokens, len(tokens), 0)
+        if pos != count:
+            return None
+        return node
+
+    def edit(self, start: int, end: int, text: str) -> Optional[Patch]:
+        # Replaces text[start:end] with text. Returns the Patch when the
+        # innermost element that can be parsed again on its own was
+        # replaced, and None when the whole document was parsed again or an
+        # s- definition changed (both change the HTML outside the edit).
+        if not 0 <= start <= end <= len(self.source):
+            raise ValueError(f"Edit {start}:{end} outside of the document (length {len(self.source)})")
+        self.source.replace(start, end, text)
+        self.version += 1
+        delta = len(text) - (end - start)
+
+        # Elements containing the edit with their first and last characters
+        # untouched, outermost first, with their start in the text
+        path = []
+        node, origin = self.root, 0
+        while node.children:
+            low, high = 0, len(node.children)
+            while low < high:  # last child starting before the edit
+                middle = (low + high) // 2
+                if origin + node.child_start(middle) < start:
+                    low = middle + 1
+                else:
+                    high = middle
+            if low == 0:
+                break
+            child = node.children[low - 1]
+            child_start = origin + node.child_start(low - 1)
+            if end >= child_start + child.length:
+                break
+            path.append((child, child_start))
+            node, origin = child, child_start
+
+        # A reparse costs as much as the element's size: past half the
+        # document, parsing all of it is about as cheap
+        limit = len(self.source) // 2
+        for depth in range(len(path) - 1, -1, -1):
+            old, old_start = path[depth]
+            if old.length > limit:
+                break
+            new = self.reparse(old_start, old.length + delta)
+            if new is None:
+                continue
+            parent = old.parent
+            new.start, new.parent, new.index = old.start, parent, old.index
+            parent.children[old.index] = new
+            parent.shift_children(old.index + 1, delta)
+            for ancestor, _ in path[:depth]:
+                ancestor.length += delta
+                ancestor.parent.shift_children(ancestor.index + 1, delta)
+            self.root.length += delta
+            if contains_definition(old) or contains_definition(new) or \
+                    any(ancestor.tag.startswith('s-') for ancestor, _ in path[:depth]):
+                self.find_definitions()
+                return None
+            if old_start < self.definitions_end:
+                self.definitions_end += delta
+            if self.translation.get(new.tag, new.tag) in VOID_ELEMENTS and new.children:
+                return None  # browsers move the children out of a void element
+            return Patch(old.attributes[ID_ATTRIBUTE], new, old_start)
+
+        self.root = self.parse_document(str(self.source))
+        self.find_definitions()
+        return None
+
+    def find_definitions(self):
+        # The s- definitions the renderer records, in document order (those
+        # inside another definition are never rendered)
+        definitions = []
+        stack = [iter(self.root.children)]
+        while stack:
+            for node in stack[-1]:
+                if node.tag.startswith('s-'):
+                    definitions.append(node)
+                elif node.children:
+                    stack.append(iter(node.children))
+                    break
+            else:
+                stack.pop()
+        self.definitions = definitions
+        # Classes they leave defined for the elements after the last one,
+        # resolved on the first render_element
+        self.classes: Optional[Tuple[Dict[str, dict], Dict[str, tuple]]] = None
+        self.definitions_end = 0
+        if definitions:
+            self.definitions_end = self.absolute_start(definitions[-1]) + definitions[-1].length
+
+    def absolute_start(self, node: SourceNode) -> int:
+        start = 0
+        while node is not self.root:
+            start += node.parent.child_start(node.index)
+            node = node.parent
+        return start
+
+    def render(self) -> str:
+        # New dicts instead of renderer.reset(), which would clear self.classes
+        classes = self.renderer.classes
+        classes.globalstyles, classes.class_styles = {}, {}
+        return self.renderer.render_nodes(self.root.children)
+
+    def render_element(self, node: SourceNode, start: int = None) -> str:
+        # HTML of one element as render() gives it: with the s- classes
+        # defined before it. start is the element's position in the text,
+        # when known.
+        renderer, classes = self.renderer, self.renderer.classes
+        position = self.absolute_start(node) if start is None else start
+        if position >= self.definitions_end and self.classes is not None:
+            # Shared: elements without definitions inside only read the classes
+            classes.globalstyles, classes.class_styles = self.classes
+            return renderer.render(node)
+        classes.globalstyles, classes.class_styles = {}, {}
+        for definition in self.definitions:
+            if self.absolute_start(definition) >= position:
+                break
+            renderer.start_element(definition.tag, definition.attributes, definition.content)
+        else:
+            self.classes = (classes.globalstyles, classes.class_styles)
+        return renderer.render(node)
@@ -0,0 +1,98 @@
+from contextlib import contextmanager, nullcontext
+import time
+from typing import Dict
+
+STAGES = ("tokenize", "parse", "render")
+
+NO_STAGE = nullcontext()
+
+def no_stage(name: str):
+    # Stand-in for FileProfile.stage when not profiling
+    return NO_STAGE
+
+def count_nodes(root) -> int:
+    if hasattr(root, "tag_ids"):
+        return len(root)  # FlatTree
+    count = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.children)
+    return count
+
+class FileProfile:
+    # Measurements of compiling one page. Only created when profiling, so
+    # builds without --profile pay for a None check per stage.
+    __slots__ = ("times", "passes", "tokens", "nodes", "input_bytes", "output_bytes", "peak_memory")
+
+    def __init__(self):
+        self.times = dict.fromkeys(STAGES, 0.0)
+        self.passes: Dict[str, float] = {}  # seconds of the render stage spent in each pass
+        self.tokens = self.nodes = self.input_bytes = self.output_bytes = 0
+        self.peak_memory = None
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] += time.perf_counter() - start
+
+    @contextmanager
+    def memory(self):
+        # Peak of Python allocations while compiling, from tracemalloc. Not
+        # measured when something else is already tracing. tracemalloc is
+        # imported here as it loads pickle, which builds without --profile
+        # never need.
+        import tracemalloc
+        if tracemalloc.is_tracing():
+            yield
+            return
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def record(self, source, tokens, root, html: str):
+        self.input_bytes = len(source)
+        self.tokens = len(tokens)
+        self.nodes = count_nodes(root)
+        self.output_bytes = len(html.encode("utf-8"))
+
+    def total(self) -> float:
+        return sum(self.times.values())
+
+    def to_dict(self) -> dict:
+        result = {stage: round(seconds, 6) for stage, seconds in self.times.items()}
+        result.update(total=round(self.total(), 6), tokens=self.tokens, nodes=self.nodes,
+                      input_bytes=self.input_bytes, output_bytes=self.output_bytes, peak_memory=self.peak_memory,
+                      passes={name: round(seconds, 6) for name, seconds in self.passes.items()})
+        return result
+
+def report(profiles: Dict[str, FileProfile], elapsed: float, stats: Dict[str, int], top: int = 10) -> dict:
+    # Aggregate of a build for --profile. Pages that were unchanged and not
+    # compiled have no profile.
+    pages = [dict(page=key, **profile.to_dict()) for key, profile in sorted(profiles.items())]
+    totals = {field: sum(page[field] for page in pages)
+              for field in STAGES + ("total", "tokens", "nodes", "input_bytes", "output_bytes")}
+    totals = {field: round(value, 6) if isinstance(value, float) else value for field, value in totals.items()}
+    peaks = [page["peak_memory"] for page in pages if page["peak_memory"] is not None]
+    passes: Dict[str, float] = {}
+    for profile in profiles.values():
+        for name, seconds in profile.passes.items():
+            passes[name] = passes.get(name, 0.0) + seconds
+    return {
+        "elapsed": round(elapsed, 6),
+        "build": stats,
+        "totals": totals,
+        "passes": {name: round(seconds, 6) for name, seconds in sorted(passes.items(), key=lambda item: item[1],
+                                                                        reverse=True)},
+        "peak_memory": max(peaks) if peaks else None,
+        "slowest": sorted(pages, key=lambda page: page["total"], reverse=True)[:top],
+        "largest": sorted(pages, key=lambda page: page["output_bytes"], reverse=True)[:top],
+        "pages": pages,
+    }
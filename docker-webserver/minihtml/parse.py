@@ -0,0 +1,561 @@
+import argparse
+from functools import lru_cache
+import glob
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import logging
+from . import budget, compiler, images, instrument, passes
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # .br files are only written when the module is installed
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".minihtml-manifest.json"
+PARTIALS = "partials"  # directories of sources that are included by pages, not pages themselves
+INLINE_STYLE_PATTERN = re.compile(r'\sstyle=(?:"[^"]*"|[^\s>]+)')
+ELEMENT_PATTERN = re.compile(r'<[A-Za-z]')
+
+def compile_file(path: str, stylesheet: compiler.Stylesheet = None, minify: bool = False,
+                 profile: instrument.FileProfile = None, includes: 'Includes' = None,
+                 strings: Optional[Dict[str, str]] = None, image: 'images.Images' = None) -> str:
+    # The page's source, tokens and HTML are logged with --debug; profile,
+    # when given, receives stage timings, the time of each render pass and
+    # sizes. Without includes,
+    # inc(src="...") elements are left as they are, and so are i elements
+    # without image. strings is the attribute value table of
+    # compiler.Compiler, shared by the pages of a build.
+    stage = profile.stage if profile is not None else instrument.no_stage
+    with compiler.map_source(path) as source:
+        logger.debug("File: %s (%d bytes)", path, len(source))
+        with stage("tokenize"):
+            tokens = compiler.Parser(source).tokenize_spans()
+        logger.debug("Tokens: %s", tokens)
+        with stage("parse"):
+            root_node = compiler.Compiler(tokens, strings).compile()
+        manager = passes.PassManager(timed=True) if profile is not None else None
+        with stage("render"):
+            html = compiler.Compiler.compile_to_html(root_node, compiler.translation, compiler.styles, stylesheet,
+                                                     minify, includes, image, manager)
+        logger.debug("Generated HTML: %s", html)
+        if profile is not None:
+            profile.record(source, tokens, root_node, html)
+            profile.passes = dict(manager.times)
+        return html
+
+class IncludeError(ValueError):
+    pass
+
+def file_stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def file_size(path: str) -> int:
+    # For ordering only: a file that cannot be read fails when it is compiled
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+class Fragment:
+    __slots__ = ("html", "stylesheet", "stamps", "variants")
+
+    def __init__(self, html: str, stylesheet: Optional[compiler.Stylesheet], stamps: Dict[str, tuple],
+                 variants: Dict[str, Tuple[str, int]]):
+        self.html = html
+        self.stylesheet = stylesheet
+        self.stamps = stamps  # file_stamp of the fragment and of everything it includes
+        self.variants = variants  # image variants it uses, see images.Images
+
+class FragmentCache:
+    # Compiled inc(src="...") fragments, shared by every page that includes
+    # them. src is relative to root, the source directory. A fragment is
+    # compiled again only when it or one of its own includes (or images,
+    # with optimize_images) changed.
+    def __init__(self, root: str, minify: bool = False, extract_css: bool = False, optimize_images: bool = False):
+        self.root = os.path.abspath(root)
+        self.minify = minify
+        self.extract_css = extract_css
+        self.optimize_images = optimize_images
+        self.fragments: Dict[str, Fragment] = {}
+
+    def locate(self, src: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, src))
+        if os.path.isabs(src) or os.path.commonpath([self.root, path]) != self.root:
+            raise IncludeError(f"Include outside of {self.root}: {src!r}")
+        if not os.path.isfile(path):
+            raise IncludeError(f"Included file not found: {src!r}")
+        return path
+
+    def get(self, path: str, stack: Tuple[str, ...] = ()) -> Fragment:
+        # stack holds the files being compiled that led to this include
+        if path in stack:
+            cycle = " -> ".join(os.path.relpath(p, self.root) for p in stack[stack.index(path):] + (path,))
+            raise IncludeError(f"Include cycle: {cycle}")
+        fragment = self.fragments.get(path)
+        if fragment is not None and all(file_stamp(p) == stamp for p, stamp in fragment.stamps.items()):
+            return fragment
+        stamp = file_stamp(path)  # taken first, so an edit while compiling is seen next time
+        stylesheet = compiler.Stylesheet() if self.extract_css else None
+        includes = Includes(self, stylesheet, stack + (path,))
+        image = images.Images(self.root) if self.optimize_images else None
+        html = compile_file(path, stylesheet, self.minify, includes=includes, image=image)
+        includes.stamps[path] = stamp
+        if image is not None:
+            includes.stamps.update(image.stamps)
+            includes.variants.update(image.variants)
+        fragment = self.fragments[path] = Fragment(html, stylesheet, includes.stamps, includes.variants)
+        return fragment
+
+class Includes:
+    # HtmlRenderer include callback for one page or fragment. Records every
+    # file included, directly or through other fragments, and the image
+    # variants they use, and adds their generated classes to the page's
+    # stylesheet.
+    def __init__(self, fragments: FragmentCache, stylesheet: compiler.Stylesheet = None, stack: Tuple[str, ...] = ()):
+        self.fragments = fragments
+        self.stylesheet = stylesheet
+        self.stack = stack
+        self.stamps: Dict[str, tuple] = {}
+        self.variants: Dict[str, Tuple[str, int]] = {}
+
+    def __call__(self, src: str) -> str:
+        fragment = self.fragments.get(self.fragments.locate(src), self.stack)
+        self.stamps.update(fragment.stamps)
+        self.variants.update(fragment.variants)
+        if self.stylesheet is not None:
+            self.stylesheet.update(fragment.stylesheet)
+        return fragment.html
+
+FRAGMENT_CACHES: Dict[tuple, FragmentCache] = {}
+
+def fragment_cache(root: str, minify: bool = False, extract_css: bool = False,
+                   optimize_images: bool = False) -> FragmentCache:
+    # One cache per process and build options, so later builds of a
+    # long-running process (and every page a pool worker compiles) reuse it
+    key = (os.path.abspath(root), minify, extract_css, optimize_images)
+    if key not in FRAGMENT_CACHES:
+        FRAGMENT_CACHES[key] = FragmentCache(root, minify, extract_css, optimize_images)
+    return FRAGMENT_CACHES[key]
+
+def output_path_for(file: str, output: str) -> str:
+    return os.path.join(output, file.replace(".minihtml", ".html").replace(".mhtml", ".html"))
+
+def gzip_bytes(data: bytes) -> bytes:
+    # mtime=0 keeps the archive identical for identical pages
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=9, mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+def brotli_bytes(data: bytes) -> bytes:
+    return brotli.compress(data, quality=11)
+
+def write_output(path: str, text: str, compress: bool = False) -> bool:
+    # Writes a page or stylesheet, plus .gz/.br copies for nginx's
+    # gzip_static when compress is set. Files whose content did not change
+    # are left alone, so their mtime stays and nothing is recompressed.
+    # Returns whether anything was written.
+    data = text.encode("utf-8")
+    compressed = {path + ".gz": gzip_bytes} if compress else {}
+    if compress and brotli is not None:
+        compressed[path + ".br"] = brotli_bytes
+
+    unchanged = False
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            unchanged = f.read() == data
+    written = False
+    if not unchanged:
+        with open(path, "wb") as f:
+            f.write(data)
+        written = True
+    for compressed_path, compress_bytes in compressed.items():
+        if unchanged and os.path.exists(compressed_path):
+            continue
+        packed = compress_bytes(data)
+        if len(packed) < len(data):
+            with open(compressed_path, "wb") as f:
+                f.write(packed)
+            written = True
+        elif os.path.exists(compressed_path):
+            os.remove(compressed_path)  # tiny pages are served as they are
+            written = True
+    # Without compression a stale copy would be served instead of the page
+    for stale in (path + ".gz", path + ".br"):
+        if stale not in compressed and os.path.exists(stale):
+            os.remove(stale)
+            written = True
+    return written
+
+def write_stylesheet(stylesheet: compiler.Stylesheet, output: str, compress: bool = False,
+                     remove_old: bool = True) -> str:
+    filename = stylesheet.filename()
+    write_output(os.path.join(output, filename), stylesheet.css(), compress)
+    # Once every page is written, only the current sheet is referenced
+    if remove_old:
+        for old in glob.glob(os.path.join(output, "site.*.css*")):
+            if not os.path.basename(old).startswith(filename):
+                os.remove(old)
+    return filename
+
+@lru_cache(maxsize=None)
+def compiler_version() -> str:
+    # Hash of the modules that shape a page's output, so changing one
+    # rebuilds everything. Cached: a running process keeps its imported code.
+    digest = hashlib.sha256()
+    for path in (compiler.__file__, passes.__file__, images.__file__, budget.__file__, __file__):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def source_hash(path: str) -> str:
+    with compiler.map_source(path) as source:
+        return hashlib.sha256(source).hexdigest()
+
+def load_manifest(output: str) -> dict:
+    try:
+        with open(os.path.join(output, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}  # first build, or unreadable: compile everything
+    return manifest if isinstance(manifest, dict) else {}
+
+def save_manifest(output: str, manifest: dict):
+    path = os.path.join(output, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def measure_page(source: str, output: str) -> Dict[str, Optional[int]]:
+    # Sizes of a built page for the budget report. Compressed sizes are
+    # those of the .gz/.br files when the build wrote them, and otherwise
+    # what the same compression would give; brotli_bytes is None without
+    # the brotli module.
+    with open(output, "rb") as f:
+        data = f.read()
+    html = data.decode("utf-8")
+    sizes = {"source_bytes": os.path.getsize(source), "html_bytes": len(data)}
+    for metric, extension, compress in (("gzip_bytes", ".gz", gzip_bytes), ("brotli_bytes", ".br", brotli_bytes)):
+        if os.path.exists(output + extension):
+            sizes[metric] = os.path.getsize(output + extension)
+        elif compress is brotli_bytes and brotli is None:
+            sizes[metric] = None
+        else:
+            sizes[metric] = len(compress(data))
+    sizes["inline_style_bytes"] = sum(len(match) for match in INLINE_STYLE_PATTERN.findall(html))
+    sizes["elements"] = len(ELEMENT_PATTERN.findall(html))
+    return sizes
+
+def check_budgets(sizes: Dict[str, dict], config: Optional[dict]) -> dict:
+    # Size report of the pages measured by build(), against the budgets of
+    # a budget.load_config() config. Pages over budget are logged as
+    # warnings, or as errors for "fail" budgets.
+    over = budget.check(sizes, config)
+    for entry in over:
+        (logger.error if entry["mode"] == "fail" else logger.warning)(f"Over budget: {budget.describe(entry)}")
+    return budget.report(sizes, over)
+
+def remove_output(path: str):
+    for stale in (path, path + ".gz", path + ".br"):
+        if os.path.exists(stale):
+            os.remove(stale)
+
+def compile_page(path: str, extract_css: bool, minify: bool, profile: bool = False, root: str = None,
+                 strings: Optional[Dict[str, str]] = None, optimize_images: bool = False) -> tuple:
+    # Unit of work for the process pool: the page HTML, its generated style
+    # classes when extracting CSS, its profile when profiling, the paths of
+    # the files it includes from root (images too, with optimize_images)
+    # and the image variants it uses. Files are only written by the parent.
+    page_stylesheet = compiler.Stylesheet() if extract_css else None
+    includes = image = None
+    if root is not None:
+        includes = Includes(fragment_cache(root, minify, extract_css, optimize_images), page_stylesheet,
+                            (os.path.abspath(path),))
+        if optimize_images:
+            image = images.Images(root)
+    page_profile = instrument.FileProfile() if profile else None
+    html = compile_file(path, page_stylesheet, minify, page_profile, includes, strings, image)
+    if profile:
+        # tracemalloc slows compiling several times over, so peak memory
+        # comes from a second, untimed compile
+        with page_profile.memory():
+            compile_file(path, compiler.Stylesheet() if extract_css else None, minify, includes=includes, image=image)
+    included, variants = {}, {}
+    for recorder in (includes, image):
+        if recorder is not None:
+            included.update(recorder.stamps)
+            variants.update(recorder.variants)
+    return html, page_stylesheet.rules if extract_css else None, page_profile, sorted(included), variants
+
+def compile_pages(tasks: List[Tuple[str, str]], extract_css: bool, minify: bool, jobs: int,
+                  profile: bool = False, root: str = None, optimize_images: bool = False,
+                  compiled: Optional[Callable[[str, tuple], None]] = None) -> Dict[str, tuple]:
+    # Compiles (key, path) tasks, largest file first so one big page does
+    # not end up running alone at the end. Returns key -> compile_page()
+    # result or key -> exception; one failing page does not stop the others.
+    # compiled(key, result) is called for each page as soon as it compiles.
+    tasks = sorted(tasks, key=lambda task: file_size(task[1]), reverse=True)
+    results = {}
+    if jobs <= 1 or len(tasks) <= 1:
+        strings = {}  # attribute values interned across the build
+        for key, path in tasks:
+            try:
+                results[key] = compile_page(path, extract_css, minify, profile, root, strings, optimize_images)
+            except Exception as e:
+                results[key] = e
+                continue
+            if compiled is not None:
+                compiled(key, results[key])
+        return results
+    # Worker processes intern attribute values per page, as a shared table
+    # would be copied to every task anyway. concurrent.futures is imported
+    # here: it is most of parse's import time and one job needs no pool.
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(compile_page, path, extract_css, minify, profile, root, None, optimize_images): key
+                   for key, path in tasks}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                results[key] = e
+                continue
+            if compiled is not None:
+                compiled(key, results[key])
+    return results
+
+def build(directory: str, output: str, extract_css: bool = False, minify: bool = False,
+          compress: bool = False, jobs: int = 1, changed: Optional[Set[str]] = None,
+          profiles: Optional[Dict[str, instrument.FileProfile]] = None,
+          optimize_images: bool = True, sizes: Optional[Dict[str, dict]] = None) -> Dict[str, int]:
+    # Incremental build: the manifest in output maps each source (relative
+    # to directory) to its hash, compiler version and output file. Only new
+    # or changed sources are compiled, by `jobs` processes, and outputs of
+    # removed ones are deleted.
+    # `changed`: paths a watcher saw modified; other sources are not hashed.
+    # Includes (sources in `partials`) and images are recorded per page, so
+    # editing one rebuilds the pages that use it.
+    # `profiles` and `sizes` dicts get each compiled page's profile and
+    # every page's measure_page() sizes, which the manifest keeps.
+    options = "".join(flag for flag, enabled in (("c", extract_css), ("m", minify), ("z", compress),
+                                                 ("i", optimize_images)) if enabled)
+    version = f"{compiler_version()}-{options}" if options else compiler_version()
+    manifest = load_manifest(output)
+    previous = manifest.get("sources", {})
+    sources = {}
+    stats = {"compiled": 0, "unchanged": 0, "removed": 0, "failed": 0}
+
+    site_stylesheet = compiler.Stylesheet()
+    linked_pages = []  # unchanged pages that link the stylesheet
+    tasks = []  # (key, source path) to compile
+    pending = {}  # key -> new manifest entry, once compiled
+    if changed is not None:
+        changed = {os.path.abspath(path) for path in changed}
+
+    include_hashes = {}  # key -> hash of included files, computed once per build
+    def include_hash(include_key: str) -> Optional[str]:
+        if include_key not in include_hashes:
+            path = os.path.join(directory, include_key)
+            include_hashes[include_key] = source_hash(path) if os.path.isfile(path) else None
+        return include_hashes[include_key]
+
+    def includes_unchanged(entry: dict) -> bool:
+        for include_key, recorded in entry.get("includes", {}).items():
+            if changed is not None and os.path.abspath(os.path.join(directory, include_key)) not in changed:
+                continue
+            if include_hash(include_key) != recorded:
+                return False
+        return True
+
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(name for name in dirs if name != PARTIALS)
+        for file in sorted(files):
+            if file.endswith((".minihtml", ".mhtml")):
+                path = os.path.join(root, file)
+                key = os.path.relpath(path, directory).replace(os.sep, "/")
+                output_file_path = output_path_for(file, output)
+                output_name = os.path.basename(output_file_path)
+                entry = previous.get(key)
+                if entry and changed is not None and os.path.abspath(path) not in changed:
+                    digest = entry.get("hash")
+                else:
+                    digest = source_hash(path)
+
+                if (entry and entry.get("hash") == digest and entry.get("compiler") == version
+                        and entry.get("output") == output_name and os.path.exists(output_file_path)
+                        and includes_unchanged(entry) and all(
+                            os.path.exists(os.path.join(output, images.IMAGE_DIR, name))
+                            for name in entry.get("images", ()))):
+                    sources[key] = entry
+                    stats["unchanged"] += 1
+                    if extract_css and entry.get("styles"):
+                        page_stylesheet = compiler.Stylesheet()
+                        page_stylesheet.rules.update(entry["styles"])
+                        site_stylesheet.update(page_stylesheet)
+                        linked_pages.append((key, output_file_path))
+                    continue
+
+                pending[key] = {"hash": digest, "compiler": version, "output": output_name}
+                tasks.append((key, path))
+
+    # Images are written by their own pool while the pages compile
+    writer = images.VariantWriter(output, jobs if jobs > 1 else None)
+    try:
+        results = compile_pages(tasks, extract_css, minify, jobs, profiles is not None, directory, optimize_images,
+                                lambda key, result: writer.add(result[4]))
+    finally:
+        written = writer.finish()  # before the pages that use them are written
+    if written:
+        logger.info(f"Images: wrote {written} of {len(writer.seen)} variants")
+    pages = []  # (output path, html, uses the stylesheet) when extracting CSS
+    for key, path in tasks:
+        result = results[key]
+        if isinstance(result, Exception):
+            # Keep the old output; without a manifest entry it is retried next build
+            logger.error(f"Failed: {key}: {result!r}")
+            stats["failed"] += 1
+            continue
+        html, styles, page_profile, included, page_variants = result
+        if profiles is not None:
+            profiles[key] = page_profile
+        entry = sources[key] = pending[key]
+        if included:
+            include_keys = [os.path.relpath(path, directory).replace(os.sep, "/") for path in included]
+            entry["includes"] = {include_key: include_hash(include_key) for include_key in include_keys}
+        if page_variants:
+            entry["images"] = sorted(page_variants)
+        stats["compiled"] += 1
+        output_file_path = os.path.join(output, entry["output"])
+        if not extract_css:
+            write_output(output_file_path, html, compress)
+            continue
+        page_stylesheet = compiler.Stylesheet()
+        page_stylesheet.rules.update(styles)
+        site_stylesheet.update(page_stylesheet)
+        entry["styles"] = styles
+        pages.append((output_file_path, html, bool(styles)))
+
+    outputs = {entry["output"] for entry in sources.values()}
+    for key, entry in previous.items():
+        if key not in sources and key not in pending and entry.get("output") and entry["output"] not in outputs:
+            logger.info(f"Removed: {key}")
+            remove_output(os.path.join(output, entry["output"]))
+            stats["removed"] += 1
+    # Old outputs of pages that failed are kept, and so are their images
+    used = {name for key, entry in previous.items() if key in pending and key not in sources
+            for name in entry.get("images", ())}
+    used.update(name for entry in sources.values() for name in entry.get("images", ()))
+    images.remove_variants(sorted({name for entry in previous.values() for name in entry.get("images", ())} - used),
+                           output)
+
+    filename = None
+    if extract_css:
+        # The file name depends on every page's styles, so pages are
+        # written once all of them are compiled. Old outputs of pages that
+        # failed may link an old sheet, so those are kept until none fail.
+        filename = write_stylesheet(site_stylesheet, output, compress, remove_old=not stats["failed"])
+        logger.info(f"Stylesheet: {filename} ({len(site_stylesheet.rules)} classes)")
+        link = compiler.Stylesheet.link(filename)
+        for output_file_path, html, styled in pages:
+            write_output(output_file_path, link + html if styled else html, compress)
+        old_filename = manifest.get("stylesheet")
+        if old_filename and old_filename != filename:
+            # Unchanged pages only need to point at the new stylesheet
+            old_link = compiler.Stylesheet.link(old_filename)
+            for key, output_file_path in linked_pages:
+                with open(output_file_path, "r") as f:
+                    html = f.read()
+                if html.startswith(old_link):
+                    write_output(output_file_path, link + html[len(old_link):], compress)
+                    sources[key].pop("sizes", None)  # measured again
+    elif manifest.get("stylesheet"):
+        if stats["failed"]:
+            filename = manifest["stylesheet"]  # still linked by old outputs, removed by a later build
+        else:
+            remove_output(os.path.join(output, manifest["stylesheet"]))
+
+    if sizes is not None:
+        for key, entry in sources.items():
+            if "sizes" not in entry:
+                entry["sizes"] = measure_page(os.path.join(directory, key), os.path.join(output, entry["output"]))
+            sizes[key] = dict(entry["sizes"], output=entry["output"])
+
+    save_manifest(output, {"stylesheet": filename, "sources": sources})
+    logger.info(f"Compiled {stats['compiled']}, unchanged {stats['unchanged']}, "
+                f"removed {stats['removed']}, failed {stats['failed']}")
+    return stats
+
+def main(argv: Optional[List[str]] = None, prog: Optional[str] = None):
+    parser = argparse.ArgumentParser(prog=prog, description='Compile a directory of MiniHTML files to HTML.')
+    parser.add_argument('-d', '--directory', type=str, help='Directory to process')
+    parser.add_argument('-o', '--output', type=str, help='Output directory')
+    parser.add_argument('-c', '--extract-css', action='store_true',
+                        help='Move styles into one content-hashed stylesheet instead of inline style attributes')
+    parser.add_argument('-m', '--minify', action='store_true', help='Minify the generated HTML')
+    parser.add_argument('-z', '--compress', action='store_true',
+                        help='Also write .gz (and .br if brotli is installed) files for nginx gzip_static')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of processes compiling pages and images (images: one per CPU by default)')
+    parser.add_argument('--no-images', dest='optimize_images', action='store_false',
+                        help='Leave i(src="...") elements as they are instead of sizing and resizing local images')
+    parser.add_argument('--profile', type=str, metavar='REPORT',
+                        help='Write per-page timings, sizes and peak memory of compiled pages to a JSON file')
+    parser.add_argument('--size-report', type=str, metavar='REPORT',
+                        help='Write the source, HTML, compressed and inline style bytes and element count of '
+                             'every page, and the budgets they exceed, to a JSON file')
+    parser.add_argument('--budget', type=str, metavar='CONFIG',
+                        help=f'Budgets to check pages against (default: {budget.CONFIG_NAME} in the directory, if any)')
+    parser.add_argument('--debug', action='store_true', help="Log every page's source, tokens and HTML")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.directory:
+        if not args.output:
+            raise NameError("No output directory specified")
+        logger.info(f"Directory specified: {args.directory}")
+        logger.info(f"Output directory specified: {args.output}")
+        os.makedirs(args.output, exist_ok=True)
+        # Loaded first, so a broken config fails before the build
+        config = budget.load_config(args.budget or os.path.join(args.directory, budget.CONFIG_NAME))
+        if args.budget and config is None:
+            parser.error(f"budget config not found: {args.budget}")
+        profiles = {} if args.profile else None
+        sizes = {} if args.size_report or config is not None else None
+        start = time.perf_counter()
+        stats = build(args.directory, args.output, args.extract_css, args.minify, args.compress, args.jobs,
+                      profiles=profiles, optimize_images=args.optimize_images, sizes=sizes)
+        if args.profile:
+            with open(args.profile, "w") as f:
+                json.dump(instrument.report(profiles, time.perf_counter() - start, stats), f, indent=2)
+            logger.info(f"Profile: {args.profile}")
+        over_budget = False
+        if sizes is not None:
+            size_report = check_budgets(sizes, config)
+            over_budget = size_report["failed"]
+            if args.size_report:
+                size_report["time"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+                size_report["compiler"] = compiler_version()
+                with open(args.size_report, "w") as f:
+                    json.dump(size_report, f, indent=2)
+                logger.info(f"Size report: {args.size_report}")
+        if stats["failed"] or over_budget:
+            sys.exit(1)
+    else:
+        raise NameError("No directory specified")
+
+if __name__ == "__main__":
+    main()
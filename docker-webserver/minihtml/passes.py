@@ -0,0 +1,328 @@
+import time
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple, Union
+from .compiler import FlatTree, Node, StyleEngine, Stylesheet
+
+# Passes over the elements of a document. Element passes (Pass) run inside
+# the renderer's walk: every element goes through them, in order, right
+# before its HTML is written, so any number of them costs one traversal.
+# A pass names the tags it runs on, and the renderer keeps the list of
+# passes to call per tag, so an element only pays for the passes that want
+# it. Tag renames (TagMap) are applied when that list is made, not per
+# element. Tree passes (TreePass) need the whole tree before anything is
+# written; each is a walk of its own and they run before rendering.
+#
+# The renderer's own steps are passes too, after the ones it is given:
+# includes, images, s- classes and styles, then the translation table.
+
+Element = Tuple[str, Dict[str, str], str]
+Result = Union[None, str, Element]
+
+MAX_CHAINS = 4096  # tags whose pass lists are kept; others are worked out per element
+
+class Pass:
+    # visit() gets an element's tag, attributes and text and returns them,
+    # changed or not. It can also return a str, written in place of the
+    # element's start tag and text (its children still render after it), or
+    # None to leave the element and its children out. The attributes dict
+    # belongs to the tree: copy it before changing it. tags, when set, is
+    # the tags (as this pass sees them) the pass runs on.
+    name = ""
+    tags: Optional[FrozenSet[str]] = None
+
+    def begin(self):
+        # A renderer starts a document; state of the previous one goes here
+        pass
+
+    def visitor(self, tag: str) -> Optional[Callable[[str, Dict[str, str], str], Result]]:
+        # The function elements with this tag go through, or None to skip
+        # them. Asked once per tag, so a pass can choose a method by tag.
+        return self.visit if self.tags is None or tag in self.tags else None
+
+    def visit(self, tag: str, attributes: Dict[str, str], content: str) -> Result:
+        return tag, attributes, content
+
+class TagMap(Pass):
+    # Renames tags by a table. The rename is looked up once per tag when the
+    # renderer makes its list of passes for that tag, not for every element.
+    def __init__(self, table: Dict[str, str], name: str = "tags"):
+        self.table = table
+        self.name = name
+
+    def visit(self, tag, attributes, content):
+        return self.table.get(tag, tag), attributes, content
+
+class TreePass:
+    # Runs on the whole tree before it renders, for work that needs all of
+    # it first (a table of contents of the page's headings, say). The tree
+    # can be changed in place.
+    name = ""
+
+    def run(self, root: Node):
+        raise NotImplementedError
+
+class FunctionPass(Pass):
+    def __init__(self, visit: Callable[[str, Dict[str, str], str], Result], tags: Iterable[str] = None,
+                 name: str = None):
+        self.visit = visit
+        self.tags = frozenset(tags) if tags is not None else None
+        self.name = name or visit.__name__
+
+# Built-in passes
+
+class IncludePass(Pass):
+    # inc(src="...") elements become the HTML of the file. Included
+    # fragments are rendered on their own, so s- classes of the page and of
+    # the fragment do not apply to each other.
+    name = "include"
+    tags = frozenset(("inc",))
+
+    def __init__(self, include: Callable[[str], str]):
+        self.include = include
+
+    def visit(self, tag, attributes, content):
+        return self.include(attributes.get('src', ''))
+
+class ImagePass(Pass):
+    # i elements get the attributes the image callback returns
+    name = "image"
+    tags = frozenset(("i",))
+
+    def __init__(self, image: Callable[[Dict[str, str]], Dict[str, str]]):
+        self.image = image
+
+    def visit(self, tag, attributes, content):
+        return tag, self.image(attributes), content
+
+class ClassPass(Pass):
+    # s- definitions are collected into globalstyles in document order, so
+    # a class only applies to elements that come after its definition, and
+    # render nothing. Each class is resolved to its CSS declarations once,
+    # when it is defined. Other elements get the styles of their classes and
+    # of their style attribute as one style attribute, or as a generated
+    # class of the stylesheet when there is one.
+    name = "classes"
+
+    def __init__(self, styles: dict, stylesheet: Optional[Stylesheet] = None, minify: bool = False):
+        self.engine = StyleEngine.for_styles(styles, minify)
+        self.stylesheet = stylesheet
+        self.separator = ';' if minify else '; '
+        self.globalstyles = {}  # Class-based styles storage
+        self.class_styles: Dict[str, Tuple[str, ...]] = {}
+        self.definitions = 0  # s- definitions so far, so caches of rendered HTML can tell they are current
+
+    def begin(self):
+        self.globalstyles.clear()
+        self.class_styles.clear()
+        self.definitions = 0
+
+    def visitor(self, tag):
+        return self.define if tag.startswith('s-') else self.visit
+
+    def define(self, tag, attributes, content):
+        # Remove s- prefix when storing the style
+        class_name = tag[2:]  # 'text' from 's-text'
+        self.globalstyles[class_name] = attributes.copy()
+        self.class_styles[class_name] = self.engine.resolve(attributes.get('style', ''), True)
+        self.definitions += 1
+        return None
+
+    def visit(self, tag, attributes, content):
+        if 'class' not in attributes and 'style' not in attributes:
+            return tag, attributes, content
+
+        combined_styles = []
+        attributes = attributes.copy()
+        # Apply styles from classes
+        if 'class' in attributes:
+            for class_name in attributes['class'].split():  # Split multiple classes
+                css = self.class_styles.get(class_name)
+                if css:
+                    combined_styles.extend(css)
+
+        # Handle inline styles
+        if 'style' in attributes:
+            combined_styles.extend(self.engine.resolve(attributes.pop('style')))
+
+        if combined_styles and self.stylesheet is not None and 'class' in attributes:
+            # Generated class goes next to the existing ones
+            attributes['class'] += ' ' + self.stylesheet.class_for(self.separator.join(combined_styles))
+            combined_styles = []
+
+        if combined_styles:
+            css = self.separator.join(combined_styles)
+            if self.stylesheet is None:
+                attributes['style'] = css
+            else:
+                attributes['class'] = self.stylesheet.class_for(css)
+        return tag, attributes, content
+
+class PassManager:
+    # The passes given to a renderer, in order: Pass and TreePass objects,
+    # or functions registered with visitor(). With timed, each renderer
+    # using the manager adds the time spent in every pass to times, and the
+    # elements it ran on to counts. Renames by TagMap and the translation
+    # table happen while dispatching and are not timed on their own.
+    def __init__(self, passes: Iterable[Union[Pass, TreePass]] = (), timed: bool = False):
+        self.passes: List[Union[Pass, TreePass]] = []
+        self.timed = timed
+        self.times: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        for item in passes:
+            self.add(item)
+
+    def add(self, item: Union[Pass, TreePass]) -> Union[Pass, TreePass]:
+        if not isinstance(item, (Pass, TreePass)):
+            raise TypeError(f"Expected a Pass or TreePass, got {type(item).__name__}")
+        self.passes.append(item)
+        return item
+
+    def visitor(self, tags: Iterable[str] = None, name: str = None):
+        # Decorator registering a function as an element pass:
+        #   @manager.visitor(tags=("l",))
+        #   def links(tag, attributes, content): ...
+        def register(visit):
+            self.add(FunctionPass(visit, tags, name))
+            return visit
+        return register
+
+    def pipeline(self, builtins: List[Pass]) -> 'Pipeline':
+        return Pipeline(self.element_passes() + builtins, self)
+
+    def element_passes(self) -> List[Pass]:
+        return [item for item in self.passes if isinstance(item, Pass)]
+
+    def tree_passes(self) -> List[TreePass]:
+        return [item for item in self.passes if isinstance(item, TreePass)]
+
+    def run_tree_passes(self, root: Node):
+        for item in self.tree_passes():
+            name = pass_name(item)
+            if not self.timed:
+                item.run(root)
+                continue
+            start = time.perf_counter()
+            try:
+                item.run(root)
+            finally:
+                self.record(name, time.perf_counter() - start, 1)
+
+    def record(self, name: str, seconds: float, count: int):
+        self.times[name] = self.times.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def report(self) -> Dict[str, dict]:
+        # Pass name -> seconds and elements, slowest first
+        return {name: {"seconds": round(seconds, 6), "elements": self.counts[name]}
+                for name, seconds in sorted(self.times.items(), key=lambda item: item[1], reverse=True)}
+
+def pass_name(item: Union[Pass, TreePass]) -> str:
+    return item.name or type(item).__name__
+
+def timed_visit(visit, name: str, manager: PassManager):
+    perf_counter = time.perf_counter
+    times, counts = manager.times, manager.counts
+    times.setdefault(name, 0.0)
+    counts.setdefault(name, 0)
+
+    def run(tag, attributes, content):
+        start = perf_counter()
+        try:
+            return visit(tag, attributes, content)
+        finally:
+            times[name] += perf_counter() - start
+            counts[name] += 1
+    return run
+
+def keep(tag, attributes, content):
+    return tag, attributes, content
+
+Entry = Tuple[Callable[[str, Dict[str, str], str], Result], str, str, str, int]
+
+class Pipeline:
+    # The element passes of one renderer, fused into one call per element.
+    # For each tag it keeps an entry (visit, tag, expected, final, position):
+    # the renderer calls visit(tag, attributes, content) and, when the
+    # element comes back with the expected tag, writes it with the final
+    # one. A single pass is called directly; several are chained by a
+    # function made for the tag. When a pass changes the tag, resume()
+    # works out the passes after it (at position) for the new tag.
+    def __init__(self, passes: List[Pass], manager: Optional[PassManager] = None):
+        self.passes = passes
+        self.timed = manager if manager is not None and manager.timed else None
+        self.entries: Dict[str, Entry] = {}
+
+    def begin(self):
+        for item in self.passes:
+            item.begin()
+
+    def steps(self, tag: str, start: int) -> Tuple[List[Tuple[int, Callable, str]], str]:
+        # (position, visit, tag it gets) of the passes from start on, and the final tag
+        steps = []
+        for position in range(start, len(self.passes)):
+            item = self.passes[position]
+            if isinstance(item, TagMap):
+                tag = item.table.get(tag, tag)
+                continue
+            visit = item.visitor(tag)
+            if visit is not None:
+                if self.timed is not None:
+                    visit = timed_visit(visit, pass_name(item), self.timed)
+                steps.append((position, visit, tag))
+        return steps, tag
+
+    def entry(self, tag: str) -> Entry:
+        steps, final = self.steps(tag, 0)
+        if not steps:
+            entry = keep, tag, tag, final, len(self.passes)
+        elif len(steps) == 1:
+            position, visit, expected = steps[0]
+            entry = visit, expected, expected, final, position
+        else:
+            def chained(tag, attributes, content):
+                return self.follow(steps, final, tag, attributes, content)
+            # follow() returns the final tag, or one a resume() ended with
+            entry = chained, tag, final, final, len(self.passes)
+        if len(self.entries) < MAX_CHAINS:
+            self.entries[tag] = entry
+        return entry
+
+    def follow(self, steps, final: str, tag: str, attributes: Dict[str, str], content: str) -> Result:
+        for position, visit, expected in steps:
+            result = visit(expected, attributes, content)
+            if result.__class__ is not tuple:
+                return result
+            tag, attributes, content = result
+            if tag != expected:
+                return self.resume(position + 1, tag, attributes, content)
+        return final, attributes, content
+
+    def resume(self, start: int, tag: str, attributes: Dict[str, str], content: str) -> Result:
+        # The passes from start on, after one renamed the element
+        steps, final = self.steps(tag, start)
+        return self.follow(steps, final, tag, attributes, content)
+
+    def run(self, tag: str, attributes: Dict[str, str], content: str) -> Result:
+        visit, tag, expected, final, position = self.entries.get(tag) or self.entry(tag)
+        result = visit(tag, attributes, content)
+        if result.__class__ is not tuple:
+            return result
+        tag, attributes, content = result
+        if tag != expected:
+            return self.resume(position + 1, tag, attributes, content)
+        return final, attributes, content
+
+def builtin_passes(translation: dict, styles: dict, stylesheet: Optional[Stylesheet] = None, minify: bool = False,
+                   include: Optional[Callable[[str], str]] = None,
+                   image: Optional[Callable[[Dict[str, str]], Dict[str, str]]] = None) -> List[Pass]:
+    passes: List[Pass] = []
+    if include is not None:
+        passes.append(IncludePass(include))
+    if image is not None:
+        passes.append(ImagePass(image))
+    passes.append(ClassPass(styles, stylesheet, minify))
+    passes.append(TagMap(translation, "translation"))
+    return passes
+
+def tree_of(element: Union[Node, FlatTree]) -> Node:
+    # Tree passes work on Nodes
+    return element.to_node() if isinstance(element, FlatTree) else element
@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+from email.utils import formatdate
+from html import escape
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, quote, urlsplit
+from . import parse
+from .incremental import Document
+
+logger = logging.getLogger(__name__)
+
+# Live preview for the editor extension. The editor posts the text of a
+# document once and then every change to it. The server keeps the parsed
+# document (incremental.Document), so a keystroke only parses the element
+# around it again, and pushes the HTML of the replaced elements to the open
+# previews as server-sent events. Edits that change more than an element
+# (s- classes, a change across elements) reload the preview instead.
+#
+#   POST /documents  {"path": ..., "text": ..., "version": ...}
+#   POST /edits      {"path": ..., "from": ..., "version": ...,
+#                     "changes": [{"offset": ..., "length": ..., "text": ...}]}
+#   GET  /preview?path=...             the page and the script following its events
+#   GET  /events?path=...&version=...  text/event-stream of "patch" and "page" events
+#
+# Offsets count code points. Changes apply in order, each to the text the
+# previous one left. "version" is the editor's version of the text after
+# the request and "from" the one before it: when "from" is not the version
+# the server has, or a change falls outside the text, the server answers
+# 409 and the editor posts the whole text again.
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict",
+           413: "Payload Too Large"}
+MAX_BODY = 64 * 1024 * 1024
+KEEPALIVE = 15.0  # seconds between comments on an idle event stream, so proxies keep it open
+
+# Replaces the elements of a patch by their data-mh id, and reloads when
+# one is missing (the page is older than the patch) or on a "page" event
+CLIENT = """<script>(function () {
+  var events = new EventSource("/events?path=%s&version=%d");
+  events.addEventListener("patch", function (event) {
+    var patches = JSON.parse(event.data).patches;
+    for (var n = 0; n < patches.length; n++) {
+      var element = document.querySelector('[data-mh="' + patches[n].id + '"]');
+      if (element === null) {
+        location.reload();
+        return;
+      }
+      element.outerHTML = patches[n].html;
+    }
+  });
+  events.addEventListener("page", function () { location.reload(); });
+})();</script>"""
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+def field(data: dict, name: str, kind: type, default=None):
+    value = data.get(name, default)
+    if not isinstance(value, kind) or (kind is int and isinstance(value, bool)):
+        raise RequestError(400, f"{name!r} must be {kind.__name__}")
+    return value
+
+class Preview:
+    def __init__(self, root: str = ".", minify: bool = False):
+        self.root = os.path.abspath(root)  # inc(src="...") paths are relative to it, as in a build
+        self.minify = minify
+        self.documents: Dict[str, Document] = {}
+        self.versions: Dict[str, int] = {}  # editor version of each document's text
+        self.listeners: Dict[str, List[asyncio.Queue]] = {}
+
+    def publish(self, path: str, event: str, data: dict):
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+        for queue in self.listeners.get(path, ()):
+            queue.put_nowait(message)
+
+    def open(self, path: str, text: str, version: int):
+        document = self.documents.get(path)
+        if document is None:
+            stack = (os.path.abspath(path),) if os.path.isfile(path) else ()
+            include = parse.Includes(parse.fragment_cache(self.root, self.minify), stack=stack)
+            document = self.documents[path] = Document(text, minify=self.minify, include=include)
+        else:
+            document.load(text)
+        self.versions[path] = version
+        self.publish(path, "page", {"version": document.version})
+
+    def edit(self, path: str, changes: List[dict], start: int, version: int):
+        document = self.documents.get(path)
+        if document is None:
+            raise RequestError(404, f"{path} is not open")
+        if start != self.versions[path]:
+            raise RequestError(409, f"{path} is at version {self.versions[path]}, not {start}")
+        changes = [(field(change, "offset", int), field(change, "length", int), field(change, "text", str))
+                   for change in changes]
+        self.versions[path] = None  # until the changes are applied, so a failure has the editor start over
+        patches = []
+        reload = False
+        for offset, length, text in changes:
+            try:
+                patch = document.edit(offset, offset + length, text)
+            except ValueError as e:
+                raise RequestError(409, str(e))
+            if patch is None:
+                reload = True
+            elif not reload:
+                # Rendered now: a later patch may replace an element inside this one
+                try:
+                    patches.append({"id": patch.old, "html": document.render_element(patch.node, patch.start)})
+                except Exception:
+                    reload = True  # the page shows the error
+        self.versions[path] = version
+        if reload:
+            self.publish(path, "page", {"version": document.version})
+        elif patches:
+            self.publish(path, "patch", {"version": document.version, "patches": patches})
+
+    def page(self, path: str) -> str:
+        document = self.documents.get(path)
+        if document is None:
+            raise RequestError(404, f"{path} is not open")
+        try:
+            html = document.render()
+        except Exception as e:
+            html = f"<pre>{escape(f'{type(e).__name__}: {e}')}</pre>"
+        return CLIENT % (quote(path, safe=""), document.version) + html
+
+    def index(self) -> str:
+        links = "".join(f'<li><a href="/preview?path={quote(path, safe="")}">{escape(path)}</a></li>'
+                        for path in sorted(self.documents))
+        return f"<h1>MiniHTML preview</h1><ul>{links}</ul>"
+
+    def respond(self, method: str, route: str, query: Dict[str, str], body: bytes) -> Tuple[int, str, str]:
+        # Status, Content-Type and body of a request other than /events
+        if route in ("/", "/preview"):
+            if method != "GET":
+                raise RequestError(405, "GET only")
+            html = self.index() if route == "/" else self.page(query.get("path", ""))
+            return 200, "text/html; charset=utf-8", html
+        if route not in ("/documents", "/edits"):
+            raise RequestError(404, f"No route {route}")
+        if method != "POST":
+            raise RequestError(405, "POST only")
+        try:
+            data = json.loads(body.decode("utf-8"))
+        except ValueError as e:
+            raise RequestError(400, f"Invalid JSON: {e}")
+        if not isinstance(data, dict):
+            raise RequestError(400, "Expected an object")
+        path = field(data, "path", str)
+        version = field(data, "version", int, 0)
+        if route == "/documents":
+            self.open(path, field(data, "text", str), version)
+        else:
+            changes = field(data, "changes", list)
+            if not all(isinstance(change, dict) for change in changes):
+                raise RequestError(400, "'changes' must be a list of objects")
+            self.edit(path, changes, field(data, "from", int), version)
+        return 200, "application/json", json.dumps({"version": self.documents[path].version})
+
+    async def stream(self, writer: asyncio.StreamWriter, path: str, version: str):
+        # Events of one document until the client goes away. A preview older
+        # than the document is told to reload first.
+        queue = asyncio.Queue()
+        self.listeners.setdefault(path, []).append(queue)
+        try:
+            head = ["HTTP/1.1 200 OK", f"Date: {formatdate(usegmt=True)}", "Content-Type: text/event-stream",
+                    "Cache-Control: no-cache", "Connection: keep-alive"]
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+            document = self.documents.get(path)
+            if document is not None and str(document.version) != version:
+                writer.write(f"event: page\ndata: {json.dumps({'version': document.version})}\n\n".encode("utf-8"))
+            while True:
+                await writer.drain()
+                try:
+                    writer.write(await asyncio.wait_for(queue.get(), KEEPALIVE))
+                except asyncio.TimeoutError:
+                    writer.write(b": keepalive\n\n")
+        finally:
+            self.listeners[path].remove(queue)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                parts = request_line.decode("latin-1").split()
+                keep_alive = False
+                if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+                    status, content_type, body = 400, "text/plain; charset=utf-8", "Bad Request"
+                else:
+                    method, target, version = parts
+                    connection = headers.get("connection", "").lower()
+                    keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+                    url = urlsplit(target)
+                    query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                    if method == "GET" and url.path == "/events":
+                        await self.stream(writer, query.get("path", ""), query.get("version", ""))
+                        break
+                    length = int(headers.get("content-length") or 0)
+                    try:
+                        if length > MAX_BODY:
+                            keep_alive = False
+                            raise RequestError(413, f"Bodies are limited to {MAX_BODY} bytes")
+                        data = await reader.readexactly(length) if length > 0 else b""
+                        status, content_type, body = self.respond(method, url.path, query, data)
+                    except RequestError as e:
+                        status, content_type, body = e.status, "text/plain; charset=utf-8", str(e)
+
+                payload = body.encode("utf-8")
+                head = [f"HTTP/1.1 {status} {REASONS[status]}", f"Date: {formatdate(usegmt=True)}",
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}", f"Content-Type: {content_type}",
+                        "Cache-Control: no-cache", f"Content-Length: {len(payload)}"]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # client went away, or sent a line over the stream limit or a bad Content-Length
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8010) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8010):
+        # Accepts connections until cancelled, e.g. by asyncio.run() on Ctrl-C
+        listening = await self.start(host, port)
+        logger.info(f"Preview on http://{host}:{port}")
+        async with listening:
+            await listening.serve_forever()
+
+def main(argv: Optional[List[str]] = None, prog: Optional[str] = None):
+    parser = argparse.ArgumentParser(prog=prog, description='Live preview of MiniHTML documents open in the editor.')
+    parser.add_argument('-r', '--root', type=str, default='.', help='Directory inc(src="...") paths are relative to')
+    parser.add_argument('-b', '--bind', type=str, default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('-p', '--port', type=int, default=8010, help='Port to listen on')
+    parser.add_argument('-m', '--minify', action='store_true', help='Preview minified HTML')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    try:
+        asyncio.run(Preview(args.root, args.minify).serve(args.bind, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import formatdate
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import unquote
+from . import images, parse
+
+logger = logging.getLogger(__name__)
+
+# Serves MiniHTML sources as the pages parse.py would build, compiling each
+# on its first request. A stand-in for nginx over /app/html when testing or
+# editing locally: same URLs (sources are flattened to their file name),
+# same gzip/brotli bodies, 404.html for missing pages, and the image
+# variants of images.IMAGE_DIR, written on their first request.
+
+REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 500: "Internal Server Error"}
+
+class Page:
+    __slots__ = ("body", "gzip", "brotli", "etag", "includes", "variants")
+
+    def __init__(self, body: bytes, includes: Dict[str, tuple] = None, variants: Dict[str, Tuple[str, int]] = None):
+        # Compressed bodies are only kept when they are smaller, as in parse.write_output
+        self.body = body
+        self.includes = includes or {}  # parse.file_stamp of every included file and image
+        self.variants = variants or {}  # image variants the page links to, see images.Images
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        gzip_body = parse.gzip_bytes(body)
+        self.gzip = gzip_body if len(gzip_body) < len(body) else None
+        brotli_body = parse.brotli.compress(body, quality=11) if parse.brotli is not None else None
+        self.brotli = brotli_body if brotli_body is not None and len(brotli_body) < len(body) else None
+
+    def size(self) -> int:
+        return len(self.body) + len(self.gzip or b"") + len(self.brotli or b"")
+
+    def fresh(self) -> bool:
+        return all(parse.file_stamp(path) == stamp for path, stamp in self.includes.items())
+
+    def representation(self, accept_encoding: str) -> Tuple[bytes, Optional[str], str]:
+        # Body, Content-Encoding and strong ETag; each encoding is its own
+        # representation and so gets its own tag.
+        accepted = set()
+        for coding in accept_encoding.lower().split(","):
+            name, _, params = coding.partition(";")
+            if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                accepted.add(name.strip())
+        if self.brotli is not None and "br" in accepted:
+            return self.brotli, "br", f'"{self.etag}-br"'
+        if self.gzip is not None and ("gzip" in accepted or "*" in accepted):
+            return self.gzip, "gzip", f'"{self.etag}-gz"'
+        return self.body, None, f'"{self.etag}"'
+
+def render_page(path: str, minify: bool, root: str) -> Page:
+    # Runs in the executor; a module function so process pools can pickle it.
+    # Images are optimized as by parse.build, which does so by default.
+    includes = parse.Includes(parse.fragment_cache(root, minify, optimize_images=True), stack=(os.path.abspath(path),))
+    image = images.Images(root)
+    html = parse.compile_file(path, minify=minify, includes=includes, image=image)
+    includes.stamps.update(image.stamps)
+    includes.variants.update(image.variants)
+    return Page(html.encode("utf-8"), includes.stamps, includes.variants)
+
+class PageCache:
+    # LRU of compiled pages bounded by their total size in bytes. Entries
+    # are keyed by source path and remember the (mtime, size) they were
+    # compiled from, so an edited source is a miss.
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.pages = OrderedDict()  # type: OrderedDict[str, Tuple[tuple, Page]]
+
+    def get(self, path: str, stamp: tuple) -> Optional[Page]:
+        entry = self.pages.get(path)
+        if entry is None or entry[0] != stamp:
+            return None
+        self.pages.move_to_end(path)
+        return entry[1]
+
+    def put(self, path: str, stamp: tuple, page: Page):
+        self.discard(path)
+        if page.size() > self.max_bytes:
+            return
+        self.pages[path] = (stamp, page)
+        self.size += page.size()
+        while self.size > self.max_bytes:
+            _, (_, evicted) = self.pages.popitem(last=False)
+            self.size -= evicted.size()
+
+    def discard(self, path: str):
+        entry = self.pages.pop(path, None)
+        if entry is not None:
+            self.size -= entry[1].size()
+
+class Server:
+    def __init__(self, directory: str, minify: bool = True, cache_bytes: int = 64 * 1024 * 1024,
+                 executor: Executor = None, rescan_interval: float = 1.0):
+        self.directory = directory
+        self.minify = minify
+        self.cache = PageCache(cache_bytes)
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.rescan_interval = rescan_interval
+        self.routes = {}  # type: Dict[str, str]
+        self.scanned = float("-inf")
+        self.compiling = {}  # type: Dict[Tuple[str, tuple], asyncio.Future]
+        self.stats = {"hits": 0, "misses": 0}
+        # Variants of the compiled pages' images, written here when first requested
+        self.variants = {}  # type: Dict[str, Tuple[str, int]]
+        self.writing = {}  # type: Dict[str, asyncio.Future]
+        self.images = None  # type: Optional[tempfile.TemporaryDirectory]
+
+    def scan(self):
+        routes = {}
+        for root, dirs, files in os.walk(self.directory):
+            dirs[:] = sorted(name for name in dirs if name != parse.PARTIALS)
+            for file in sorted(files):
+                if file.endswith((".minihtml", ".mhtml")):
+                    routes.setdefault(os.path.basename(parse.output_path_for(file, "")), os.path.join(root, file))
+        self.routes = routes
+        self.scanned = time.monotonic()
+
+    def source_for(self, name: str) -> Optional[str]:
+        # New sources are picked up by rescanning, at most once per rescan_interval
+        path = self.routes.get(name)
+        if (path is None or not os.path.exists(path)) and time.monotonic() - self.scanned >= self.rescan_interval:
+            self.scan()
+            path = self.routes.get(name)
+        return path
+
+    async def page(self, path: str) -> Page:
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        page = self.cache.get(path, stamp)
+        if page is not None and page.fresh():
+            self.stats["hits"] += 1
+            return page
+        self.stats["misses"] += 1
+        # Requests for a page that is already compiling wait for that result
+        pending = self.compiling.get((path, stamp))
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            pending = loop.run_in_executor(self.executor, render_page, path, self.minify, self.directory)
+            self.compiling[path, stamp] = pending
+            pending.add_done_callback(lambda future: self.compiled(path, stamp, future))
+        # Shielded so a client hanging up does not cancel it for the others
+        return await asyncio.shield(pending)
+
+    def compiled(self, path: str, stamp: tuple, future: asyncio.Future):
+        del self.compiling[path, stamp]
+        if not future.cancelled() and future.exception() is None:
+            self.cache.put(path, stamp, future.result())
+            self.variants.update(future.result().variants)
+
+    async def image(self, name: str) -> Optional[str]:
+        # File of a variant linked by a compiled page; copies are the source itself
+        variant = self.variants.get(name)
+        if variant is None:
+            return None
+        path, width = variant
+        if width == 0:
+            return path
+        if self.images is None:
+            self.images = tempfile.TemporaryDirectory(prefix="minihtml-")
+        destination = os.path.join(self.images.name, name)
+        if not os.path.exists(destination):
+            pending = self.writing.get(name)
+            if pending is None:
+                loop = asyncio.get_running_loop()
+                pending = loop.run_in_executor(self.executor, images.write_image, path, [(width, destination)])
+                self.writing[name] = pending
+                pending.add_done_callback(lambda future: self.writing.pop(name))
+            await asyncio.shield(pending)
+        return destination
+
+    async def respond(self, method: str, target: str, headers: Dict[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+        if method not in ("GET", "HEAD"):
+            return 405, {"Allow": "GET, HEAD"}, b""
+        # Pages are flat in /app/html, so only top-level names exist besides images
+        name = unquote(target.split("?", 1)[0])[1:] or "index.html"
+        if name.startswith(f"{images.IMAGE_DIR}/"):
+            try:
+                path = await self.image(name[len(images.IMAGE_DIR) + 1:])
+                if path is not None:
+                    with open(path, "rb") as f:
+                        body = f.read()
+                    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                    # Variant names change with their content, like nginx's `expires max`
+                    return 200, {"Content-Type": content_type, "Cache-Control": "max-age=315360000"}, body
+            except FileNotFoundError:
+                pass
+            except Exception:
+                logger.exception(f"Failed to write {name}")
+                return 500, {"Content-Type": "text/plain; charset=utf-8"}, b"500 Internal Server Error"
+        status = 200
+        path = self.source_for(name) if "/" not in name else None
+        if path is None:
+            status, path = 404, self.source_for("404.html")
+            if path is None:
+                return 404, {"Content-Type": "text/plain; charset=utf-8"}, b"404 Not Found"
+        try:
+            page = await self.page(path)
+        except FileNotFoundError:
+            return 404, {"Content-Type": "text/plain; charset=utf-8"}, b"404 Not Found"
+        except Exception:
+            logger.exception(f"Failed to compile {path}")
+            return 500, {"Content-Type": "text/plain; charset=utf-8"}, b"500 Internal Server Error"
+
+        body, encoding, etag = page.representation(headers.get("accept-encoding", ""))
+        response = {"Content-Type": "text/html; charset=utf-8", "ETag": etag,
+                    "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if encoding:
+            response["Content-Encoding"] = encoding
+        if status == 200:
+            tags = [tag.strip() for tag in headers.get("if-none-match", "").split(",")]
+            if etag in tags or "*" in tags:
+                return 304, response, b""
+        return status, response, body
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                parts = request_line.decode("latin-1").split()
+                method = parts[0] if parts else ""
+                if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+                    status, response, body = 400, {}, b""
+                    keep_alive = False
+                else:
+                    method, target, version = parts
+                    connection = headers.get("connection", "").lower()
+                    keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+                    status, response, body = await self.respond(method, target, headers)
+
+                head = [f"HTTP/1.1 {status} {REASONS[status]}", f"Date: {formatdate(usegmt=True)}",
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+                head.extend(f"{key}: {value}" for key, value in response.items())
+                if status != 304:
+                    head.append(f"Content-Length: {len(body)}")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+                if status != 304 and method != "HEAD":
+                    writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # client went away or sent a line over the stream limit
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8000) -> asyncio.AbstractServer:
+        self.scan()
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8000):
+        # Accepts connections until cancelled, e.g. by asyncio.run() on Ctrl-C
+        listening = await self.start(host, port)
+        logger.info(f"Serving {self.directory} on http://{host}:{port}")
+        async with listening:
+            await listening.serve_forever()
+
+@contextmanager
+def background(server: Server, host: str = "127.0.0.1", port: int = 0):
+    # Runs server on its own event loop thread, e.g. for tests; yields its base URL
+    loop = asyncio.new_event_loop()
+    listening = loop.run_until_complete(server.start(host, port))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://{host}:{listening.sockets[0].getsockname()[1]}"
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        listening.close()
+        # Connections still open are kept-alive handlers waiting for a request
+        handlers = asyncio.all_tasks(loop)
+        for handler in handlers:
+            handler.cancel()
+
+        async def closed():
+            await asyncio.gather(*handlers, return_exceptions=True)
+            await listening.wait_closed()
+        loop.run_until_complete(closed())
+        loop.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve MiniHTML sources, compiling pages on first request.')
+    parser.add_argument('-d', '--directory', type=str, default='.', help='Directory of MiniHTML sources')
+    parser.add_argument('-b', '--bind', type=str, default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('-p', '--port', type=int, default=8000, help='Port to listen on')
+    parser.add_argument('--cache-size', type=int, default=64, help='Compiled page cache size in MB')
+    parser.add_argument('--no-minify', action='store_true', help='Serve pages as parse.py writes them without --minify')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Processes compiling pages (1 compiles in a thread of this process)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    executor = ProcessPoolExecutor(max_workers=args.jobs) if args.jobs > 1 else ThreadPoolExecutor(max_workers=1)
+    server = Server(args.directory, not args.no_minify, args.cache_size * 1024 * 1024, executor)
+    try:
+        asyncio.run(server.serve(args.bind, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown()
+        if server.images is not None:
+            server.images.cleanup()
+
+if __name__ == "__main__":
+    main()
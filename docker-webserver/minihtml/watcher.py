@@ -0,0 +1,182 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+from typing import Dict, Optional, Set
+from .budget import CONFIG_NAME as BUDGET_CONFIG
+from .images import EXTENSIONS as IMAGE_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+SOURCE_EXTENSIONS = (".minihtml", ".mhtml") + IMAGE_EXTENSIONS  # images are rebuilt into the pages using them
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+def is_source(path: str) -> bool:
+    # The budget config too: editing it checks the pages again
+    return path.endswith(SOURCE_EXTENSIONS) or os.path.basename(path) == BUDGET_CONFIG
+
+# Both watchers have poll(timeout): it waits up to timeout seconds (None
+# waits for the first change) and returns the paths that changed, an empty
+# set on timeout, or None when it lost track and everything may have changed.
+
+class InotifyWatcher:
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}  # type: Dict[int, str]
+        self.watch_tree(directory)
+
+    def watch(self, directory: str):
+        wd = self.add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                logger.warning("Out of inotify watches, raise fs.inotify.max_user_watches")
+            raise OSError(error, f"inotify_add_watch failed for {directory}")
+        self.directories[wd] = directory
+
+    def watch_tree(self, directory: str) -> Set[str]:
+        # Watches directory and its subdirectories. Returns the files already
+        # in them, which were created before the watch could report them.
+        files = set()
+        for root, dirs, names in os.walk(directory):
+            self.watch(root)
+            files.update(os.path.join(root, name) for name in names)
+        return files
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def poll(self, timeout: Optional[float] = None) -> Optional[Set[str]]:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        everything = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                everything = True
+                continue
+            if mask & IN_IGNORED:
+                self.directories.pop(wd, None)
+                continue
+            directory = self.directories.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                # A moved or deleted directory takes its sources with it
+                everything = True
+                if mask & (IN_CREATE | IN_MOVED_TO) and os.path.isdir(path):
+                    changed |= self.watch_tree(path)
+            else:
+                changed.add(path)
+        return None if everything else changed
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    # Fallback without inotify: keeps a stat cache of the tree and rescans
+    # it with os.scandir every `interval` seconds.
+    def __init__(self, directory: str, interval: float = 1.0):
+        self.directory = directory
+        self.interval = interval
+        self.stats = self.scan()
+
+    def scan(self) -> Dict[str, tuple]:
+        stats = {}
+        stack = [self.directory]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        stats[entry.path] = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+                except FileNotFoundError:
+                    continue
+        return stats
+
+    def poll(self, timeout: Optional[float] = None) -> Optional[Set[str]]:
+        while True:
+            time.sleep(self.interval if timeout is None else min(self.interval, timeout))
+            stats = self.scan()
+            changed = {path for path in stats.keys() | self.stats.keys() if stats.get(path) != self.stats.get(path)}
+            self.stats = stats
+            if changed or timeout is not None:
+                return changed
+
+    def close(self):
+        pass
+
+def make_watcher(directory: str, interval: float = 1.0):
+    try:
+        return InotifyWatcher(directory)
+    except (OSError, AttributeError) as e:
+        logger.warning(f"inotify unavailable ({e}), polling every {interval}s")
+        return PollingWatcher(directory, interval)
+
+def wait_for_changes(watcher, debounce: float = 0.05, max_delay: float = 0.5) -> Optional[Set[str]]:
+    # Blocks until something changes, then keeps collecting changes until
+    # nothing happened for `debounce` seconds (or `max_delay` passed), so a
+    # burst of saves becomes one rebuild. Returns the changed paths, or
+    # None when everything should be checked.
+    changed = set()
+    everything = False
+    deadline = None
+    timeout = None
+    while True:
+        paths = watcher.poll(timeout)
+        if paths is None:
+            everything = True
+        elif paths:
+            changed |= paths
+        elif deadline is not None:
+            break
+        if deadline is None and (everything or changed):
+            deadline = time.monotonic() + max_delay
+        if deadline is not None:
+            timeout = min(debounce, deadline - time.monotonic())
+            if timeout <= 0:
+                break
+    return None if everything else changed
@@ -0,0 +1,272 @@
+import argparse
+import sys
+import zlib
+from typing import Dict, List, Optional, Tuple
+from . import compiler
+from .compiler import HtmlRenderer, Node, StyleEngine, Stylesheet
+
+# Binary encoding of a Compiler.compile() tree.
+#
+#   header:  b"MH", version byte, 2 byte fingerprint of the string table
+#   node:    tag, content, attribute count, attributes, child count,
+#            then the children, depth first
+#
+# Counts are unsigned LEB128 varints. Strings are varint references into a
+# table that starts out with the tag names, common attribute names and
+# style directive names of the translation/styles tables: 0 is followed by
+# a new string (varint byte length and UTF-8), which is appended to the
+# table; n > 0 is table entry n - 1. So every repeated tag, attribute key,
+# value or text is one or two bytes after its first use.
+#
+# style values are stored as their directives: a varint count and each
+# directive's name, where names of directives with parameters end in "("
+# and are followed by the parameters. A count of 0 is followed by the value
+# as a plain string, for values that would not be rebuilt exactly.
+
+MAGIC = b"MH"
+VERSION = 1
+
+COMMON_ATTRIBUTES = ("class", "style", "src", "alt", "href", "id", "title", "width", "height", "target",
+                     "rel", "name", "type", "value", "lang", "role", "inc")
+
+class WireError(ValueError):
+    pass
+
+TABLES: Dict[Tuple[int, int], tuple] = {}
+
+def static_strings(translation: dict, styles: dict) -> Tuple[List[str], bytes]:
+    # Initial string table and its fingerprint, cached per pair of tables
+    key = (id(translation), id(styles))
+    cached = TABLES.get(key)
+    if cached is None or cached[0] is not translation or cached[1] is not styles:
+        names = [""] + list(translation) + list(COMMON_ATTRIBUTES)
+        for name, template in styles.items():
+            names.append(name + "(" if "{}" in template else name)
+        strings = list(dict.fromkeys(names))
+        fingerprint = (zlib.crc32("\0".join(strings).encode("utf-8")) & 0xffff).to_bytes(2, "little")
+        cached = TABLES[key] = (translation, styles, strings, fingerprint)
+    return cached[2], cached[3]
+
+def style_directives(value: str) -> Optional[List[Tuple[str, Optional[str]]]]:
+    # (name, parameters) of each directive, or None when joining them back
+    # would not give the same value
+    directives = []
+    for directive in StyleEngine.split_directives(value):
+        open_paren = directive.find("(")
+        if open_paren == -1:
+            directives.append((directive, None))
+        elif directive.endswith(")"):
+            directives.append((directive[:open_paren + 1], directive[open_paren + 1:-1]))
+        else:
+            return None
+    if not directives or " ".join(directives_text(directives)) != value:
+        return None
+    return directives
+
+def directives_text(directives: List[Tuple[str, Optional[str]]]) -> List[str]:
+    return [name if params is None else f"{name}{params})" for name, params in directives]
+
+def encode(root: Node, translation: dict, styles: dict) -> bytes:
+    strings, fingerprint = static_strings(translation, styles)
+    table = {string: index for index, string in enumerate(strings)}
+    out = bytearray(MAGIC)
+    out.append(VERSION)
+    out += fingerprint
+
+    def varint(value: int):
+        while value >= 0x80:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+
+    def string(value: str):
+        index = table.get(value)
+        if index is not None:
+            varint(index + 1)
+            return
+        table[value] = len(table)
+        data = value.encode("utf-8")
+        out.append(0)
+        varint(len(data))
+        out.extend(data)
+
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        string(node.tag or "")
+        string(node.content or "")
+        varint(len(node.attributes))
+        for key, value in node.attributes.items():
+            string(key)
+            if key == "style":
+                directives = style_directives(value)
+                if directives is None:
+                    varint(0)
+                    string(value)
+                    continue
+                varint(len(directives))
+                for name, params in directives:
+                    string(name)
+                    if params is not None:
+                        string(params)
+            else:
+                string(value)
+        varint(len(node.children))
+        stack.extend(reversed(node.children))
+    return bytes(out)
+
+class Reader:
+    # Decoding state: position in data and the string table so far
+    def __init__(self, data: bytes, translation: dict, styles: dict):
+        strings, fingerprint = static_strings(translation, styles)
+        if data[:3] != MAGIC + bytes((VERSION,)):
+            raise WireError("Not MiniHTML wire data, or another version")
+        if data[3:5] != fingerprint:
+            raise WireError("Encoded with other translation/styles tables")
+        self.data = data
+        self.pos = 5
+        self.strings = list(strings)
+
+    def varint(self) -> int:
+        data = self.data
+        try:
+            byte = data[self.pos]
+            self.pos += 1
+            if byte < 0x80:
+                return byte
+            value = byte & 0x7f
+            shift = 7
+            while True:
+                byte = data[self.pos]
+                self.pos += 1
+                value |= (byte & 0x7f) << shift
+                if byte < 0x80:
+                    return value
+                shift += 7
+        except IndexError:
+            raise WireError(f"Truncated: a count runs past the end of the data ({len(data)} bytes)")
+
+    def string(self) -> str:
+        reference = self.varint()
+        if reference:
+            try:
+                return self.strings[reference - 1]
+            except IndexError:
+                raise WireError(f"String {reference - 1} referenced before byte {self.pos} is not in the table")
+        length = self.varint()
+        end = self.pos + length
+        if end > len(self.data):
+            raise WireError(f"Truncated: a string of {length} bytes at byte {self.pos} runs past the end of the data")
+        try:
+            value = self.data[self.pos:end].decode("utf-8")
+        except UnicodeDecodeError as e:
+            raise WireError(f"String at byte {self.pos} is not UTF-8: {e.reason}")
+        self.pos = end
+        self.strings.append(value)
+        return value
+
+    def finish(self):
+        if self.pos != len(self.data):
+            raise WireError(f"{len(self.data) - self.pos} bytes after the tree")
+
+    def element(self) -> Tuple[str, str, Dict[str, str], int]:
+        # tag, content, attributes and number of children of the next node
+        string = self.string
+        tag = string()
+        content = string()
+        attributes = {}
+        for _ in range(self.varint()):
+            key = string()
+            if key == "style":
+                count = self.varint()
+                if count == 0:
+                    attributes[key] = string()
+                    continue
+                directives = []
+                for _ in range(count):
+                    name = string()
+                    directives.append(name + string() + ")" if name.endswith("(") else name)
+                attributes[key] = " ".join(directives)
+            else:
+                attributes[key] = string()
+        return tag, content, attributes, self.varint()
+
+def decode(data: bytes, translation: dict, styles: dict) -> Node:
+    reader = Reader(data, translation, styles)
+
+    def make_node() -> Tuple[Node, int]:
+        node = Node()
+        node.tag, node.content, node.attributes, count = reader.element()
+        return node, count
+
+    root, count = make_node()
+    stack = [[root, count]]
+    while stack:
+        top = stack[-1]
+        if not top[1]:
+            stack.pop()
+            continue
+        top[1] -= 1
+        node, count = make_node()
+        top[0].children.append(node)
+        if count:
+            stack.append([node, count])
+    reader.finish()
+    return root
+
+def decode_to_html(data: bytes, translation: dict, styles: dict, stylesheet: Optional[Stylesheet] = None,
+                   minify: bool = False) -> str:
+    # Renders while decoding without building Nodes, like StreamCompiler;
+    # same output as compile_to_html(decode(data, ...)).
+    reader = Reader(data, translation, styles)
+    renderer = HtmlRenderer(translation, styles, stylesheet, minify)
+    html = []
+    count = reader.element()[3]  # the root itself renders nothing
+    stack = [[count, "", False]]  # children left, end tag, inside a subtree that renders nothing
+    while stack:
+        top = stack[-1]
+        if not top[0]:
+            stack.pop()
+            html.append(top[1])
+            continue
+        top[0] -= 1
+        tag, content, attributes, count = reader.element()
+        element = None
+        if tag and not top[2]:
+            element = renderer.start_element(tag, attributes, content)
+        if element is None:
+            if count:
+                stack.append([count, "", True])
+            continue
+        start, end = element
+        html.append(start)
+        if count:
+            stack.append([count, end, False])
+        else:
+            html.append(end)
+    reader.finish()
+    return "".join(html)
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert MiniHTML source to the binary wire format, or wire data to HTML.')
+    parser.add_argument('command', choices=('encode', 'html'))
+    parser.add_argument('input', type=str, help='MiniHTML source (encode) or wire data (html)')
+    parser.add_argument('-o', '--output', type=str, help='Output file, stdout by default')
+    parser.add_argument('-m', '--minify', action='store_true', help='Minify the generated HTML')
+    args = parser.parse_args()
+
+    if args.command == 'encode':
+        with compiler.map_source(args.input) as source:
+            root = compiler.Compiler(compiler.Parser(source).tokenize_spans()).compile()
+        result = encode(root, compiler.translation, compiler.styles)
+    else:
+        with open(args.input, "rb") as f:
+            result = decode_to_html(f.read(), compiler.translation, compiler.styles, minify=args.minify).encode("utf-8")
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(result)
+    else:
+        sys.stdout.buffer.write(result)
+
+if __name__ == "__main__":
+    main()
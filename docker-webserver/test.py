@@ -1,5 +1,23 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import gzip
+import http.client
+import json
+import logging
+import os
+import random
+import re
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
-from compiler import Parser, Compiler, Node
+import zlib
+import minihtml
+from minihtml import batch, budget, cli, compiler, images, incremental, instrument, parse, passes, preview, serve, watcher, wire
+from benchmarks.generate import generate_document
+from minihtml.compiler import Parser, Compiler, Node, FlatTree, SharedSubtrees, Limits, LimitError, StyleEngine, StyleError, Stylesheet, map_source, iter_html, TokenStream, TokenBuffer, translation, styles
 
 class TestCompiler(unittest.TestCase):
     def setUp(self):
@@ -73,5 +91,1445 @@ class TestCompiler(unittest.TestCase):
         expected = '<p class="header" style="color: blue; font-size: 24px">Header</p>'
         self.assertEqual(html.strip(), expected)
 
+class TestTokenizer(unittest.TestCase):
+    def assertSameTokens(self, text):
+        parser = Parser(text)
+        fast = [(t.type, t.value) for t in parser.tokenize()]
+        reference = [(t.type, t.value) for t in parser.tokenize_loop()]
+        self.assertEqual(fast, reference, repr(text))
+
+    def test_matches_reference_loop(self):
+        self.assertSameTokens("""[
+            s-myclass(style="bold size(24px) italic")
+            p{look how classy i am}(class="myclass")
+            i(src="https://assets.hackclub.com/flag-standalone.svg" width="100px")
+            hline() // comment é
+        ]""")
+
+    def test_quoted_close_paren(self):
+        self.assertSameTokens('[p(title="a ) b" x=1){t}]')
+        self.assertSameTokens('[p(title="unterminated ) ]')
+
+    def test_unterminated_bodies(self):
+        self.assertSameTokens('[p{never closed')
+        self.assertSameTokens('[p(never closed')
+
+    def test_random_inputs(self):
+        rng = random.Random(1234)
+        alphabet = '[](){}"=, \n\tab-_.1\xe9\u3000'
+        for _ in range(2000):
+            self.assertSameTokens(''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 30))))
+
+    def test_trailing_junk_is_linear(self):
+        # A skip of the characters before a token used to backtrack over a
+        # run of them at the end, once per character: seconds for 10k
+        for junk in (' ', '}', ')', '\u3000'):
+            text = '[p{a}]' + junk * 50000
+            start = time.perf_counter()
+            self.assertSameTokens(text)
+            spans = Parser(text.encode('utf-8')).tokenize_spans()
+            self.assertEqual([spans.value_at(n) for n in range(len(spans))], ['[', 'p', 'a', ']'])
+            self.assertEqual(len(Parser(text).tokenize_into(TokenBuffer())), 4)
+            self.assertLess(time.perf_counter() - start, 1.0, repr(junk))
+
+class TestAttributes(unittest.TestCase):
+    def assertSamePairs(self, text):
+        fast = Compiler.parse_attributes(text)
+        reference = Compiler.parse_attributes_loop(text)
+        self.assertEqual(list(fast.items()), list(reference.items()), repr(text))
+
+    def test_matches_reference_loop(self):
+        self.assertSamePairs('src="https://picsum.photos/300/200" alt="a picture", width="100px"')
+        self.assertSamePairs('style="bold size(24px)",class="x"')
+        self.assertSamePairs('x=1 y=2')
+        self.assertSamePairs('a="" b="c"')
+        self.assertSamePairs('alt=""')
+        self.assertSamePairs(' a = "b" ')
+        self.assertSamePairs('a="x"y b="unterminated')
+        self.assertSamePairs('a b="c" d="e=f", =g')
+
+    def test_random_inputs(self):
+        rng = random.Random(4321)
+        for alphabet in ('ab=", \n\t', 'k="v" ,=\xe9\u3000'):
+            for _ in range(3000):
+                self.assertSamePairs(''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 20))))
+
+    def test_random_pair_lists(self):
+        rng = random.Random(99)
+        for _ in range(1000):
+            pairs = [f'{rng.choice(["a", "b", "class", " x"])}="{rng.choice(["", "1", "v w", "a=b"])}"'
+                     for _ in range(rng.randint(0, 4))]
+            self.assertSamePairs(rng.choice([" ", ",", ", "]).join(pairs))
+
+    def test_values_interned(self):
+        strings = {}
+        first = Compiler.parse_attributes('class="card"', strings)
+        second = Compiler.parse_attributes('class="card" id="x"', strings)
+        self.assertIs(first["class"], second["class"])
+        self.assertIs(next(iter(second)), "class")
+
+    def test_groups_merge_around_text(self):
+        root = Compiler(Parser('[p(a="1" b="2"){text}(b="3", c="4")]').tokenize()).compile()
+        self.assertEqual(root.children[0].attributes, {"a": "1", "b": "3", "c": "4"})
+        self.assertEqual(root.children[0].content, "text")
+
+class TestSpanTokens(unittest.TestCase):
+    source = """[
+        s-text(style="bold color(red)")
+        p{Caf\u00e9 \u2014 text}(class="text")
+        d[p{t\u00e9l\u00e9}]\u3000na\u00efve(x="1")
+    ]"""
+    translation = {'p': 'p', 'd': 'div'}
+    styles = {'bold': 'font-weight: bold', 'color': 'color: {}'}
+
+    def render(self, tokens):
+        root = Compiler(tokens).compile()
+        return Compiler.compile_to_html(root, self.translation, self.styles)
+
+    def test_values_match_tokenize(self):
+        expected = [(t.type, t.value) for t in Parser(self.source).tokenize()]
+        for buffer in (self.source, self.source.encode('utf-8')):
+            spans = Parser(buffer).tokenize_spans()
+            self.assertEqual([(t.type, t.value) for t in spans], expected)
+
+    def test_mmap_source_renders_same_html(self):
+        expected = self.render(Parser(self.source).tokenize())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'page.mhtml')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self.source)
+            with map_source(path) as source:
+                html = self.render(Parser(source).tokenize_spans())
+        self.assertEqual(html, expected)
+
+class TestStreaming(unittest.TestCase):
+    source = """[
+        p{before the class}(class="text")
+        s-text(style="bold color(red)")
+        d[
+            p{Test text}(class="text")
+            s-ignored(style="italic")[p{not rendered}]
+            i(src="a.png" alt="quoted ) paren")
+            d[br() p{deep}]
+        ](style="card")
+        p{unused}(class="ignored")
+    ] trailing p{ignored}"""
+    translation = {'p': 'p', 'd': 'div', 'i': 'img', 'br': 'br'}
+    styles = {'bold': 'font-weight: bold', 'color': 'color: {}', 'italic': 'font-style: italic',
+              'card': 'border: 1px solid #ddd'}
+
+    def expected(self, text):
+        root = Compiler(Parser(text).tokenize()).compile()
+        return Compiler.compile_to_html(root, self.translation, self.styles)
+
+    def test_matches_compile_to_html_for_any_chunking(self):
+        expected = self.expected(self.source)
+        for size in (1, 2, 3, 7, 64, len(self.source)):
+            chunks = [self.source[i:i + size] for i in range(0, len(self.source), size)]
+            self.assertEqual(''.join(iter_html(chunks, self.translation, self.styles)), expected)
+
+    def test_unterminated_input(self):
+        for text in ('[d[p{open', '[d(class="x', '[d[p{a}', 'p{no root}', '['):
+            self.assertEqual(''.join(iter_html([text], self.translation, self.styles)), self.expected(text))
+
+    def test_output_is_incremental(self):
+        chunks = iter(['[p{one}', 'p{two}', ']'])
+        html = iter_html(chunks, self.translation, self.styles)
+        self.assertEqual(next(html), '<p>one</p>')
+        self.assertEqual(next(chunks), ']')  # 'p{two}' was consumed, ']' not yet
+
+    def test_token_stream_matches_tokenize(self):
+        text = '[hline() p{text}(title="a ) b") d[]]'
+        stream = TokenStream()
+        tokens = []
+        for char in text:
+            tokens.extend(stream.feed(char))
+        tokens.extend(stream.close())
+        self.assertEqual([(t.type, t.value) for t in tokens],
+                         [(t.type, t.value) for t in Parser(text).tokenize()])
+
+    def test_trailing_junk_chunks(self):
+        # Each chunk is scanned once; a chunk of whitespace must not stall the stream
+        start = time.perf_counter()
+        chunks = ['[p{a}]', ' ' * 50000, '}' * 50000, 'p{b}', '\n' * 50000]
+        html = ''.join(iter_html(chunks, self.translation, self.styles))
+        self.assertEqual(html, self.expected(''.join(chunks)))
+        stream = TokenStream()
+        tokens = [token for chunk in chunks for token in stream.feed(chunk)] + stream.close()
+        self.assertEqual([(t.type, t.value) for t in tokens],
+                         [(t.type, t.value) for t in Parser(''.join(chunks)).tokenize()])
+        self.assertLess(time.perf_counter() - start, 1.0)
+
+class TestFlatTree(unittest.TestCase):
+    source = """[
+        s-text(style="bold")
+        d(class="text")[
+            p{one}(x="1"){ignored}
+            s-hidden[p{not rendered}]
+            d[br() hline()]
+        ]
+        p{two}
+    ]"""
+    translation = {'p': 'p', 'd': 'div', 'br': 'br', 'hline': 'hr'}
+    styles = {'bold': 'font-weight: bold'}
+
+    def test_renders_like_node_tree(self):
+        tokens = Parser(self.source).tokenize()
+        tree = Compiler(tokens).compile(compact=True)
+        self.assertIsInstance(tree, FlatTree)
+        self.assertEqual(Compiler.compile_to_html(tree, self.translation, self.styles),
+                         Compiler.compile_to_html(Compiler(tokens).compile(), self.translation, self.styles))
+
+    def test_structure(self):
+        tree = Compiler(Parser(self.source).tokenize()).compile(compact=True)
+        top = list(tree.children(0))
+        self.assertEqual([tree.tag(i) for i in top], ['s-text', 'd', 'p'])
+        self.assertEqual([tree.tag(i) for i in tree.children(top[1])], ['p', 's-hidden', 'd'])
+        self.assertEqual(tree.attributes(top[1]), {'class': 'text'})
+        self.assertEqual(tree.to_node().children[2].content, 'two')
+
+class TestDeepNesting(unittest.TestCase):
+    depth = 20000  # far beyond the default recursion limit
+
+    def test_deep_document(self):
+        text = '[' + 'd[' * self.depth + 'p{x}' + ']' * self.depth + ']'
+        tokens = Parser(text).tokenize()
+        html = Compiler.compile_to_html(Compiler(tokens).compile(), {'d': 'div'}, {})
+        self.assertEqual(html, '<div>' * self.depth + '<p>x</p>' + '</div>' * self.depth)
+        tree = Compiler(tokens).compile(compact=True)
+        self.assertEqual(Compiler.compile_to_html(tree, {'d': 'div'}, {}), html)
+        self.assertEqual(Compiler.compile_to_html(tree.to_node(), {'d': 'div'}, {}), html)
+
+    def test_unclosed_deep_document(self):
+        text = '[' + 'd[' * self.depth
+        html = Compiler.compile_to_html(Compiler(Parser(text).tokenize()).compile(), {'d': 'div'}, {})
+        self.assertEqual(html, '<div>' * self.depth + '</div>' * self.depth)
+
+class TestStyleEngine(unittest.TestCase):
+    styles = {
+        'bold': 'font-weight: bold',
+        'color': 'color: {}',
+        'font': 'font-family: {}',
+        'width-height': 'width: {}; height: {}',
+    }
+
+    def render(self, text):
+        root = Compiler(Parser(text).tokenize()).compile()
+        return Compiler.compile_to_html(root, {'p': 'p'}, self.styles)
+
+    def test_multiple_parameters_inline(self):
+        html = self.render('[p{box}(style="width-height(10px, 20px)")]')
+        self.assertEqual(html, '<p style="width: 10px; height: 20px">box</p>')
+
+    def test_class_and_inline_paths_agree(self):
+        style = 'bold font(Brush Script MT) width-height(1px,2px) color(rgb(1, 2, 3))'
+        inline = self.render(f'[p{{x}}(style="{style}")]')
+        from_class = self.render(f'[s-c(style="{style}") p{{x}}(class="c")]')
+        self.assertEqual(inline, from_class.replace(' class="c"', ''))
+        self.assertIn('font-family: Brush Script MT', inline)
+        self.assertIn('color: rgb(1, 2, 3)', inline)
+
+    def test_unknown_directives(self):
+        # Kept inline and dropped from classes, as before the engine
+        self.assertEqual(self.render('[p{x}(style="raw:css bold")]'), '<p style="raw:css; font-weight: bold">x</p>')
+        self.assertEqual(self.render('[s-c(style="raw:css bold") p{x}(class="c")]'),
+                         '<p class="c" style="font-weight: bold">x</p>')
+
+    def test_directives_are_separated_by_spaces(self):
+        self.assertEqual(self.render('[p{x}(style="bold\tcolor(red) font(a b)")]'),
+                         '<p style="bold\tcolor(red); font-family: a b">x</p>')
+
+    def test_missing_parameters(self):
+        for source in ('[p{a}(style="width-height(1px)")]', '[s-x(style="width-height(1px)") p(class="x")]'):
+            with self.assertRaises(StyleError) as caught:
+                self.render(source)
+            self.assertEqual(caught.exception.directive, 'width-height(1px)')
+        self.assertIsInstance(caught.exception, ValueError)
+        results = batch.compile_many(['[p(style="width-height(1px)")]', '[p{ok}]'], translation, styles)
+        self.assertEqual(str(results[0]), "document 0: StyleError: Style directive 'width-height(1px)' needs 2 "
+                                          "parameters, got 1")
+        self.assertEqual(results[1], '<p>ok</p>')
+
+    def test_single_placeholder_keeps_commas(self):
+        self.assertEqual(self.render('[p{x}(style="font(Arial, sans-serif)")]'),
+                         '<p style="font-family: Arial, sans-serif">x</p>')
+
+    def test_engine_is_shared_and_cached(self):
+        engine = StyleEngine.for_styles(self.styles)
+        self.assertIs(StyleEngine.for_styles(self.styles), engine)
+        engine.resolve.cache_clear()
+        self.render('[p{a}(style="bold") p{b}(style="bold")]')
+        self.assertEqual(engine.resolve.cache_info().hits, 1)
+
+    def test_engine_rebuilt_when_table_changes(self):
+        styles = dict(self.styles)
+        engine = StyleEngine.for_styles(styles)
+        styles['bold'] = 'font-weight: 900'
+        self.assertIsNot(StyleEngine.for_styles(styles), engine)
+        self.assertEqual(StyleEngine.for_styles(styles).resolve('bold'), ('font-weight: 900',))
+
+class TestStylesheet(unittest.TestCase):
+    source = """[
+        s-text(style="bold")
+        p{a}(style="bold color(red)")
+        p{b}(class="text" style="color(red)")
+        p{c}(style="bold color(red)")
+        p{plain}
+    ]"""
+    styles = {'bold': 'font-weight: bold', 'color': 'color: {}'}
+
+    def test_styles_become_shared_classes(self):
+        stylesheet = Stylesheet()
+        root = Compiler(Parser(self.source).tokenize()).compile()
+        html = Compiler.compile_to_html(root, {'p': 'p'}, self.styles, stylesheet)
+        self.assertNotIn('style=', html)
+        self.assertEqual(list(stylesheet.rules.values()), ['font-weight: bold; color: red'])
+        name = next(iter(stylesheet.rules))
+        self.assertEqual(html, f'<p class="{name}">a</p><p class="text {name}">b</p>'
+                               f'<p class="{name}">c</p><p>plain</p>')
+        self.assertEqual(stylesheet.css(), f'.{name}{{font-weight: bold; color: red}}\n')
+
+    def test_names_are_stable_across_sheets(self):
+        first, second = Stylesheet(), Stylesheet()
+        second.class_for('margin: 0')
+        self.assertEqual(first.class_for('color: red'), second.class_for('color: red'))
+        first.update(second)
+        self.assertEqual(len(first.rules), 2)
+        self.assertRegex(first.filename(), r'^site\.[0-9a-f]{12}\.css$')
+
+class TestMinify(unittest.TestCase):
+    translation = {'p': 'p', 'd': 'div', 'i': 'img', 'br': 'br', 'hline': 'hr'}
+    styles = {'bold': 'font-weight: bold', 'color': 'color: {}'}
+
+    def render(self, text, minify):
+        root = Compiler(Parser(text).tokenize()).compile()
+        return Compiler.compile_to_html(root, self.translation, self.styles, minify=minify)
+
+    def test_minified_output(self):
+        text = """[
+            d(class="a b" id="main")[
+                p{some
+                    wrapped   text}(style="bold color(red)")
+                i(src="x.png" alt="a picture")
+                br()
+                hline()
+                pre{  keep
+  this}
+            ]
+        ]"""
+        self.assertEqual(self.render(text, True),
+                         '<div class="a b" id=main><p style=font-weight:bold;color:red>some wrapped text</p>'
+                         '<img src=x.png alt="a picture"><br></br><hr><pre>  keep\n  this</pre></div>')
+
+    def test_raw_preformatted_html_in_text(self):
+        text = '[p{see   <pre>  a\n   b</pre>  and <TEXTAREA rows=2>x  y</TEXTAREA>  then <script>if (a)  b()}]'
+        self.assertEqual(self.render(text, True),
+                         '<p>see <pre>  a\n   b</pre> and <TEXTAREA rows=2>x  y</TEXTAREA> then <script>if (a)  b()</p>')
+
+    def test_not_minified_by_default(self):
+        self.assertEqual(self.render('[p{a  b}(style="bold")]', False), '<p style="font-weight: bold">a  b</p>')
+
+class TestWriteOutput(unittest.TestCase):
+    def test_compressed_copy_and_unchanged_pages(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'page.html')
+            html = '<p>hello</p>' * 50
+            self.assertTrue(parse.write_output(path, html, compress=True))
+            with gzip.open(path + '.gz', 'rt') as f:
+                self.assertEqual(f.read(), html)
+            mtimes = os.stat(path).st_mtime_ns, os.stat(path + '.gz').st_mtime_ns
+            self.assertFalse(parse.write_output(path, html, compress=True))
+            self.assertEqual((os.stat(path).st_mtime_ns, os.stat(path + '.gz').st_mtime_ns), mtimes)
+
+            self.assertTrue(parse.write_output(path, html, compress=False))
+            self.assertFalse(os.path.exists(path + '.gz'))
+
+    def test_tiny_pages_are_not_compressed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'page.html')
+            parse.write_output(path, '<p>hi</p>', compress=True)
+            self.assertFalse(os.path.exists(path + '.gz'))
+
+class SourceTreeTest(unittest.TestCase):
+    # Sources written to self.source and built to self.output, in a
+    # temporary directory. The minihtml logger is quiet unless a test
+    # checks it with assertLogs.
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.source = os.path.join(self.directory.name, 'src')
+        self.output = os.path.join(self.directory.name, 'html')
+        os.makedirs(self.source)
+        os.makedirs(self.output)
+        logger = logging.getLogger('minihtml')
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.CRITICAL)
+
+    def write(self, name, data):
+        # Text or bytes, in subdirectories created as needed
+        path = os.path.join(self.source, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+        return path
+
+class TestIncrementalBuild(SourceTreeTest):
+    def setUp(self):
+        super().setUp()
+        self.write('index.mhtml', '[p{home}]')
+        self.write('sub/about.mhtml', '[p{about}(style="bold")]')
+
+    def mtimes(self):
+        return {name: os.stat(os.path.join(self.output, name)).st_mtime_ns
+                for name in os.listdir(self.output) if name.endswith('.html')}
+
+    def test_only_changed_sources_are_rebuilt(self):
+        self.assertEqual(parse.build(self.source, self.output), {'compiled': 2, 'unchanged': 0, 'removed': 0, 'failed': 0})
+        before = self.mtimes()
+        self.assertEqual(parse.build(self.source, self.output), {'compiled': 0, 'unchanged': 2, 'removed': 0, 'failed': 0})
+        self.assertEqual(self.mtimes(), before)
+
+        self.write('index.mhtml', '[p{new home}]')
+        self.assertEqual(parse.build(self.source, self.output), {'compiled': 1, 'unchanged': 1, 'removed': 0, 'failed': 0})
+        self.assertEqual(self.mtimes()['about.html'], before['about.html'])
+        with open(os.path.join(self.output, 'index.html')) as f:
+            self.assertEqual(f.read(), '<p>new home</p>')
+
+    def test_removed_sources_lose_their_output(self):
+        parse.build(self.source, self.output, compress=True)
+        os.remove(os.path.join(self.source, 'sub', 'about.mhtml'))
+        self.assertEqual(parse.build(self.source, self.output, compress=True)['removed'], 1)
+        self.assertEqual(sorted(self.mtimes()), ['index.html'])
+
+    def test_failed_pages_keep_their_stylesheet(self):
+        def sheets():
+            return sorted(name for name in os.listdir(self.output) if name.endswith('.css'))
+        self.write('index.mhtml', '[p{home}(style="italic")]')
+        parse.build(self.source, self.output, extract_css=True)
+        old = sheets()
+        self.write('index.mhtml', '[p{home}(style="width-height(1px)")]')
+        self.write('sub/about.mhtml', '[p{about}(style="underline")]')
+        with self.assertLogs('minihtml.parse', 'ERROR'):
+            self.assertEqual(parse.build(self.source, self.output, extract_css=True)['failed'], 1)
+        # The old index.html still links the old sheet
+        self.assertEqual(len(sheets()), 2)
+        self.assertTrue(set(old) < set(sheets()))
+        self.write('index.mhtml', '[p{home}]')
+        parse.build(self.source, self.output, extract_css=True)
+        self.assertEqual(len(sheets()), 1)
+        self.assertNotEqual(sheets(), old)
+
+    def test_changed_paths_limit_hashing(self):
+        parse.build(self.source, self.output)
+        self.write('index.mhtml', '[p{new home}]')
+        about = os.path.join(self.source, 'sub', 'about.mhtml')
+        self.assertEqual(parse.build(self.source, self.output, changed={about})['compiled'], 0)
+        index = os.path.join(self.source, 'index.mhtml')
+        self.assertEqual(parse.build(self.source, self.output, changed={index})['compiled'], 1)
+
+    def test_option_change_rebuilds_everything(self):
+        parse.build(self.source, self.output)
+        self.assertEqual(parse.build(self.source, self.output, minify=True)['compiled'], 2)
+
+    def test_changes_to_output_modules_rebuild_everything(self):
+        parse.build(self.source, self.output)
+        self.addCleanup(parse.compiler_version.cache_clear)
+        changed = os.path.join(self.directory.name, 'changed.py')
+        with open(changed, 'w') as f:
+            f.write('# a change to a module\n')
+        for module in (compiler, passes, images, budget):
+            original = module.__file__
+            module.__file__ = changed
+            try:
+                parse.compiler_version.cache_clear()
+                self.assertEqual(parse.build(self.source, self.output)['compiled'], 2, module.__name__)
+            finally:
+                module.__file__ = original
+            parse.compiler_version.cache_clear()
+            self.assertEqual(parse.build(self.source, self.output)['compiled'], 2)
+
+class TestIncludes(SourceTreeTest):
+    def setUp(self):
+        super().setUp()
+        self.write('partials/nav.mhtml', '[l{home}(href="/")]')
+        self.write('partials/header.mhtml', '[s-top(style="bold") hl{Site}(class="top") inc(src="partials/nav.mhtml")]')
+        self.write('index.mhtml', '[inc(src="partials/header.mhtml") p{index}(class="top")]')
+        self.write('sub/about.mhtml', '[inc(src="partials/header.mhtml") p{about}]')
+        self.write('plain.mhtml', '[p{plain}]')
+
+    def read(self, name):
+        with open(os.path.join(self.output, name)) as f:
+            return f.read()
+
+    def test_fragments_are_rendered_in_place(self):
+        self.assertEqual(parse.build(self.source, self.output)['compiled'], 3)
+        # The fragment's s- classes stay inside it
+        self.assertEqual(self.read('index.html'),
+                         '<h1 class="top" style="font-weight: bold">Site</h1><a href="/">home</a><p class="top">index</p>')
+        self.assertEqual(sorted(name for name in os.listdir(self.output) if name.endswith('.html')),
+                         ['about.html', 'index.html', 'plain.html'])
+
+    def test_editing_a_partial_rebuilds_its_pages(self):
+        parse.build(self.source, self.output)
+        self.write('partials/nav.mhtml', '[l{start}(href="/")]')
+        stats = parse.build(self.source, self.output)
+        self.assertEqual((stats['compiled'], stats['unchanged']), (2, 1))
+        self.assertIn('start', self.read('about.html'))
+
+        cache = parse.fragment_cache(self.source, optimize_images=True)
+        header = cache.fragments[os.path.abspath(os.path.join(self.source, 'partials', 'header.mhtml'))]
+        self.write('index.mhtml', '[inc(src="partials/header.mhtml") p{new index}]')
+        self.assertEqual(parse.build(self.source, self.output)['compiled'], 1)
+        self.assertIs(cache.fragments[os.path.abspath(os.path.join(self.source, 'partials', 'header.mhtml'))], header)
+
+    def test_changed_paths_include_partials(self):
+        parse.build(self.source, self.output)
+        nav = os.path.join(self.source, 'partials', 'nav.mhtml')
+        self.write('partials/nav.mhtml', '[l{start}(href="/")]')
+        self.assertEqual(parse.build(self.source, self.output, changed={nav})['compiled'], 2)
+
+    def test_include_cycles_fail(self):
+        self.write('partials/nav.mhtml', '[inc(src="partials/header.mhtml")]')
+        stats = parse.build(self.source, self.output)
+        self.assertEqual((stats['compiled'], stats['failed']), (1, 2))
+        includes = parse.Includes(parse.FragmentCache(self.source))
+        with self.assertRaisesRegex(parse.IncludeError, 'header.mhtml -> partials/nav.mhtml -> partials/header.mhtml'):
+            includes('partials/header.mhtml')
+        with self.assertRaises(parse.IncludeError):
+            includes('../outside.mhtml')
+
+    def test_extracted_styles_of_fragments(self):
+        parse.build(self.source, self.output, extract_css=True)
+        stylesheet = [name for name in os.listdir(self.output) if name.endswith('.css')]
+        self.assertEqual(len(stylesheet), 1)
+        self.assertTrue(self.read('about.html').startswith(Stylesheet.link(stylesheet[0])))
+
+    def test_served_pages_follow_their_partials(self):
+        server = serve.Server(self.source)
+        with serve.background(server) as url:
+            connection = http.client.HTTPConnection(url[len('http://'):])
+            self.addCleanup(connection.close)
+            connection.request('GET', '/about.html')
+            self.assertIn(b'home', connection.getresponse().read())
+            self.write('partials/nav.mhtml', '[l{start page}(href="/")]')
+            connection.request('GET', '/about.html')
+            self.assertIn(b'start page', connection.getresponse().read())
+            connection.request('GET', '/nav.html')
+            self.assertEqual(connection.getresponse().status, 404)
+
+class TestParallelBuild(SourceTreeTest):
+    def setUp(self):
+        super().setUp()
+        for i in range(6):
+            self.write(f'page{i}.mhtml', f'[p{{page {i}}}(style="bold")]' * (i + 1) * 50)
+
+    def outputs(self, jobs, **options):
+        output = os.path.join(self.directory.name, f'html{jobs}')
+        os.makedirs(output)
+        stats = parse.build(self.source, output, jobs=jobs, **options)
+        files = {}
+        for name in sorted(os.listdir(output)):
+            with open(os.path.join(output, name), 'rb') as f:
+                files[name] = f.read()
+        return stats, files
+
+    def test_jobs_give_the_same_output(self):
+        self.assertEqual(self.outputs(1, extract_css=True, minify=True), self.outputs(3, extract_css=True, minify=True))
+
+    def test_failed_page_does_not_stop_the_build(self):
+        self.write('broken.mhtml', b'[p{\xff}]')
+        stats, files = self.outputs(2)
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['compiled'], 6)
+        self.assertNotIn('broken.html', files)
+
+    def test_missing_source_fails_alone(self):
+        tasks = [('gone', os.path.join(self.source, 'gone.mhtml')), ('page0', os.path.join(self.source, 'page0.mhtml'))]
+        for jobs in (1, 2):
+            results = parse.compile_pages(tasks, False, False, jobs)
+            self.assertIsInstance(results['gone'], OSError)
+            self.assertTrue(results['page0'][0].startswith('<p style="font-weight: bold">page 0</p>'))
+
+class TestProfile(unittest.TestCase):
+    def test_count_nodes(self):
+        tokens = Parser('[d[p{a} p{b}(style="bold") d[br()]]]').tokenize()
+        self.assertEqual(instrument.count_nodes(Compiler(tokens).compile()), 6)
+        self.assertEqual(instrument.count_nodes(Compiler(tokens).compile(compact=True)), 6)
+
+    def test_build_profiles_compiled_pages(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name, text in (('small.mhtml', '[p{a}]'), ('big.mhtml', '[' + 'p{b}(style="bold") ' * 50 + ']')):
+                with open(os.path.join(directory, name), 'w') as f:
+                    f.write(text)
+            profiles = {}
+            stats = parse.build(directory, directory, profiles=profiles)
+            self.assertEqual(sorted(profiles), ['big.mhtml', 'small.mhtml'])
+            small = profiles['small.mhtml']
+            self.assertEqual((small.tokens, small.nodes, small.input_bytes, small.output_bytes), (4, 2, 6, 8))
+            self.assertGreater(small.peak_memory, 0)
+
+            report = instrument.report(profiles, 1.0, stats)
+            self.assertEqual(report['largest'][0]['page'], 'big.mhtml')
+            self.assertEqual(report['totals']['nodes'], 53)
+            self.assertIn('classes', report['passes'])
+            self.assertEqual(parse.build(directory, directory, profiles={})['compiled'], 0)
+
+class TestWire(unittest.TestCase):
+    translation = {'p': 'p', 'd': 'div', 'l': 'a'}
+    styles = {'bold': 'font-weight: bold', 'color': 'color: {}', 'font': 'font-family: {}'}
+
+    def tree(self, text):
+        return Compiler(Parser(text).tokenize()).compile()
+
+    def assertSameTree(self, first, second):
+        stack = [(first, second)]
+        while stack:
+            a, b = stack.pop()
+            self.assertEqual((a.tag, a.content, a.attributes, len(a.children)),
+                             (b.tag, b.content, b.attributes, len(b.children)))
+            stack.extend(zip(a.children, b.children))
+
+    def test_round_trip(self):
+        text = ('[s-x(style="bold") d[p{héllo}(class="x" style="font(Brush Script MT) color(#fff)") br()]'
+                'p{a}(style="bold  color(red") l{link}(href="https://example.com")]')
+        root = self.tree(text)
+        data = wire.encode(root, self.translation, self.styles)
+        self.assertSameTree(wire.decode(data, self.translation, self.styles), root)
+        for minify in (False, True):
+            self.assertEqual(wire.decode_to_html(data, self.translation, self.styles, minify=minify),
+                             Compiler.compile_to_html(root, self.translation, self.styles, minify=minify))
+
+    def test_repeated_strings_are_references(self):
+        one = wire.encode(self.tree('[p{same text}(style="bold")]'), self.translation, self.styles)
+        many = wire.encode(self.tree('[' + 'p{same text}(style="bold")' * 100 + ']'), self.translation, self.styles)
+        # tag, text, attribute count, key, directive count, directive, child count
+        self.assertEqual(len(many) - len(one), 99 * 7)
+
+    def test_other_tables_are_rejected(self):
+        data = wire.encode(self.tree('[p{a}]'), self.translation, self.styles)
+        with self.assertRaises(wire.WireError):
+            wire.decode(data, dict(self.translation, x='span'), self.styles)
+        with self.assertRaises(wire.WireError):
+            wire.decode(b'<p>' + data, self.translation, self.styles)
+
+    def test_truncated_and_trailing_data(self):
+        data = wire.encode(self.tree('[d[p{héllo}(style="bold color(red)" id="x") p{héllo}] br()]'),
+                           self.translation, self.styles)
+        for bad in [data[:end] for end in range(5, len(data))] + [data + b'\0', data + data]:
+            with self.assertRaises(wire.WireError, msg=repr(bad)):
+                wire.decode(bad, self.translation, self.styles)
+            with self.assertRaises(wire.WireError, msg=repr(bad)):
+                wire.decode_to_html(bad, self.translation, self.styles)
+
+    def test_corrupted_data(self):
+        data = wire.encode(self.tree('[d[p{héllo}(style="bold color(red)" id="x") p{héllo}] br()]'),
+                           self.translation, self.styles)
+        rng = random.Random(5)
+        for _ in range(500):
+            bad = bytearray(data)
+            bad[rng.randrange(5, len(bad))] = rng.randrange(256)
+            try:
+                wire.decode(bytes(bad), self.translation, self.styles)
+            except wire.WireError:
+                pass
+
+class TestGenerator(unittest.TestCase):
+    def depth(self, node):
+        deepest, stack = 0, [(node, 0)]
+        while stack:
+            node, depth = stack.pop()
+            deepest = max(deepest, depth)
+            stack.extend((child, depth + 1) for child in node.children)
+        return deepest
+
+    def test_documents_are_seeded(self):
+        self.assertEqual(generate_document(200, seed=4), generate_document(200, seed=4))
+        self.assertNotEqual(generate_document(200, seed=4), generate_document(200, seed=5))
+
+    def test_parameters_shape_the_document(self):
+        root = Compiler(Parser(generate_document(1000, depth=3, classes=0, seed=1)).tokenize()).compile()
+        self.assertEqual(instrument.count_nodes(root), 1001)
+        self.assertLessEqual(self.depth(root), 4)
+        html = Compiler.compile_to_html(root, translation, styles)
+        self.assertNotIn('class=', html)
+        plain = generate_document(300, attribute_density=0, classes=0, styles=0, seed=2)
+        self.assertNotIn('style=', plain)
+
+class TestWatcher(SourceTreeTest):
+    def test_inotify_reports_saved_files(self):
+        files = watcher.InotifyWatcher(self.source)
+        self.addCleanup(files.close)
+        path = self.write('index.mhtml', '[p{hi}]')
+        self.assertEqual(watcher.wait_for_changes(files, debounce=0.01), {path})
+
+    def test_inotify_watches_new_directories(self):
+        files = watcher.InotifyWatcher(self.source)
+        self.addCleanup(files.close)
+        os.mkdir(os.path.join(self.source, 'sub'))
+        self.assertIsNone(watcher.wait_for_changes(files, debounce=0.01))
+        path = self.write(os.path.join('sub', 'page.mhtml'), '[p{hi}]')
+        self.assertEqual(watcher.wait_for_changes(files, debounce=0.01), {path})
+
+    def test_burst_of_saves_is_one_change(self):
+        files = watcher.InotifyWatcher(self.source)
+        self.addCleanup(files.close)
+        paths = {self.write(f'page{i}.mhtml', '[p{hi}]') for i in range(20)}
+        self.assertEqual(watcher.wait_for_changes(files, debounce=0.05), paths)
+        self.assertEqual(files.poll(0), set())
+
+    def test_sources(self):
+        for name in ('index.mhtml', 'page.minihtml', 'cat.png', budget.CONFIG_NAME):
+            self.assertTrue(watcher.is_source(os.path.join(self.source, name)), name)
+        for name in ('notes.txt', 'index.html', budget.CONFIG_NAME + '.swp'):
+            self.assertFalse(watcher.is_source(os.path.join(self.source, name)), name)
+
+    def test_polling_fallback(self):
+        path = self.write('index.mhtml', '[p{hi}]')
+        files = watcher.PollingWatcher(self.source, interval=0.01)
+        self.assertEqual(files.poll(0), set())
+        os.remove(path)
+        self.assertEqual(watcher.wait_for_changes(files, debounce=0.02), {path})
+
+def run_command(test, module, *args):
+    # Starts `python -m module` on a free port until test ends; returns host:port once it accepts connections
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    process = subprocess.Popen([sys.executable, '-m', module, '-p', str(port), *args], stderr=subprocess.DEVNULL,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    test.addCleanup(process.wait)
+    test.addCleanup(process.terminate)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return f'127.0.0.1:{port}'
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    test.fail(f'{module} did not start')
+
+class TestServe(SourceTreeTest):
+    def setUp(self):
+        super().setUp()
+        self.write('index.mhtml', '[' + 'p{home}(style="bold")' * 20 + ']')
+        self.write(os.path.join('sub', 'about.mhtml'), '[p{about}]')
+        self.server = serve.Server(self.source, rescan_interval=0)
+        context = serve.background(self.server)
+        url = context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
+        self.connection = http.client.HTTPConnection(url[len('http://'):])
+        self.addCleanup(self.connection.close)
+
+    def get(self, path, **headers):
+        self.connection.request('GET', path, headers=headers)
+        response = self.connection.getresponse()
+        return response, response.read()
+
+    def test_pages_are_compiled_once(self):
+        response, body = self.get('/')
+        self.assertEqual(response.status, 200)
+        expected = parse.compile_file(os.path.join(self.source, 'index.mhtml'), minify=True)
+        self.assertEqual(body.decode('utf-8'), expected)
+        self.assertEqual(self.get('/about.html')[1], b'<p>about</p>')
+        self.get('/index.html')
+        self.assertEqual(self.server.stats, {'hits': 1, 'misses': 2})
+
+    def test_etag_and_not_modified(self):
+        response, _ = self.get('/')
+        etag = response.getheader('ETag')
+        self.assertTrue(etag.startswith('"'))
+        response, body = self.get('/', **{'If-None-Match': etag})
+        self.assertEqual((response.status, body), (304, b''))
+        self.write('index.mhtml', '[p{changed}]')
+        response, body = self.get('/', **{'If-None-Match': etag})
+        self.assertEqual((response.status, body), (200, b'<p>changed</p>'))
+
+    def test_gzip_representation(self):
+        response, body = self.get('/', **{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertNotEqual(response.getheader('ETag'), self.get('/')[0].getheader('ETag'))
+        self.assertEqual(gzip.decompress(body), self.get('/')[1])
+
+    def test_missing_pages(self):
+        self.assertEqual(self.get('/nope.html')[0].status, 404)
+        self.assertEqual(self.get('/sub/about.html')[0].status, 404)
+        self.write('404.mhtml', '[p{lost}]')
+        response, body = self.get('/nope.html')
+        self.assertEqual((response.status, body), (404, b'<p>lost</p>'))
+
+    def test_images(self):
+        self.write('cat.png', png(700, 20))
+        self.addCleanup(lambda: self.server.images.cleanup())
+        self.write('cat.mhtml', '[i(src="cat.png")]')
+        page = self.get('/cat.html')[1].decode('utf-8')
+        self.assertEqual(page, parse.compile_file(os.path.join(self.source, 'cat.mhtml'), minify=True,
+                                                  image=images.Images(self.source)))
+        candidates = re.findall(r'(img/\S+) (\d+)w', page)
+        self.assertEqual([width for _, width in candidates], ['320', '640', '700'])
+        for url, width in candidates:
+            response, body = self.get('/' + url)
+            self.assertEqual((response.status, response.getheader('Content-Type')), (200, 'image/png'))
+            self.assertEqual(struct.unpack('>I', body[16:20])[0], int(width))
+        self.assertEqual(self.get('/img/dog.png')[0].status, 404)
+
+    def test_main(self):
+        connection = http.client.HTTPConnection(run_command(self, 'minihtml.serve', '-d', self.source))
+        self.addCleanup(connection.close)
+        connection.request('GET', '/about.html')
+        self.assertEqual(connection.getresponse().read(), b'<p>about</p>')
+
+    def test_cache_is_bounded(self):
+        cache = serve.PageCache(150)
+        for name in 'abc':
+            cache.put(name, (0, 0), serve.Page(name.encode() * 40))
+        self.assertEqual(list(cache.pages), ['b', 'c'])
+        self.assertIsNone(cache.get('c', (1, 0)))
+
+class TestPackage(unittest.TestCase):
+    def imported_by(self, statement):
+        # Modules loaded by statement in a fresh interpreter
+        code = f"import sys; {statement}; print(' '.join(sys.modules))"
+        result = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, universal_newlines=True,
+                                check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        return set(result.stdout.split())
+
+    def test_import_is_lazy(self):
+        modules = self.imported_by('import minihtml')
+        self.assertNotIn('minihtml.compiler', modules)
+        modules = self.imported_by('import minihtml.compiler')
+        self.assertFalse({'logging', 'hashlib', 'minihtml.parse'} & modules)
+        modules = self.imported_by('import minihtml.parse')
+        self.assertFalse({'concurrent.futures', 'tracemalloc', 'pickle'} & modules)
+
+    def test_lazy_exports(self):
+        self.assertIs(minihtml.Compiler, Compiler)
+        self.assertIs(minihtml.build, parse.build)
+        with self.assertRaises(AttributeError):
+            minihtml.missing
+
+    def test_patterns_compile_on_first_use(self):
+        from minihtml import compiler
+        self.assertEqual([t.value for t in Parser('[p{x}]').tokenize()], ['[', 'p', 'x', ']'])
+        self.assertNotIsInstance(compiler.TOKEN_PATTERN, compiler.LazyPattern)
+
+    def test_render_and_build(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'src')
+            os.makedirs(os.path.join(source, 'partials'))
+            with open(os.path.join(source, 'index.mhtml'), 'w') as f:
+                f.write('[p{Hi}(class="a") inc(src="partials/footer.mhtml")]')
+            with open(os.path.join(source, 'partials', 'footer.mhtml'), 'w') as f:
+                f.write('[p{Footer}]')
+            page = os.path.join(directory, 'page.html')
+            cli.main(['render', os.path.join(source, 'index.mhtml'), '-m', '-r', source, '-o', page])
+            with open(page) as f:
+                self.assertEqual(f.read(), '<p class=a>Hi</p><p>Footer</p>')
+            output = os.path.join(directory, 'out', 'site')
+            cli.main(['build', '-d', source, '-o', output])
+            self.assertIn('index.html', os.listdir(output))
+
+class TestBatch(unittest.TestCase):
+    def pipeline(self, source, minify=False):
+        return Compiler.compile_to_html(Compiler(Parser(source).tokenize()).compile(), translation, styles, minify=minify)
+
+    def test_matches_pipeline(self):
+        sources = [generate_document(nodes=n % 7 + 1, seed=n) for n in range(50)] + ['', '[', 'p{no root}', '[p]] [p]']
+        for minify in (False, True):
+            expected = [self.pipeline(source, minify) for source in sources]
+            self.assertEqual(batch.compile_many(sources, translation, styles, minify, chunk_size=7), expected)
+
+    def test_token_buffer(self):
+        source = generate_document(nodes=40, seed=3)
+        buffer = TokenBuffer()
+        Parser('[p{stale}]').tokenize_into(buffer)
+        tokens = Parser(source).tokenize_into(buffer)
+        self.assertEqual([(t.type, t.value) for t in tokens], [(t.type, t.value) for t in Parser(source).tokenize()])
+        self.assertEqual(Compiler.compile_to_html(Compiler(tokens).compile(compact=True), translation, styles),
+                         self.pipeline(source))
+
+    def test_classes_do_not_leak(self):
+        results = batch.compile_many(['[s-a(style="bold") p(class="a")]', '[p(class="a")]'], translation, styles)
+        self.assertEqual(results, ['<p class="a" style="font-weight: bold"></p>', '<p class="a"></p>'])
+
+    def test_errors_in_place(self):
+        results = batch.compile_many(['[p{a}]', None, '[p{b}]'], translation, styles, chunk_size=2)
+        self.assertEqual((results[0], results[2]), ('<p>a</p>', '<p>b</p>'))
+        self.assertIsInstance(results[1], batch.CompileError)
+        self.assertEqual(results[1].index, 1)
+        self.assertIn('TypeError', str(results[1]))
+
+    def test_executors_keep_order(self):
+        sources = [f'[p{{{n}}}]' for n in range(30)] + [None]
+        expected = [f'<p>{n}</p>' for n in range(30)]
+        for pool in (ThreadPoolExecutor, ProcessPoolExecutor):
+            with pool(max_workers=2) as executor:
+                results = batch.compile_many(sources, translation, styles, executor=executor, chunk_size=4)
+            self.assertEqual(results[:30], expected)
+            self.assertEqual(results[30].index, 30)
+
+class TestBudget(SourceTreeTest):
+    def setUp(self):
+        super().setUp()
+        self.write('index.mhtml', '[p{home}(style="bold") p{two}]')
+        self.write('blog/post.mhtml', '[d[p{' + 'words ' * 200 + '}]]')
+
+    def test_page_sizes(self):
+        sizes = {}
+        parse.build(self.source, self.output, compress=True, sizes=sizes)
+        self.assertEqual(set(sizes), {'index.mhtml', 'blog/post.mhtml'})
+        index = sizes['index.mhtml']
+        with open(os.path.join(self.output, 'index.html'), 'rb') as f:
+            html = f.read()
+        self.assertEqual(index['html_bytes'], len(html))
+        self.assertEqual(index['source_bytes'], os.path.getsize(os.path.join(self.source, 'index.mhtml')))
+        self.assertEqual(index['elements'], 2)
+        self.assertEqual(index['inline_style_bytes'], len(' style="font-weight: bold"'))
+        post = sizes['blog/post.mhtml']
+        self.assertEqual(post['gzip_bytes'], os.path.getsize(os.path.join(self.output, 'post.html.gz')))
+        self.assertLess(post['gzip_bytes'], post['html_bytes'])
+        self.assertEqual(post['output'], 'post.html')
+        # Without compressed files the same compression is measured
+        os.remove(os.path.join(self.output, 'post.html.gz'))
+        self.assertEqual(parse.measure_page(os.path.join(self.source, 'blog/post.mhtml'),
+                                            os.path.join(self.output, 'post.html'))['gzip_bytes'], post['gzip_bytes'])
+        # Unchanged pages keep their measurements in the manifest
+        again = {}
+        self.assertEqual(parse.build(self.source, self.output, compress=True, sizes=again)['compiled'], 0)
+        self.assertEqual(again, sizes)
+
+    def test_budgets(self):
+        config = {'mode': 'warn', 'budgets': {'*': {'html_bytes': 500, 'elements': 10},
+                                              'blog/*': {'html_bytes': 2000, 'mode': 'fail'}}}
+        self.assertEqual(budget.limits_for('blog/post.mhtml', config), {'mode': 'fail', 'html_bytes': 2000, 'elements': 10})
+        self.assertEqual(budget.limits_for('index.mhtml', config), {'mode': 'warn', 'html_bytes': 500, 'elements': 10})
+        sizes = {'index.mhtml': {'html_bytes': 600, 'elements': 3, 'brotli_bytes': None},
+                 'blog/post.mhtml': {'html_bytes': 1500, 'elements': 11}}
+        self.assertEqual(budget.check(sizes, config), [
+            {'page': 'blog/post.mhtml', 'metric': 'elements', 'limit': 10, 'value': 11, 'mode': 'fail'},
+            {'page': 'index.mhtml', 'metric': 'html_bytes', 'limit': 500, 'value': 600, 'mode': 'warn'},
+        ])
+        self.assertEqual(budget.check(sizes, None), [])
+        path = os.path.join(self.source, budget.CONFIG_NAME)
+        for text in ('{', '[]', '{"budgets": {"*": {"bytes": 1}}}', '{"budgets": {"*": {"html_bytes": -1}}}',
+                     '{"budgets": {"*": {"mode": "explode"}}}'):
+            self.write(budget.CONFIG_NAME, text)
+            with self.assertRaises(budget.BudgetError):
+                budget.load_config(path)
+        self.assertIsNone(budget.load_config(os.path.join(self.source, 'missing.json')))
+
+    def test_build_fails_over_budget(self):
+        report_path = os.path.join(self.directory.name, 'sizes.json')
+        argv = ['-d', self.source, '-o', self.output, '--size-report', report_path]
+        parse.main(argv)  # no budgets: only the report
+        with open(report_path) as f:
+            report = json.load(f)
+        self.assertEqual(report['totals']['pages'], 2)
+        self.assertEqual([page['page'] for page in report['pages']], ['blog/post.mhtml', 'index.mhtml'])
+        self.assertEqual(report['over_budget'], [])
+
+        self.write(budget.CONFIG_NAME, '{"budgets": {"blog/*": {"html_bytes": 100}}}')
+        with self.assertLogs('minihtml.parse', 'WARNING') as logs:
+            parse.main(argv)
+        self.assertIn('blog/post.mhtml: html_bytes is', logs.output[0])
+        self.write(budget.CONFIG_NAME, '{"mode": "fail", "budgets": {"blog/*": {"html_bytes": 100}}}')
+        with self.assertRaises(SystemExit), self.assertLogs('minihtml.parse', 'ERROR'):
+            parse.main(argv)
+        with open(report_path) as f:
+            report = json.load(f)
+        self.assertTrue(report['failed'])
+        self.assertEqual(report['over_budget'][0]['metric'], 'html_bytes')
+
+def png(width, height, shade=0):
+    # Smallest valid RGB PNG of the given size
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    rows = b''.join(b'\x00' + bytes((shade, x % 256, 0)) * width for x in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+class TestImages(SourceTreeTest):
+    def setUp(self):
+        super().setUp()
+        self.write('pics/cat photo.png', png(700, 20))
+        self.write('index.mhtml', b'[i(src="pics/cat photo.png" alt="cat") i(src="https://example.com/a.png")]')
+
+    def page(self):
+        with open(os.path.join(self.output, 'index.html')) as f:
+            return f.read()
+
+    def variants(self):
+        return sorted(os.listdir(os.path.join(self.output, images.IMAGE_DIR)))
+
+    def test_image_size_from_headers(self):
+        path = os.path.join(self.source, 'image')
+        headers = {
+            (700, 20): png(700, 20),
+            (3, 5): b'GIF89a' + struct.pack('<HH', 3, 5) + b'\x00' * 20,
+            (640, 480): (b'\xff\xd8\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + b'\x00' * 9
+                         + b'\xff\xff\xc2' + struct.pack('>HBHH', 17, 8, 480, 640) + b'\x00' * 12),
+            (1000, 300): b'RIFF\x00\x00\x00\x00WEBPVP8X' + b'\x00' * 8 + (999).to_bytes(3, 'little')
+                         + (299).to_bytes(3, 'little'),
+            None: b'<svg xmlns="http://www.w3.org/2000/svg"></svg>',
+        }
+        for size, data in headers.items():
+            with open(path, 'wb') as f:
+                f.write(data)
+            self.assertEqual(images.image_size(path), size)
+        # Orientation 6 (turned a quarter) in big-endian Exif before the frame: shown 480 wide
+        tiff = b'MM\x00\x2a' + struct.pack('>IH', 8, 1) + struct.pack('>HHIHH', 0x0112, 3, 1, 6, 0) + b'\x00' * 4
+        with open(path, 'wb') as f:
+            f.write(b'\xff\xd8\xff\xe1' + struct.pack('>H', 8 + len(tiff)) + b'Exif\x00\x00' + tiff
+                    + b'\xff\xc0' + struct.pack('>HBHH', 17, 8, 480, 640) + b'\x00' * 12)
+        self.assertEqual(images.image_size(path), (480, 640))
+
+    def test_local_images_are_sized_and_written(self):
+        parse.build(self.source, self.output, minify=True)
+        html = self.page()
+        self.assertIn('width=700 height=20', html)
+        self.assertIn('loading=lazy', html)
+        self.assertIn('alt=cat', html)
+        self.assertIn('<img src=https://example.com/a.png>', html)
+        self.assertTrue(all(name.startswith('cat-photo.') for name in self.variants()))
+        src = html.split('src=', 1)[1].split(' ', 1)[0]
+        self.assertTrue(os.path.exists(os.path.join(self.output, src)))
+        # Unchanged images are not written again, and the option can be turned off
+        mtimes = [os.stat(os.path.join(self.output, images.IMAGE_DIR, name)).st_mtime_ns for name in self.variants()]
+        self.assertEqual(parse.build(self.source, self.output, minify=True)['compiled'], 0)
+        self.assertEqual([os.stat(os.path.join(self.output, images.IMAGE_DIR, name)).st_mtime_ns
+                          for name in self.variants()], mtimes)
+        parse.build(self.source, self.output, minify=True, optimize_images=False)
+        self.assertIn('<img src="pics/cat photo.png" alt=cat>', self.page())
+        self.assertEqual(self.variants(), [])
+
+    def test_editing_an_image_rebuilds_its_pages(self):
+        self.write('plain.mhtml', b'[p{no images}]')
+        parse.build(self.source, self.output)
+        old = self.variants()
+        self.write('pics/cat photo.png', png(700, 40, shade=9))
+        stats = parse.build(self.source, self.output)
+        self.assertEqual((stats['compiled'], stats['unchanged']), (1, 1))
+        self.assertIn('height="40"', self.page())
+        self.assertTrue(self.variants())
+        self.assertFalse(set(old) & set(self.variants()))
+
+    def test_watched_image_changes(self):
+        image = os.path.join(self.source, 'pics', 'cat photo.png')
+        self.assertTrue(watcher.is_source(image))
+        parse.build(self.source, self.output)
+        self.write('pics/cat photo.png', png(350, 20))
+        self.assertEqual(parse.build(self.source, self.output, changed={image})['compiled'], 1)
+        self.assertIn('width="350"', self.page())
+
+    def test_images_in_fragments(self):
+        os.makedirs(os.path.join(self.source, 'partials'))
+        self.write('partials/logo.mhtml', b'[i(src="pics/cat photo.png" width="350")]')
+        self.write('index.mhtml', b'[inc(src="partials/logo.mhtml")]')
+        parse.build(self.source, self.output, jobs=2)
+        self.assertIn('width="350" height="10"', self.page())
+        self.assertTrue(self.variants())
+
+    @unittest.skipUnless(images.has_pillow(), 'Pillow is not installed')
+    def test_resized_variants(self):
+        from PIL import Image
+        parse.build(self.source, self.output, jobs=2)
+        html = self.page()
+        self.assertIn('srcset="img/cat-photo.', html)
+        self.assertIn(' 320w, ', html)
+        self.assertIn('sizes="(max-width: 700px) 100vw, 700px"', html)
+        sizes = {}
+        for name in self.variants():
+            with Image.open(os.path.join(self.output, images.IMAGE_DIR, name)) as image:
+                sizes[int(name.rsplit('.', 2)[1])] = image.size
+        self.assertEqual(sizes, {320: (320, 9), 640: (640, 18), 700: (700, 20)})
+
+    @unittest.skipUnless(images.has_pillow(), 'Pillow is not installed')
+    def test_orientation(self):
+        from PIL import Image
+        for extension, format in (('.jpg', 'JPEG'), ('.png', 'PNG'), ('.webp', 'WEBP')):
+            # 400x200 as stored, the top half red; orientation 6 shows it 200x400 with red on the right
+            image = Image.new('RGB', (400, 200), (0, 0, 255))
+            image.paste((255, 0, 0), (0, 0, 400, 100))
+            exif = Image.Exif()
+            exif[0x0112] = 6
+            image.save(os.path.join(self.source, 'pics', 'phone' + extension), format, exif=exif.tobytes())
+            self.write('index.mhtml', f'[i(src="pics/phone{extension}")]'.encode())
+            parse.build(self.source, self.output)
+            self.assertIn('width="200" height="400"', self.page())
+            for name in self.variants():
+                if name.startswith('phone') and name.endswith(extension) and '.200.' in name:
+                    with Image.open(os.path.join(self.output, images.IMAGE_DIR, name)) as variant:
+                        self.assertEqual(variant.size, (200, 400))
+                        self.assertEqual(variant.getexif().get(0x0112, 1), 1)
+                        red, green, blue = variant.convert('RGB').getpixel((190, 200))
+                        self.assertGreater(red, blue, format)
+                    break
+            else:
+                self.fail(f'no full-size variant of phone{extension}')
+
+    def test_variants_are_written_while_pages_compile(self):
+        writer = images.VariantWriter(self.output)
+        path = os.path.join(self.source, 'pics', 'cat photo.png')
+        info = images.image_info(path)
+        variants = {images.variant_name(path, info, width): (path, width) for width in images.variant_widths(path, info)}
+        writer.add(variants)
+        self.assertEqual(len(writer.tasks), 1)  # started by add()
+        writer.add(variants)  # another page with the same image
+        self.assertEqual(len(writer.tasks), 1)
+        self.assertEqual(writer.finish(), len(variants))
+        self.assertEqual(self.variants(), sorted(variants))
+        writer = images.VariantWriter(self.output)
+        writer.add(variants)
+        self.assertIsNone(writer.executor)  # nothing left to write, no pool
+        self.assertEqual(writer.finish(), 0)
+
+class TestIncremental(unittest.TestCase):
+    def pipeline(self, source):
+        return Compiler.compile_to_html(Compiler(Parser(source).tokenize()).compile(), translation, styles)
+
+    def rendered(self, document):
+        return re.sub(r' data-mh="\d+"', '', document.render())
+
+    def test_random_edits_match_pipeline(self):
+        rng = random.Random(0)
+        pieces = ['[', ']', '{', '}', '(', ')', '"', ' ', 'p', 'x', 'd[p{a}]', '(id="b")', '{hi}', 'br']
+        patches = 0
+        for n in range(60):
+            document = incremental.Document(generate_document(nodes=rng.randint(1, 30), seed=n, styles=0))
+            for _ in range(20):
+                start = rng.randint(0, len(document.text))
+                end = min(len(document.text), start + rng.choice([0, 0, 1, 3]))
+                patch = document.edit(start, end, rng.choice(pieces) if rng.random() < 0.5 else 'ab')
+                html = document.render()
+                self.assertEqual(self.rendered(document), self.pipeline(document.text))
+                if patch is not None:
+                    patches += 1
+                    self.assertIn(document.render_element(patch.node), html)
+        self.assertGreater(patches, 300)
+
+    def test_patch_replaces_element(self):
+        document = incremental.Document('[d[p{one} p{two}] p{three}]')
+        before = document.render()
+        patch = document.edit(12, 15, 'TWO')
+        self.assertEqual(document.text, '[d[p{one} p{TWO}] p{three}]')
+        self.assertIn(f'<p data-mh="{patch.old}">two</p>', before)
+        self.assertEqual(document.render_element(patch.node), f'<p data-mh="{patch.node.attributes["data-mh"]}">TWO</p>')
+        # Later elements moved with the edit
+        self.assertIsNotNone(document.edit(23, 23, '!'))
+        self.assertIn('>thr!ee</p>', document.render())
+
+    def test_edits_outside_an_element(self):
+        document = incremental.Document('[s-c(style="bold") p{a}(class="c") p{b}]')
+        self.assertIsNone(document.edit(12, 16, 'italic'))
+        self.assertIn('font-style: italic', document.render())
+        # An unclosed bracket takes the next sibling, so the page is parsed again
+        self.assertIsNone(document.edit(document.text.index('p{b}'), document.text.index('p{b}'), 'd['))
+        self.assertEqual(self.rendered(document), self.pipeline(document.text))
+        with self.assertRaises(ValueError):
+            document.edit(5, 500, '')
+
+class TestPreview(unittest.TestCase):
+    def setUp(self):
+        self.preview = preview.Preview()
+        context = serve.background(self.preview)
+        url = context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
+        self.address = url[len('http://'):]
+        self.connection = http.client.HTTPConnection(self.address)
+        self.addCleanup(self.connection.close)
+
+    def post(self, route, data):
+        self.connection.request('POST', route, json.dumps(data), {'Content-Type': 'application/json'})
+        response = self.connection.getresponse()
+        return response.status, response.read()
+
+    def events(self, path, version):
+        connection = http.client.HTTPConnection(self.address, timeout=10)
+        self.addCleanup(connection.close)
+        connection.request('GET', f'/events?path={path}&version={version}')
+        response = connection.getresponse()
+        self.assertEqual(response.getheader('Content-Type'), 'text/event-stream')
+
+        def read():
+            lines = [response.readline().decode('utf-8') for _ in range(3)]
+            return lines[0][len('event: '):].strip(), json.loads(lines[1][len('data: '):])
+        return read
+
+    def test_edits_are_pushed_as_patches(self):
+        self.assertEqual(self.post('/documents', {'path': 'a.mhtml', 'text': '[p{one} p{two}]', 'version': 1})[0], 200)
+        self.connection.request('GET', '/preview?path=a.mhtml')
+        response = self.connection.getresponse()
+        page = response.read().decode('utf-8')
+        self.assertIn('EventSource("/events?path=a.mhtml&version=1")', page)
+        self.assertIn('>two</p>', page)
+        read = self.events('a.mhtml', 1)
+        status, _ = self.post('/edits', {'path': 'a.mhtml', 'from': 1, 'version': 2,
+                                         'changes': [{'offset': 10, 'length': 3, 'text': 'TWO'}]})
+        self.assertEqual(status, 200)
+        event, data = read()
+        self.assertEqual(event, 'patch')
+        self.assertEqual(data['version'], 2)
+        self.assertEqual([patch['html'] for patch in data['patches']], ['<p data-mh="3">TWO</p>'])
+        self.post('/edits', {'path': 'a.mhtml', 'from': 2, 'version': 3,
+                             'changes': [{'offset': 0, 'length': 0, 'text': '[s-x(style="bold")'},
+                                         {'offset': 0, 'length': 18, 'text': ''}]})
+        self.assertEqual(read(), ('page', {'version': 4}))
+
+    def test_out_of_date_editor(self):
+        self.post('/documents', {'path': 'a.mhtml', 'text': '[p{one}]', 'version': 5})
+        change = {'path': 'a.mhtml', 'from': 4, 'version': 6, 'changes': [{'offset': 0, 'length': 0, 'text': 'x'}]}
+        self.assertEqual(self.post('/edits', change)[0], 409)
+        change.update({'from': 5, 'changes': [{'offset': 50, 'length': 0, 'text': 'x'}]})
+        self.assertEqual(self.post('/edits', change)[0], 409)
+        change['from'] = 6
+        self.assertEqual(self.post('/edits', change)[0], 409)  # the failed request left no version
+        self.assertEqual(self.post('/edits', {'path': 'b.mhtml', 'from': 0, 'changes': []})[0], 404)
+        self.assertEqual(self.post('/documents', {'path': 'a.mhtml'})[0], 400)
+        # A preview opened before the last change reloads
+        read = self.events('a.mhtml', 0)
+        self.assertEqual(read()[0], 'page')
+
+    def test_main(self):
+        connection = http.client.HTTPConnection(run_command(self, 'minihtml.preview'))
+        self.addCleanup(connection.close)
+        connection.request('POST', '/documents', json.dumps({'path': 'a.mhtml', 'text': '[p{one}]', 'version': 1}),
+                           {'Content-Type': 'application/json'})
+        self.assertEqual(connection.getresponse().status, 200)
+
+class TestLimits(unittest.TestCase):
+    source = '[d[p{one}(id="a")\n  d[p{two}(id="b" lang="en")]]\n  p{three}]'
+
+    def compile(self, source, limits, spans=False):
+        parser = Parser(source, limits)
+        tokens = parser.tokenize_spans() if spans else parser.tokenize()
+        root = Compiler(tokens, limits=limits).compile()
+        return Compiler.compile_to_html(root, translation, styles, limits=limits)
+
+    def assertLimit(self, limit, source, limits, line=None, column=None, spans=False):
+        with self.assertRaises(LimitError) as caught:
+            self.compile(source, limits, spans)
+        error = caught.exception.locate(source)
+        self.assertEqual(error.limit, limit)
+        self.assertEqual((error.line, error.column), (line, column))
+        return error
+
+    def test_within_limits(self):
+        limits = Limits(input_bytes=len(self.source), tokens=16, nodes=5, depth=3, attributes=2, output_bytes=93,
+                        seconds=60)
+        for spans in (False, True):
+            self.assertEqual(self.compile(self.source, limits, spans), self.compile(self.source, None))
+
+    def test_errors_point_at_the_source(self):
+        for spans in (False, True):
+            self.assertLimit('tokens', self.source, Limits(tokens=5), 1, 11, spans)
+            self.assertLimit('nodes', self.source, Limits(nodes=4), 3, 3, spans)
+            self.assertLimit('depth', self.source, Limits(depth=2), 2, 5, spans)
+            self.assertLimit('attributes', self.source, Limits(attributes=1), 2, 12, spans)
+        error = self.assertLimit('input_bytes', 'p{é}' + self.source, Limits(input_bytes=4), 1, 4)
+        self.assertEqual(error.position, 3)  # é does not fit in the fourth byte
+        with map_source(__file__) as source:
+            with self.assertRaises(LimitError) as caught:
+                Parser(source, Limits(input_bytes=100)).tokenize_spans()
+            self.assertEqual(caught.exception.position, 100)
+        self.assertIn('line 2, column 5', str(self.assertLimit('depth', self.source, Limits(depth=2), 2, 5)))
+
+    def test_output_bytes(self):
+        self.assertLimit('output_bytes', self.source, Limits(output_bytes=40))
+        self.assertEqual(self.compile('[p{ééé}]', Limits(output_bytes=13)), '<p>ééé</p>')
+        self.assertLimit('output_bytes', '[p{ééé}]', Limits(output_bytes=12))  # 10 characters, 13 bytes
+
+    def test_clock(self):
+        expired = Limits(seconds=0).start()
+        source = '[' + 'p{a}' * 5000 + ']'
+        with self.assertRaises(LimitError) as caught:
+            Parser(source, expired).tokenize()
+        self.assertEqual((caught.exception.limit, caught.exception.position), ('seconds', 0))
+        tokens = Parser(source).tokenize()
+        with self.assertRaises(LimitError):
+            Compiler(tokens, limits=expired).compile()
+        root = Compiler(tokens).compile()
+        with self.assertRaises(LimitError):
+            Compiler.compile_to_html(root, translation, styles, limits=expired)
+        # Limits that were not started give each stage its own clock
+        self.assertTrue(Compiler.compile_to_html(root, translation, styles, limits=Limits(seconds=60)))
+
+    def test_clock_bounds_hostile_scans(self):
+        # Every token is scanned in time linear in its length, so the clock,
+        # read between runs of tokens, stops these in time or they finish
+        limits = Limits(seconds=0.05)
+        for source in ('[p{a}]' + ' ' * 50000, '[p{a}]' + '}' * 50000, '[p(' + '"' * 50000, '[p(' + '"a' * 25000 + ')',
+                       '(' * 50000, ' ' * 50000 + 'p', '[' + 'p{a} ' * 50000):
+            start = time.perf_counter()
+            try:
+                Parser(source, limits).tokenize()
+            except LimitError as e:
+                self.assertEqual(e.limit, 'seconds')
+            self.assertLess(time.perf_counter() - start, 0.5, repr(source[:20]))
+
+    def test_shared_subtrees_count_against_limits(self):
+        source = '[' + 'd[p{card}(class="c") p{text}]' * 2000 + ']'
+        tokens = Parser(source).tokenize()
+        table = SharedSubtrees()
+        root = Compiler(tokens, shared=table).compile()
+        html = Compiler.compile_to_html(root, translation, styles, shared=table)
+        self.assertEqual(Compiler.compile_to_html(root, translation, styles, shared=table,
+                                                  limits=Limits(output_bytes=len(html))), html)
+        with self.assertRaises(LimitError) as caught:
+            Compiler.compile_to_html(root, translation, styles, shared=table, limits=Limits(output_bytes=len(html) - 1))
+        self.assertEqual((caught.exception.limit, caught.exception.tag), ('output_bytes', 'd'))
+        # 6000 elements, though all but the first card are reused
+        with self.assertRaises(LimitError) as caught:
+            Compiler.compile_to_html(root, translation, styles, shared=table, limits=Limits(seconds=0).start())
+        self.assertEqual(caught.exception.limit, 'seconds')
+        self.assertGreater(table.reused, 0)
+
+    def test_fuzzed_sources_compile_or_stop(self):
+        rng = random.Random(7)
+        limits = Limits(input_bytes=2000, tokens=120, nodes=40, depth=6, attributes=3, output_bytes=3000)
+        for _ in range(300):
+            source = generate_document(nodes=rng.randint(1, 60), depth=rng.randint(1, 9), seed=rng.random())
+            source = ''.join(char for char in source if rng.random() > 0.02)  # unbalanced brackets and bodies
+            try:
+                expected = self.compile(source, None)
+            except StyleError:
+                expected = StyleError  # malformed directives fail the same way with or without limits
+            try:
+                html = self.compile(source, limits, spans=rng.random() < 0.5)
+            except LimitError as e:
+                self.assertIsNotNone(e.locate(source).limit)
+                continue
+            except StyleError:
+                html = StyleError
+            self.assertEqual(html, expected)
+
+    def test_batches(self):
+        results = batch.compile_many(['[p{a}]', '[d[d[p{deep}]]]', '[p{b}]'], translation, styles,
+                                     limits=Limits(depth=2))
+        self.assertEqual((results[0], results[2]), ('<p>a</p>', '<p>b</p>'))
+        self.assertEqual(str(results[1]), 'document 1: LimitError: depth limit of 2 exceeded at line 1, column 6')
+        with self.assertRaises(ValueError):
+            Compiler(Parser('[p]').tokenize(), limits=Limits()).compile(compact=True)
+
+class TestSharedSubtrees(unittest.TestCase):
+    translation = {'p': 'p', 'd': 'div', 'br': 'br'}
+    styles = {'bold': 'font-weight: bold', 'italic': 'font-style: italic'}
+
+    def compile(self, text, table):
+        return Compiler(Parser(text).tokenize(), shared=table).compile()
+
+    def assertSameHtml(self, text, table=None, **options):
+        # Rendered with the table as without it; returns the table
+        table = SharedSubtrees() if table is None else table
+        expected = Compiler.compile_to_html(Compiler(Parser(text).tokenize()).compile(), self.translation,
+                                            self.styles, **options)
+        self.assertEqual(Compiler.compile_to_html(self.compile(text, table), self.translation, self.styles,
+                                                  shared=table, **options), expected)
+        return table
+
+    def test_identical_subtrees_are_one_node(self):
+        table = SharedSubtrees()
+        root = self.compile('[d[p{a}(x="1") br()] d[p{a}(x="1") br()] br() p{a}(x="2") p{a}[br()]]', table)
+        first, second, br, other, parent = root.children
+        self.assertIs(first, second)
+        self.assertIs(br, first.children[1])
+        self.assertIsNot(other, first.children[0])
+        self.assertIs(parent.children[0], br)
+        self.assertEqual(table.stats()['nodes'], 10)
+        self.assertEqual(table.stats()['deduplicated'], 5)
+        root = self.compile('[p{a}(x="1" y="2") p{a}(y="2" x="1")]', SharedSubtrees())
+        self.assertIsNot(root.children[0], root.children[1])  # attribute order is part of the output
+
+    def test_cached_html_follows_class_definitions(self):
+        copy = 'd[p{a}(class="x y")]'
+        text = f'[{copy} s-x(style="bold") {copy} s-w(style="bold") {copy} s-z(style="italic") {copy} s-x(style="italic") {copy}]'
+        for options in ({}, {'minify': True}, {'stylesheet': Stylesheet()}):
+            table = self.assertSameHtml(text, **options)
+            self.assertEqual(table.reused, 2)  # after s-w and s-z, which the copies do not use
+
+    def test_subtrees_defining_classes_always_render(self):
+        table = self.assertSameHtml('[d[s-x(style="bold") p{a}(class="x")] p{b}(class="x") '
+                                    'd[s-x(style="bold") p{a}(class="x")]]')
+        self.assertEqual(table.stats()['repeated'], 3)
+        self.assertEqual(table.reused, 1)  # only the p inside the second d
+
+    def test_modes_that_change_the_tree(self):
+        with self.assertRaises(ValueError):
+            Compiler(Parser('[p{a}]').tokenize(), shared=SharedSubtrees()).compile(compact=True)
+        manager = passes.PassManager([passes.TreePass()])
+        with self.assertRaises(ValueError):
+            Compiler.compile_to_html(self.compile('[p{a}]', SharedSubtrees()), self.translation, self.styles,
+                                     passes=manager, shared=SharedSubtrees())
+        # Element passes may depend on where an element is: nothing is cached
+        count = []
+        manager = passes.PassManager()
+        manager.visitor(tags=('p',))(lambda tag, attributes, content: (tag, attributes, str(len(count.append(1) or count))))
+        table = SharedSubtrees()
+        html = Compiler.compile_to_html(self.compile('[d[p{a}] d[p{a}]]', table), self.translation, self.styles,
+                                        passes=manager, shared=table)
+        self.assertEqual(html, '<div><p>1</p></div><div><p>2</p></div>')
+
+class TestPasses(unittest.TestCase):
+    translation = {'p': 'p', 'd': 'div', 'l': 'a', 'note': 'aside'}
+    styles = {'bold': 'font-weight: bold', 'color': 'color: {}'}
+    source = '[s-x(style="bold") d[p{a}(class="x") l{home}(href="/index.mhtml") note{b}(style="color(red)")]]'
+
+    def render(self, text, manager=None, flat=False):
+        root = Compiler(Parser(text).tokenize()).compile(compact=flat)
+        return Compiler.compile_to_html(root, self.translation, self.styles, passes=manager)
+
+    def test_no_passes_match_default(self):
+        expected = self.render(self.source)
+        self.assertEqual(self.render(self.source, passes.PassManager()), expected)
+        self.assertEqual(self.render(self.source, passes.PassManager(timed=True), flat=True), expected)
+
+    def test_element_passes_share_the_walk(self):
+        manager = passes.PassManager()
+
+        @manager.visitor(tags=('l',))
+        def links(tag, attributes, content):
+            return tag, dict(attributes, href=attributes['href'].replace('.mhtml', '.html')), content
+
+        @manager.visitor()
+        def language(tag, attributes, content):
+            return tag, dict(attributes, lang='en') if tag == 'd' else attributes, content
+
+        self.assertEqual(self.render(self.source, manager),
+                         '<div lang="en"><p class="x" style="font-weight: bold">a</p><a href="/index.html">home</a>'
+                         '<aside style="color: red">b</aside></div>')
+
+    def test_renamed_element_goes_through_passes_of_its_new_tag(self):
+        manager = passes.PassManager()
+        manager.visitor(tags=('note',))(lambda tag, attributes, content: ('d', dict(attributes, role='note'), content))
+        manager.visitor(tags=('d',), name='seen')(lambda tag, attributes, content: (tag, attributes, content + '!'))
+        manager.add(passes.TagMap({'d': 'section'}))
+        self.assertEqual(self.render('[note{b}(class="x") d{c}]', manager),
+                         '<section class="x" role="note">b!</section><section>c!</section>')
+
+    def test_raw_html_and_dropped_elements(self):
+        manager = passes.PassManager()
+        manager.visitor(tags=('d',))(lambda tag, attributes, content: '<hr>')
+        manager.visitor(tags=('p',))(lambda tag, attributes, content: None if content == 'drop' else
+                                     (tag, attributes, content))
+        self.assertEqual(self.render('[d[p{kept}] p{drop}[p{child}] p{b}]', manager), '<hr><p>kept</p><p>b</p>')
+
+    def test_tree_pass_and_streaming(self):
+        class Headings(passes.TreePass):
+            name = 'headings'
+
+            def run(self, root):
+                count = Node()
+                count.tag, count.content = 'p', str(len(root.children))
+                root.children.insert(0, count)
+
+        manager = passes.PassManager([Headings()], timed=True)
+        self.assertEqual(self.render('[p{a} p{b}]', manager, flat=True), '<p>2</p><p>a</p><p>b</p>')
+        self.assertEqual(set(manager.report()), {'headings', 'classes'})
+        self.assertEqual(manager.report()['classes']['elements'], 3)
+        with self.assertRaises(ValueError):
+            ''.join(iter_html(['[p{a}]'], self.translation, self.styles, passes=manager))
+
+        streamed = passes.PassManager()
+        streamed.visitor(tags=('p',))(lambda tag, attributes, content: (tag, attributes, content.upper()))
+        self.assertEqual(''.join(iter_html(['[p{a}', ' d[p{b}]]'], self.translation, self.styles,
+                                           passes=streamed)), '<p>A</p><div><p>B</p></div>')
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,111 @@
+const http = require("http");
+const vscode = require("vscode");
+
+// Live preview: posts MiniHTML documents to `minihtml preview` and then
+// each change to them, so the server only parses the edited element again
+// and patches the open preview. Requests go out one at a time, in order.
+
+const SURROGATE = /[\uD800-\uDFFF]/;
+
+function activate(context) {
+  const posted = new Map(); // document URI -> editor version the server has
+  const astral = new Set(); // URIs of documents with characters outside the BMP
+  let queue = Promise.resolve();
+
+  function server() {
+    return vscode.workspace.getConfiguration("minihtml").get("previewUrl");
+  }
+
+  function post(route, body) {
+    // Resolves to the status code, 0 when the server cannot be reached
+    return new Promise((resolve) => {
+      const data = Buffer.from(JSON.stringify(body));
+      const request = http.request(new URL(route, server()), {
+        method: "POST",
+        headers: { "Content-Type": "application/json", "Content-Length": data.length },
+      }, (response) => {
+        response.resume();
+        response.on("end", () => resolve(response.statusCode));
+      });
+      request.on("error", () => resolve(0));
+      request.end(data);
+    });
+  }
+
+  function send(document) {
+    const key = document.uri.toString();
+    const version = document.version;
+    const text = document.getText();
+    if (SURROGATE.test(text)) {
+      astral.add(key);
+    } else {
+      astral.delete(key);
+    }
+    return post("/documents", { path: document.fileName, version, text }).then((status) => {
+      if (status === 200) {
+        posted.set(key, version);
+      } else {
+        posted.delete(key);
+      }
+      return status;
+    });
+  }
+
+  function changed(event) {
+    const document = event.document;
+    const key = document.uri.toString();
+    if (!posted.has(key) || event.contentChanges.length === 0) {
+      return;
+    }
+    const version = document.version;
+    const changes = event.contentChanges.map((change) => ({
+      offset: change.rangeOffset, length: change.rangeLength, text: change.text,
+    }));
+    queue = queue.then(() => {
+      const from = posted.get(key);
+      if (from === undefined || from >= version) {
+        return; // not previewed, or already sent with the whole text
+      }
+      // The server counts code points and VS Code UTF-16 units: they only
+      // differ with surrogate pairs, and then the whole text is sent
+      if (astral.has(key) || changes.some((change) => SURROGATE.test(change.text))) {
+        return send(document);
+      }
+      return post("/edits", { path: document.fileName, from, version, changes }).then((status) => {
+        if (status === 200) {
+          posted.set(key, version);
+        } else if (status !== 0) {
+          return send(document);
+        }
+      });
+    });
+  }
+
+  function open() {
+    const editor = vscode.window.activeTextEditor;
+    if (!editor || editor.document.languageId !== "minihtml") {
+      vscode.window.showInformationMessage("Open a MiniHTML file to preview it.");
+      return;
+    }
+    const document = editor.document;
+    queue = queue.then(() => send(document)).then((status) => {
+      if (status !== 200) {
+        vscode.window.showErrorMessage(`No preview server at ${server()}. Start one with: minihtml preview`);
+        return;
+      }
+      const url = new URL("/preview", server());
+      url.searchParams.set("path", document.fileName);
+      vscode.env.openExternal(vscode.Uri.parse(url.toString()));
+    });
+  }
+
+  context.subscriptions.push(
+    vscode.commands.registerCommand("minihtml.preview", open),
+    vscode.workspace.onDidChangeTextDocument(changed),
+    vscode.workspace.onDidCloseTextDocument((document) => posted.delete(document.uri.toString())),
+  );
+}
+
+function deactivate() {}
+
+module.exports = { activate, deactivate };